@@ -0,0 +1,137 @@
+"""Compare the compile, simulation and gradient times of control encodings.
+
+Run from this directory, e.g.
+    python benchmark_encodings.py
+
+Problems with timecourse conditions are converted to events with
+`petab_timecourse` before they are compiled, as in `doc/examples/simple_example_distilled.py`.
+"""
+from pathlib import Path
+import tempfile
+import time
+from typing import Any, Dict, Tuple
+
+import amici
+import amici.petab_import
+import amici.petab_objective
+import numpy as np
+import petab
+import petab_timecourse
+
+import petab_control
+
+
+INPUT_PATH = (
+    Path(__file__).resolve().parent.parent
+    / 'doc' / 'examples' / 'input' / 'optimize_then_control' / 'petab'
+)
+TIMECOURSE_ID = 'timecourse1'
+UNSCALED_PARAMETERS0 = {'decay': 0.5, 'substrate0': 1.0}
+N_REPEATS = 10
+
+
+def get_petab_problem(encoding: str) -> petab.Problem:
+    petab_problem0 = petab_timecourse.Problem.from_yaml(
+        str(INPUT_PATH / 'estimate' / 'petab_problem.yaml'),
+    )
+    petab_control_problem = petab_control.Problem.from_yaml(
+        yaml_path=INPUT_PATH / 'control' / 'petab_control_problem.yaml',
+    )
+    petab_problem = petab_control.get_control_events_petab_problem(
+        petab_control_problem=petab_control_problem,
+        petab_problem=petab_problem0,
+        unscaled_parameters0=UNSCALED_PARAMETERS0,
+        timecourse_id=TIMECOURSE_ID,
+        consolidate_events=True,
+        encoding=encoding,
+    )
+    if petab_problem.timecourse_df is not None:
+        petab_problem.model = petab.models.sbml_model.SbmlModel(
+            petab_timecourse.sbml.add_timecourse_as_events(
+                petab_problem=petab_problem,
+                timecourse_id=TIMECOURSE_ID,
+            )
+        )
+        petab_problem.condition_df = petab_problem.condition_df.loc[
+            [TIMECOURSE_ID]
+        ].dropna(axis=1, how='all')
+        petab_problem.timecourse_df = None
+        petab_problem.extensions_config = None
+    return petab_problem
+
+
+def time_simulation(
+    petab_problem: petab.Problem,
+    amici_model: amici.Model,
+    sensitivities: bool,
+) -> Tuple[float, Dict[str, Any]]:
+    amici_solver = amici_model.getSolver()
+    if sensitivities:
+        amici_solver.setSensitivityOrder(amici.SensitivityOrder.first)
+    problem_parameters = dict(zip(
+        petab_problem.x_free_ids,
+        petab_problem.x_nominal_free_scaled,
+    ))
+    start = time.perf_counter()
+    for _ in range(N_REPEATS):
+        result = amici.petab_objective.simulate_petab(
+            petab_problem=petab_problem,
+            amici_model=amici_model,
+            solver=amici_solver,
+            problem_parameters=problem_parameters,
+            scaled_parameters=True,
+        )
+    duration = (time.perf_counter() - start) / N_REPEATS
+    return duration, result
+
+
+def main():
+    results = {}
+    for encoding in petab_control.ENCODINGS:
+        petab_problem = get_petab_problem(encoding)
+
+        with tempfile.TemporaryDirectory() as model_output_dir:
+            start = time.perf_counter()
+            amici_model = amici.petab_import.import_petab_problem(
+                petab_problem,
+                model_output_dir=model_output_dir,
+                force_compile=True,
+            )
+            compile_time = time.perf_counter() - start
+
+            simulation_time, result = time_simulation(
+                petab_problem=petab_problem,
+                amici_model=amici_model,
+                sensitivities=False,
+            )
+            gradient_time, _ = time_simulation(
+                petab_problem=petab_problem,
+                amici_model=amici_model,
+                sensitivities=True,
+            )
+        results[encoding] = (
+            compile_time,
+            simulation_time,
+            gradient_time,
+            result[petab_control.LLH],
+        )
+
+    print(
+        f'{"encoding":<20}{"compile [s]":>14}{"simulation [s]":>16}'
+        f'{"gradient [s]":>14}{"llh":>14}'
+    )
+    for encoding, (compile_time, simulation_time, gradient_time, llh) \
+            in results.items():
+        print(
+            f'{encoding:<20}{compile_time:>14.3f}{simulation_time:>16.5f}'
+            f'{gradient_time:>14.5f}{llh:>14.6g}'
+        )
+
+    # All encodings describe the same problem.
+    llhs = [result[-1] for result in results.values()]
+    if not np.allclose(llhs, llhs[0]):
+        print('Warning: the encodings have different likelihoods.')
+
+
+if __name__ == '__main__':
+    main()
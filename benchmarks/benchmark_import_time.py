@@ -0,0 +1,86 @@
+"""Time imports of this package, and check that they stay lean.
+
+Run from this directory, e.g.
+    python benchmark_import_time.py
+
+Each import is timed in a fresh interpreter. The script exits with an error
+if an import loads one of the dependencies that it should not load, or takes
+longer than its limit.
+"""
+import json
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+
+N_REPEATS = 5
+
+# Statement, modules that must not be imported, and the time limit [s].
+IMPORTS: List[Tuple[str, List[str], float]] = [
+    (
+        'import petab_control',
+        [
+            'amici',
+            'libsbml',
+            'pandas',
+            'petab',
+            'petab_timecourse',
+            'pypesto',
+            'yaml',
+        ],
+        0.1,
+    ),
+    (
+        'import petab_control.objective',
+        ['amici', 'libsbml', 'pandas', 'petab', 'pypesto'],
+        1.0,
+    ),
+]
+
+SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+{statement}
+duration = time.perf_counter() - start
+print(json.dumps({{
+    'duration': duration,
+    'modules': sorted({{name.split('.')[0] for name in sys.modules}}),
+}}))
+'''
+
+
+def time_import(statement: str) -> Dict:
+    output = subprocess.run(
+        [sys.executable, '-c', SCRIPT.format(statement=statement)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    failures = []
+    print(f'{"statement":<36}{"median [s]":>12}  forbidden modules')
+    for statement, forbidden_modules, limit in IMPORTS:
+        results = [time_import(statement) for _ in range(N_REPEATS)]
+        durations = sorted(result['duration'] for result in results)
+        median = durations[len(durations) // 2]
+        imported = sorted(
+            set(forbidden_modules).intersection(results[0]['modules'])
+        )
+        print(f'{statement:<36}{median:>12.4f}  {imported or "-"}')
+
+        if imported:
+            failures.append(f'`{statement}` imports {imported}.')
+        if median > limit:
+            failures.append(
+                f'`{statement}` took {median:.4f} s. Limit: {limit} s.'
+            )
+
+    if failures:
+        sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Compare gradient times of forward and adjoint sensitivities.
+
+Run from this directory, e.g.
+    python benchmark_sensitivity_methods.py
+
+The controls of the bundled `optimize_then_control` example are replaced by
+schedules with increasing numbers of estimated controls. Each schedule is
+encoded as events, as in `petab_control.get_pypesto_problem` with adjoint
+sensitivities, and its gradient is timed with both sensitivity methods. The
+crossover point is the smallest ratio of estimated parameters to states where
+adjoint sensitivities are faster, which is the basis of
+`petab_control.ADJOINT_PARAMETER_STATE_RATIO`.
+"""
+from pathlib import Path
+import tempfile
+import time
+
+import amici
+import amici.petab_import
+import amici.petab_objective
+import numpy as np
+import pandas as pd
+import petab
+import petab_timecourse
+
+import petab_control
+
+
+INPUT_PATH = (
+    Path(__file__).resolve().parent.parent
+    / 'doc' / 'examples' / 'input' / 'optimize_then_control' / 'petab'
+)
+TIMECOURSE_ID = 'timecourse1'
+UNSCALED_PARAMETERS0 = {'decay': 0.5, 'substrate0': 1.0}
+CONTROL_END_TIME = 80
+N_CONTROLS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+N_REPEATS = 5
+
+
+def get_petab_problem(n_controls: int) -> petab.Problem:
+    petab_problem0 = petab_timecourse.Problem.from_yaml(
+        str(INPUT_PATH / 'estimate' / 'petab_problem.yaml'),
+    )
+    petab_control_problem = petab_control.Problem.from_yaml(
+        yaml_path=INPUT_PATH / 'control' / 'petab_control_problem.yaml',
+    )
+    times = np.linspace(0, CONTROL_END_TIME, n_controls, endpoint=False)
+    petab_control_problem.control_df = pd.DataFrame({
+        petab_control.CONTROL_ID: [
+            f'influx_{control_index}'
+            for control_index in range(n_controls)
+        ],
+        petab_control.PARAMETER_ID: 'influx',
+        petab_control.TIME: times,
+        petab_control.VALUE: petab_control.ESTIMATE,
+    })
+    petab_problem = petab_control.get_control_events_petab_problem(
+        petab_control_problem=petab_control_problem,
+        petab_problem=petab_problem0,
+        unscaled_parameters0=UNSCALED_PARAMETERS0,
+        timecourse_id=TIMECOURSE_ID,
+        consolidate_events=True,
+        encoding=petab_control.ENCODING_EVENTS,
+    )
+    return petab_problem
+
+
+def time_gradient(
+    petab_problem: petab.Problem,
+    amici_model: amici.Model,
+    sensitivity_method: amici.SensitivityMethod,
+) -> float:
+    amici_solver = amici_model.getSolver()
+    amici_solver.setSensitivityOrder(amici.SensitivityOrder.first)
+    amici_solver.setSensitivityMethod(sensitivity_method)
+    problem_parameters = dict(zip(
+        petab_problem.x_free_ids,
+        petab_problem.x_nominal_free_scaled,
+    ))
+    start = time.perf_counter()
+    for _ in range(N_REPEATS):
+        amici.petab_objective.simulate_petab(
+            petab_problem=petab_problem,
+            amici_model=amici_model,
+            solver=amici_solver,
+            problem_parameters=problem_parameters,
+            scaled_parameters=True,
+        )
+    return (time.perf_counter() - start) / N_REPEATS
+
+
+def main():
+    results = []
+    for n_controls in N_CONTROLS:
+        petab_problem = get_petab_problem(n_controls)
+        with tempfile.TemporaryDirectory() as model_output_dir:
+            amici_model = amici.petab_import.import_petab_problem(
+                petab_problem,
+                model_output_dir=model_output_dir,
+                force_compile=True,
+            )
+            n_states = len(amici_model.getStateIds())
+            forward_time = time_gradient(
+                petab_problem=petab_problem,
+                amici_model=amici_model,
+                sensitivity_method=amici.SensitivityMethod.forward,
+            )
+            adjoint_time = time_gradient(
+                petab_problem=petab_problem,
+                amici_model=amici_model,
+                sensitivity_method=amici.SensitivityMethod.adjoint,
+            )
+        results.append((
+            n_controls,
+            n_controls / n_states,
+            forward_time,
+            adjoint_time,
+        ))
+
+    print(
+        f'{"controls":<10}{"controls/states":>16}'
+        f'{"forward [s]":>14}{"adjoint [s]":>14}'
+    )
+    for n_controls, ratio, forward_time, adjoint_time in results:
+        print(
+            f'{n_controls:<10}{ratio:>16.2f}'
+            f'{forward_time:>14.5f}{adjoint_time:>14.5f}'
+        )
+
+    crossover_ratios = [
+        ratio
+        for _, ratio, forward_time, adjoint_time in results
+        if adjoint_time < forward_time
+    ]
+    if crossover_ratios:
+        print(
+            'Adjoint sensitivities are faster from a ratio of estimated '
+            f'parameters to states of {min(crossover_ratios):.2f}. Current '
+            '`ADJOINT_PARAMETER_STATE_RATIO`: '
+            f'{petab_control.ADJOINT_PARAMETER_STATE_RATIO}.'
+        )
+    else:
+        print('Forward sensitivities were faster for all schedules.')
+
+
+if __name__ == '__main__':
+    main()
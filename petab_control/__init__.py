@@ -1,8 +1,96 @@
+import importlib
+
+from . import constants
 from .constants import *
-from .controls import get_control_df
-from .misc import (
-    add_estimate,
-    add_estimate_from_pypesto_result,
-)
-from .problem import *
+
+# Public names are loaded on first access, such that importing this package
+# does not import heavy dependencies (e.g. libsbml, pandas, petab), which
+# matters for worker processes that only use some submodules.
+SUBMODULES = {
+    'cache',
+    'constants',
+    'control',
+    'controls',
+    'misc',
+    'objective',
+    'periods',
+    'petab',
+    'petab_problem',
+    'problem',
+    'pypesto',
+    'receding_horizon',
+    'sbml',
+    'simulator',
+    'version',
+}
+# The modules of public names that are not in `problem`.
+LAZY_ATTRIBUTE_MODULES = {
+    'get_control_df': 'controls',
+    'add_estimate': 'misc',
+    'add_estimate_from_pypesto_result': 'misc',
+}
+# The public names of `problem`, listed here such that `__all__` does not
+# require importing `problem`.
+PROBLEM_ATTRIBUTES = {
+    'Control',
+    'LazyProblems',
+    'ParameterControl',
+    'ParameterControlSlot',
+    'ParameterTarget',
+    'PeriodsParameters',
+    'Problem',
+    'SpeciesTarget',
+    'StateTarget',
+    'Target',
+    'Timepoints',
+    'Values',
+    'add_condition_events',
+    'add_control_events',
+    'concat_tables',
+    'get_cached_control_events_petab_problem',
+    'get_control_events_petab_problem',
+    'get_control_petab_problem',
+    'get_control_petab_timecourse_problem',
+    'get_period_id',
+    'get_period_start_times',
+    'get_start_time',
+    'get_structural_control_petab_problem',
+    'read_problem_dicts',
+}
 #from . import objective
+
+__all__ = sorted({
+    *(name for name in vars(constants) if name.isupper()),
+    *LAZY_ATTRIBUTE_MODULES,
+    *PROBLEM_ATTRIBUTES,
+})
+
+
+def __getattr__(name: str):
+    if name in SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    if name.startswith('_'):
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    module = importlib.import_module(
+        f'.{LAZY_ATTRIBUTE_MODULES.get(name, "problem")}',
+        __name__,
+    )
+    try:
+        value = getattr(module, name)
+    except AttributeError:
+        raise AttributeError(
+            f'module {__name__!r} has no attribute {name!r}'
+        ) from None
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    problem = importlib.import_module('.problem', __name__)
+    return sorted({
+        *globals(),
+        *SUBMODULES,
+        *LAZY_ATTRIBUTE_MODULES,
+        *(name for name in dir(problem) if not name.startswith('_')),
+    })
@@ -0,0 +1,282 @@
+"""Opt-in on-disk caches of parsed and generated problems.
+
+Cache entries are directories, named by a hash of the contents of the input
+files and of the options that the cached object was created with. Entries
+are never modified, so changed inputs produce a new entry, and stale entries
+can be deleted at any time.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import libsbml
+import pandas as pd
+import petab
+from petab.models.sbml_model import SbmlModel
+import yaml
+
+from .constants import TYPE_PATH
+from .version import __version__
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+PARQUET_SUFFIX = '.parquet'
+PICKLE_SUFFIX = '.pkl'
+YAML_SUFFIXES = ('.yaml', '.yml')
+METADATA_FILENAME = 'metadata.yaml'
+SBML_FILENAME = 'model.xml'
+
+# The tables of a `petab.Problem`, by attribute name.
+PETAB_TABLES = [
+    'condition_df',
+    'measurement_df',
+    'observable_df',
+    'parameter_df',
+    'visualization_df',
+    'mapping_df',
+    # `petab_timecourse.Problem`
+    'timecourse_df',
+]
+
+
+def get_referenced_paths(yaml_path: TYPE_PATH) -> List[Path]:
+    """Get a YAML file and all files that it references.
+
+    Any string in the YAML file that is the path of an existing file,
+    relative to the directory of the YAML file, is a reference. Referenced
+    YAML files are searched for references too, e.g. the PEtab YAML file of
+    a control problem.
+
+    Args:
+        yaml_path:
+            The YAML file.
+
+    Returns:
+        The YAML file, then the referenced files in order of appearance.
+        The references of a referenced YAML file directly follow it.
+    """
+    paths = []
+    # Resolved paths, such that cyclic references are only followed once.
+    resolved_paths = set()
+
+    def add_path(path: Path) -> None:
+        paths.append(path)
+        resolved_paths.add(path.resolve())
+
+    def add_yaml_references(yaml_path: Path) -> None:
+        add_path(yaml_path)
+        with open(yaml_path, 'r') as f:
+            yaml_dict = yaml.safe_load(f)
+        add_references(yaml_dict, yaml_path.parent)
+
+    def add_references(node: Any, directory: Path) -> None:
+        if isinstance(node, dict):
+            for child in node.values():
+                add_references(child, directory)
+        elif isinstance(node, list):
+            for child in node:
+                add_references(child, directory)
+        elif isinstance(node, str):
+            path = directory / node
+            if not path.is_file() or path.resolve() in resolved_paths:
+                return
+            if path.suffix in YAML_SUFFIXES:
+                add_yaml_references(path)
+            else:
+                add_path(path)
+
+    add_yaml_references(Path(yaml_path))
+    return paths
+
+
+def get_files_hash(yaml_paths: Sequence[TYPE_PATH], **options) -> str:
+    """Get a hash of YAML files, their referenced files, and options.
+
+    The version of this package is included, such that cached objects are
+    recreated after updates.
+
+    Args:
+        yaml_paths:
+            The YAML files.
+        **options:
+            Any JSON-serializable options that the cached object depends on.
+
+    Returns:
+        The hash, as a hexadecimal string.
+    """
+    sha256 = hashlib.sha256(__version__.encode())
+    for yaml_path in yaml_paths:
+        for path in get_referenced_paths(yaml_path):
+            sha256.update(path.name.encode())
+            sha256.update(path.read_bytes())
+    sha256.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return sha256.hexdigest()
+
+
+def write_tables(
+    directory: TYPE_PATH,
+    tables: Dict[str, Optional[pd.DataFrame]],
+) -> None:
+    """Write tables in a binary format.
+
+    Tables are written as Parquet files if `pyarrow` is installed, else, or
+    if a table cannot be stored as Parquet (e.g. columns with both numbers
+    and strings), as pickle files.
+
+    Args:
+        directory:
+            The directory to write the tables to.
+        tables:
+            Keys are table names, values are the tables. `None` tables are
+            skipped.
+    """
+    directory = Path(directory)
+    for name, table in tables.items():
+        if table is None:
+            continue
+        if pyarrow is not None:
+            try:
+                table.to_parquet(directory / f'{name}{PARQUET_SUFFIX}')
+                continue
+            except (pyarrow.ArrowException, TypeError, ValueError):
+                (directory / f'{name}{PARQUET_SUFFIX}').unlink(
+                    missing_ok=True,
+                )
+        table.to_pickle(directory / f'{name}{PICKLE_SUFFIX}')
+
+
+def read_tables(directory: TYPE_PATH) -> Dict[str, pd.DataFrame]:
+    """Read tables that were written with `write_tables`.
+
+    Args:
+        directory:
+            The directory with the tables.
+
+    Returns:
+        Keys are table names, values are the tables.
+    """
+    tables = {}
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix == PARQUET_SUFFIX:
+            tables[path.stem] = pd.read_parquet(path)
+        elif path.suffix == PICKLE_SUFFIX:
+            tables[path.stem] = pd.read_pickle(path)
+    return tables
+
+
+def write_petab_problem(
+    petab_problem: petab.Problem,
+    directory: TYPE_PATH,
+) -> None:
+    """Write a PEtab problem with an SBML model to a cache entry.
+
+    Args:
+        petab_problem:
+            The PEtab problem.
+        directory:
+            The directory of the cache entry.
+    """
+    directory = Path(directory)
+    libsbml.writeSBMLToFile(
+        petab_problem.sbml_document,
+        str(directory / SBML_FILENAME),
+    )
+    write_tables(directory, {
+        name: getattr(petab_problem, name, None)
+        for name in PETAB_TABLES
+    })
+    with open(directory / METADATA_FILENAME, 'w') as f:
+        yaml.safe_dump({
+            'model_id': petab_problem.model.model_id,
+            'extensions_config': petab_problem.extensions_config,
+        }, f)
+
+
+def read_petab_problem(
+    directory: TYPE_PATH,
+    petab_problem_class: type = petab.Problem,
+) -> petab.Problem:
+    """Read a PEtab problem that was written with `write_petab_problem`.
+
+    Args:
+        directory:
+            The directory of the cache entry.
+        petab_problem_class:
+            The class of the PEtab problem, e.g. `petab_timecourse.Problem`.
+
+    Returns:
+        The PEtab problem.
+    """
+    directory = Path(directory)
+    with open(directory / METADATA_FILENAME, 'r') as f:
+        metadata = yaml.safe_load(f)
+    sbml_document = libsbml.readSBMLFromFile(str(directory / SBML_FILENAME))
+    tables = read_tables(directory)
+    timecourse_df = tables.pop('timecourse_df', None)
+    petab_problem = petab_problem_class(
+        model=SbmlModel(
+            sbml_model=sbml_document.getModel(),
+            sbml_document=sbml_document,
+            model_id=metadata['model_id'],
+        ),
+        extensions_config=metadata['extensions_config'],
+        **tables,
+    )
+    if timecourse_df is not None or hasattr(petab_problem, 'timecourse_df'):
+        petab_problem.timecourse_df = timecourse_df
+    return petab_problem
+
+
+def get_cached(
+    cache_dir: TYPE_PATH,
+    key: str,
+    create: Callable[[], Any],
+    write: Callable[[Any, Path], None],
+    read: Callable[[Path], Any],
+) -> Any:
+    """Get an object from a cache, or create and cache it.
+
+    Entries are first written to a temporary directory, then renamed, so
+    concurrent processes never read incomplete entries.
+
+    Args:
+        cache_dir:
+            The cache directory.
+        key:
+            The key of the object, e.g. from `get_files_hash`.
+        create:
+            Creates the object, if it is not cached.
+        write:
+            Writes the object to an empty entry directory.
+        read:
+            Reads the object from its entry directory.
+
+    Returns:
+        The object.
+    """
+    cache_dir = Path(cache_dir)
+    entry_dir = cache_dir / key
+    if entry_dir.is_dir():
+        return read(entry_dir)
+
+    obj = create()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    temporary_dir = Path(tempfile.mkdtemp(dir=cache_dir, prefix=f'.{key}.'))
+    try:
+        write(obj, temporary_dir)
+        os.rename(temporary_dir, entry_dir)
+    except OSError:
+        # Another process wrote the entry first.
+        if not entry_dir.is_dir():
+            raise
+    finally:
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+    return obj
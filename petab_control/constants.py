@@ -23,10 +23,11 @@ VALUE = 'value'
 
 CONTROL_FILES = 'control_files'
 CONTROL_PARAMETER_FILES = 'control_parameter_files'
-from petab.C import (
-    MEASUREMENT_FILES,
-    OBSERVABLE_FILES,
-)
+# As in `petab.C`. Defined here such that importing this package does not
+# import `petab`.
+MEASUREMENT_FILES = 'measurement_files'
+OBSERVABLE_FILES = 'observable_files'
+PARAMETER_ID = 'parameterId'
 
 LAST_MEASURED_TIMEPOINT = 'last_measured_timepoint'
 
@@ -43,6 +44,61 @@ CONTROL_TIMECOURSE_ID = 'control_timecourse_id'
 PERIODS = 'periods'
 PERIODS_RESULTS = 'periods_results'
 
+# Simulation result keys, as in `amici.petab_objective`.
+LLH = 'llh'
+SLLH = 'sllh'
+RDATAS = 'rdatas'
+# The state and state sensitivities at the end of a period, e.g. in lean
+# results without `RDATAS`.
+FINAL_STATE = 'final_state'
+
+# Objective result keys, as in `pypesto.C`.
+FVAL = 'fval'
+GRAD = 'grad'
+HESS = 'hess'
+RES = 'res'
+SRES = 'sres'
+
+# Encodings of the controls in the PEtab problem.
+# Controls are SBML events that assign the control parameters.
+ENCODING_EVENTS = 'events'
+# Controls are PEtab timecourse conditions.
+ENCODING_TIMECOURSE = 'timecourse'
+# Controls are SBML events that toggle switch parameters, and the controlled
+# parameter is assigned as the sum of switches multiplied by control values.
+ENCODING_SWITCHES = 'switches'
+# As `ENCODING_SWITCHES`, but the switch parameters are set by PEtab
+# timecourse conditions.
+ENCODING_SWITCH_CONDITIONS = 'switch_conditions'
+ENCODINGS = [
+    ENCODING_EVENTS,
+    ENCODING_TIMECOURSE,
+    ENCODING_SWITCHES,
+    ENCODING_SWITCH_CONDITIONS,
+]
+
+# Methods to compute the gradient of the control objective.
+# Forward sensitivities of each period of the control timecourse.
+SENSITIVITY_METHOD_FORWARD = 'forward'
+# Adjoint sensitivities of the events-encoded problem.
+SENSITIVITY_METHOD_ADJOINT = 'adjoint'
+# Adjoint if there are many more estimated parameters than states, else
+# forward.
+SENSITIVITY_METHOD_AUTO = 'auto'
+SENSITIVITY_METHODS = [
+    SENSITIVITY_METHOD_FORWARD,
+    SENSITIVITY_METHOD_ADJOINT,
+    SENSITIVITY_METHOD_AUTO,
+]
+# `SENSITIVITY_METHOD_AUTO` chooses adjoint sensitivities if the number of
+# estimated parameters exceeds this multiple of the number of states. See
+# `benchmarks/benchmark_sensitivity_methods.py`.
+ADJOINT_PARAMETER_STATE_RATIO = 2
+
+# Kinds of objects in the on-disk cache.
+PETAB_CONTROL_PROBLEM = 'petab_control_problem'
+ENCODED_PETAB_PROBLEM = 'encoded_petab_problem'
+
 CATEGORY = 'category'
 # FIXME better name for the original PEtab problem without optimal control
 # added to it?
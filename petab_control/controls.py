@@ -1,9 +1,277 @@
+from functools import cached_property
+import sys
+from typing import Dict, Sequence, Union
+
+import numpy as np
 import pandas as pd
+from petab.C import (
+    PARAMETER_ID,
+    TIME,
+)
+from petab_timecourse.sbml import get_slug
 
-from .constants import CONTROL_ID
+from .constants import (
+    CONTROL_ID,
+    ESTIMATE,
+    VALUE,
+)
 
 
 def get_control_df(df) -> pd.DataFrame:
     df = pd.DataFrame(df)
     df = df.set_index(CONTROL_ID)
     return df
+
+
+def get_control_order(control_df: pd.DataFrame) -> np.ndarray:
+    """Get the order of controls that groups them by target.
+
+    Args:
+        control_df:
+            The controls table.
+
+    Returns:
+        The row indices of the controls, grouped by target in order of first
+        appearance, as in `ControlSet.from_control_df`.
+    """
+    return np.argsort(
+        pd.factorize(control_df[PARAMETER_ID].to_numpy())[0],
+        kind='stable',
+    )
+
+
+class ControlSet():
+    """Controls of parameters, stored as arrays.
+
+    All encodings of a control problem are built from a `ControlSet`, which
+    is also the only lookup of the active controls at some time (see
+    `get_active_indices`). IDs are generated once for all controls, with one
+    slug per distinct time and value, and match the IDs of the equivalent
+    `ParameterControl` objects, which `from_parameter_controls` accepts.
+
+    Attributes:
+        target_ids:
+            The IDs of the controlled parameters, in order of first
+            appearance.
+        target_indices:
+            The index in `target_ids` of the target of each control.
+        times:
+            The time of each control.
+        values:
+            The value of each control, which is a number or `ESTIMATE`.
+        estimate:
+            Whether each control is estimated.
+    """
+    def __init__(
+        self,
+        target_ids: Sequence[str],
+        times: Sequence[float],
+        values: Sequence,
+    ):
+        """Store the controls.
+
+        Args:
+            target_ids:
+                The ID of the controlled parameter of each control.
+            times:
+                The time of each control.
+            values:
+                The value of each control.
+        """
+        target_indices, unique_target_ids = pd.factorize(
+            np.asarray(target_ids, dtype=object)
+        )
+        self.target_ids = [sys.intern(str(t)) for t in unique_target_ids]
+        self.target_indices = target_indices
+        self.times = np.asarray(times, dtype=float)
+        self.values = np.asarray(values, dtype=object)
+        self.estimate = np.array(
+            [value == ESTIMATE for value in self.values],
+            dtype=bool,
+        )
+
+    @staticmethod
+    def from_control_df(
+        control_df: pd.DataFrame,
+        start_time: float = 0,
+    ) -> 'ControlSet':
+        """Create controls from a PEtab Control controls table.
+
+        Args:
+            control_df:
+                The controls table.
+            start_time:
+                Added to the control times.
+
+        Returns:
+            The controls, grouped by target in order of first appearance.
+        """
+        order = get_control_order(control_df)
+        return ControlSet(
+            target_ids=control_df[PARAMETER_ID].to_numpy()[order],
+            times=control_df[TIME].to_numpy(dtype=float)[order] + start_time,
+            values=control_df[VALUE].to_numpy()[order],
+        )
+
+    @staticmethod
+    def from_parameter_controls(
+        parameter_controls: Dict[str, Sequence['ParameterControl']],
+    ) -> 'ControlSet':
+        """Create controls from `ParameterControl` objects.
+
+        Args:
+            parameter_controls:
+                Keys are parameter IDs, values are the controls of the
+                parameter.
+
+        Returns:
+            The controls, in the same order.
+        """
+        controls = [
+            control
+            for parameter_controls_ in parameter_controls.values()
+            for control in parameter_controls_
+        ]
+        return ControlSet(
+            target_ids=[control.target_id for control in controls],
+            times=[control.time for control in controls],
+            values=[control.value for control in controls],
+        )
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @cached_property
+    def ids(self) -> np.ndarray:
+        """The ID of each control.
+
+        IDs are `target__{target_id}__time__{time}__value__{value}`, with
+        slugs of the time and value, as in `Control.get_id`.
+        """
+        time_indices, unique_times = pd.factorize(self.times)
+        time_slugs = [get_slug(float(time)) for time in unique_times]
+        value_indices, unique_values = pd.factorize(self.values)
+        value_slugs = [get_slug(value) for value in unique_values]
+        target_prefixes = [
+            f'target__{target_id}__time__'
+            for target_id in self.target_ids
+        ]
+        return np.array(
+            [
+                sys.intern(
+                    f'{target_prefixes[target_index]}{time_slugs[time_index]}'
+                    f'__value__{value_slugs[value_index]}'
+                )
+                for target_index, time_index, value_index in zip(
+                    self.target_indices,
+                    time_indices,
+                    value_indices,
+                )
+            ],
+            dtype=object,
+        )
+
+    def _get_prefixed_ids(self, prefix: str) -> np.ndarray:
+        return np.array(
+            [sys.intern(f'{prefix}{id_}') for id_ in self.ids],
+            dtype=object,
+        )
+
+    @cached_property
+    def control_parameter_ids(self) -> np.ndarray:
+        """The ID of the parameter that stores the value of each control."""
+        return self._get_prefixed_ids('control_parameter__')
+
+    @cached_property
+    def switch_parameter_ids(self) -> np.ndarray:
+        """The ID of the parameter that switches each control on."""
+        return self._get_prefixed_ids('switch_parameter__')
+
+    @cached_property
+    def event_ids(self) -> np.ndarray:
+        """The ID of the SBML event that applies each control."""
+        return self._get_prefixed_ids('control_event__')
+
+    @cached_property
+    def numeric_values(self) -> np.ndarray:
+        """The value of each control, or `nan` if it is estimated."""
+        return np.array(
+            [
+                np.nan if estimate else float(value)
+                for value, estimate in zip(self.values, self.estimate)
+            ],
+            dtype=float,
+        )
+
+    @cached_property
+    def target_rows(self) -> Dict[str, np.ndarray]:
+        """The controls of each target, sorted by time.
+
+        Keys are target IDs, values are indices of the controls of the
+        target, sorted by time. Controls with the same time keep their
+        order.
+        """
+        order = np.lexsort((self.times, self.target_indices))
+        boundaries = np.searchsorted(
+            self.target_indices[order],
+            np.arange(len(self.target_ids) + 1),
+        )
+        return {
+            target_id: order[boundaries[index]:boundaries[index + 1]]
+            for index, target_id in enumerate(self.target_ids)
+        }
+
+    def get_active_indices(
+        self,
+        timepoints: Sequence[float],
+    ) -> Dict[str, np.ndarray]:
+        """Get the active controls at many timepoints.
+
+        The active control of a target is its latest control at or before the
+        timepoint. If several controls of a target have the same time, the
+        last of these is active. The controls of each target are sorted once
+        (see `target_rows`), so active controls are found by binary search.
+
+        Args:
+            timepoints:
+                The timepoints.
+
+        Returns:
+            Keys are target IDs, values are the index of the active control
+            at each timepoint, or `-1` if no control is active.
+        """
+        timepoints = np.asarray(timepoints, dtype=float)
+        active_indices = {}
+        for target_id, rows in self.target_rows.items():
+            positions = np.searchsorted(
+                self.times[rows],
+                timepoints,
+                side='right',
+            ) - 1
+            active_indices[target_id] = np.where(
+                positions >= 0,
+                rows[positions],
+                -1,
+            )
+        return active_indices
+
+
+def get_control_set(
+    parameter_controls: Union[
+        ControlSet,
+        Dict[str, Sequence['ParameterControl']],
+    ],
+) -> ControlSet:
+    """Get controls as a `ControlSet`.
+
+    Args:
+        parameter_controls:
+            The controls, as a `ControlSet`, or as `ParameterControl` objects
+            grouped by parameter ID.
+
+    Returns:
+        The controls.
+    """
+    if isinstance(parameter_controls, ControlSet):
+        return parameter_controls
+    return ControlSet.from_parameter_controls(parameter_controls)
@@ -1,47 +1,51 @@
-from functools import partial
-from itertools import chain
-from typing import Any, Dict, List, Sequence, Tuple, Union
-import warnings
-
-import amici
-from amici.petab_import import import_petab_problem
-from amici.petab_objective import (
-    RDATAS
-)
-from more_itertools import one
-import petab
-from petab.C import (
-    CONDITION_NAME,
-    ESTIMATE,
-    PARAMETER_ID,
-)
-
-import pypesto.objective
-import pypesto.petab
+"""Objective functions of PEtab Control problems.
 
-from petab_timecourse import Timecourse
-from petab_timecourse import Simulator
+This module only depends on NumPy and SciPy, such that worker processes that
+evaluate a pre-built objective do not import libsbml, PEtab or pyPESTO.
+pyPESTO problems are created with `petab_control.pypesto`.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+import hashlib
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Sequence, Tuple
+import uuid
 
+import numpy as np
+import scipy.sparse
 
 from .constants import (
+    ADJOINT_PARAMETER_STATE_RATIO,
+    CONTROL_ID,
+    ESTIMATE,
+    FVAL,
+    GRAD,
+    HESS,
+    LLH,
+    PARAMETER_ID,
     PERIODS,
     PERIODS_RESULTS,
-)
-from .problem import Problem
-
-from amici.petab_objective import (
-    LLH,
+    RDATAS,
+    RES,
+    SENSITIVITY_METHOD_ADJOINT,
+    SENSITIVITY_METHOD_AUTO,
+    SENSITIVITY_METHOD_FORWARD,
+    SENSITIVITY_METHODS,
     SLLH,
+    SRES,
 )
-
-
-from pypesto.C import (
-    FVAL,
-    GRAD,
-    MODE_FUN,
+from .periods import (
+    PeriodSimulator,
+    SensitivityColumns,
+    get_sensitivity_columns,
 )
 
-from pypesto.objective import Objective
+if TYPE_CHECKING:
+    import amici
+    import petab
+
+    from .problem import Problem
 
 
 # pyPESTO expects an objective function to provide
@@ -50,12 +54,539 @@ PYPESTO_FUNCTION_ORDER = [
     FVAL,
     GRAD,
 ]
+# Objective outputs that require sensitivities.
+SENSITIVITY_OUTPUTS = [
+    GRAD,
+    HESS,
+    SRES,
+]
+
+
+@dataclass
+class GradientMapping:
+    """Maps the gradients of all periods to the optimizer parameters.
+
+    Attributes:
+        matrix:
+            A sparse matrix of shape
+            (number of optimizer parameters,
+            number of periods * number of model parameters).
+            The gradient is this matrix times the flattened stacked array of
+            per-period model parameter gradients.
+        parameter_ids:
+            The model parameters, in the order of the columns of the stacked
+            array of per-period gradients.
+    """
+    matrix: scipy.sparse.csr_matrix
+    parameter_ids: List[str]
+
+    def stack(self, periods_results: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """Stack the per-period model parameter gradients.
+
+        Args:
+            periods_results:
+                The simulation results of each period.
+
+        Returns:
+            The gradients, of shape
+            (number of periods, number of model parameters). Gradients that
+            were not computed are zero.
+        """
+        return np.array(
+            [
+                [
+                    period_results[SLLH].get(parameter_id, 0.0)
+                    for parameter_id in self.parameter_ids
+                ]
+                for period_results in periods_results
+            ],
+            dtype=float,
+        ).reshape(len(periods_results), len(self.parameter_ids))
+
+    def get_gradient(
+        self,
+        periods_results: Sequence[Dict[str, Any]],
+    ) -> np.ndarray:
+        """Get the gradient with respect to the optimizer parameters.
+
+        Args:
+            periods_results:
+                The simulation results of each period.
+
+        Returns:
+            The gradient.
+        """
+        return self.matrix @ self.stack(periods_results).ravel()
+
+    def get_residuals(
+        self,
+        periods_results: Sequence[Dict[str, Any]],
+        sensitivities: bool = True,
+    ) -> Dict[str, np.ndarray]:
+        """Get the residuals, and their sensitivities and the Hessian.
+
+        The residual sensitivities of each period are mapped to the
+        optimizer parameters like the gradient. The Hessian is the
+        Gauss-Newton approximation, i.e. the Fisher information matrix for
+        Gaussian noise.
+
+        Args:
+            periods_results:
+                The simulation results of each period, with the AMICI
+                return data.
+            sensitivities:
+                Whether to compute the residual sensitivities and the
+                Hessian.
+
+        Returns:
+            The residuals of all periods (`RES`), and the residual
+            sensitivities (`SRES`), of shape
+            (number of residuals, number of optimizer parameters), and the
+            Hessian (`HESS`), if `sensitivities`.
+        """
+        n_parameters = len(self.parameter_ids)
+        parameter_indices = {
+            parameter_id: index
+            for index, parameter_id in enumerate(self.parameter_ids)
+        }
+        res_periods = []
+        sres_periods = []
+        for period_index, period_results in enumerate(periods_results):
+            # Periods after a failed simulation are not simulated.
+            if not period_results[RDATAS]:
+                continue
+            rdata = period_results[RDATAS][0]
+            res = np.asarray(rdata.res, dtype=float)
+            res_periods.append(res)
+            if not sensitivities:
+                continue
+
+            sres = np.zeros((len(res), n_parameters))
+            # The gradient has the sensitivity parameters or sources of the
+            # period as keys, in the order of the columns of the residual
+            # sensitivities. Simulators with sources provide the residual
+            # sensitivities by source.
+            columns = np.array(
+                [
+                    parameter_indices.get(parameter_id, -1)
+                    for parameter_id in period_results[SLLH]
+                ],
+                dtype=int,
+            )
+            period_sres = period_results.get(SRES, rdata.sres)
+            if period_sres is not None and len(columns):
+                period_sres = np.asarray(period_sres, dtype=float)
+                sres[:, columns[columns != -1]] = \
+                    period_sres[:, columns != -1]
+            period_matrix = self.matrix[
+                :,
+                period_index * n_parameters:(period_index + 1) * n_parameters,
+            ]
+            sres_periods.append((period_matrix @ sres.T).T)
+
+        results = {RES: np.concatenate(res_periods)}
+        if sensitivities:
+            sres = np.vstack(sres_periods)
+            results[SRES] = sres
+            results[HESS] = sres.T @ sres
+        return results
+
+
+def get_gradient_mapping(
+    petab_control_problem: 'Problem',
+    x_names: Sequence[str],
+) -> GradientMapping:
+    """Precompute the mapping of period gradients to optimizer parameters.
+
+    If the simulator has sensitivity sources (see
+    `Problem.get_periods_sensitivity_sources`), the gradient of each period
+    is by source, i.e. by estimated control or parameter, and includes the
+    effects of earlier periods through the state. The gradient of a source
+    is then the sum of its gradients in all periods.
+
+    Else, the gradient of a control parameter is the sum of the gradients
+    of its model parameter, in all periods where the control is applied.
+    The gradient of an estimated model parameter is the sum of its
+    gradients in all periods where none of its controls are applied.
+
+    Args:
+        petab_control_problem:
+            The PEtab Control problem. NB: should already be
+            setup with a simulator.
+        x_names:
+            The optimizer parameter IDs.
+
+    Returns:
+        The mapping.
+    """
+    simulator = petab_control_problem.simulator
+    n_periods = len(simulator.timecourse.periods)
+    by_source = (
+        getattr(simulator, 'sensitivity_sources_periods', None) is not None
+    )
+    if by_source:
+        sensitivity_sources_periods = [
+            simulator.get_sensitivity_sources(period_index)
+            for period_index in range(n_periods)
+        ]
+        parameter_ids = list(dict.fromkeys(
+            source_id
+            for sensitivity_sources in sensitivity_sources_periods
+            for source_id in sensitivity_sources
+        ))
+    else:
+        estimated_parameters = list(
+            petab_control_problem
+            .control_parameter_df
+            .loc[
+                petab_control_problem
+                .control_parameter_df
+                [ESTIMATE]
+                ==
+                1
+            ]
+            .index
+        )
+        parameter_ids = list(dict.fromkeys([
+            *(
+                control_information[PARAMETER_ID]
+                for control_information in (
+                    petab_control_problem.simulator_control_parameters.values()
+                )
+            ),
+            *estimated_parameters,
+        ]))
+        sensitivity_sources_periods = \
+            petab_control_problem.get_periods_sensitivity_sources(
+                sensitivity_parameter_ids=parameter_ids,
+                n_periods=n_periods,
+                restrict_sensitivities=False,
+            )
+    parameter_indices = {
+        parameter_id: index
+        for index, parameter_id in enumerate(parameter_ids)
+    }
+    x_indices = {x_name: index for index, x_name in enumerate(x_names)}
+
+    rows = []
+    columns = []
+    for period_index, sensitivity_sources in enumerate(
+        sensitivity_sources_periods
+    ):
+        for source_id, parameter_id in sensitivity_sources.items():
+            if source_id not in x_indices:
+                continue
+            if by_source:
+                parameter_id = source_id
+            elif parameter_id is None:
+                continue
+            rows.append(x_indices[source_id])
+            columns.append(
+                period_index * len(parameter_ids)
+                + parameter_indices[parameter_id]
+            )
+
+    matrix = scipy.sparse.coo_matrix(
+        (np.ones(len(rows)), (rows, columns)),
+        shape=(len(x_names), n_periods * len(parameter_ids)),
+    ).tocsr()
+    return GradientMapping(matrix=matrix, parameter_ids=parameter_ids)
+
+
+def get_encoded_gradient_mapping(
+    petab_control_problem: 'Problem',
+    petab_problem: 'petab.Problem',
+    x_names: Sequence[str],
+    start_time: float,
+) -> GradientMapping:
+    """Map the gradient of an encoded problem to the optimizer parameters.
+
+    In encoded problems, e.g. from `get_control_events_petab_problem`, each
+    control has its own parameter, and the problem is a single simulation.
+    The gradient of an optimizer parameter is the sum of the gradients of
+    the control parameters of its controls. The transpose of the matrix maps
+    the optimizer parameters to the control parameters.
+
+    Args:
+        petab_control_problem:
+            The PEtab Control problem.
+        petab_problem:
+            The encoded problem.
+        x_names:
+            The optimizer parameter IDs.
+        start_time:
+            The start time of the controls in the encoded problem (see
+            `petab_control.problem.get_start_time`), which is part of the
+            control parameter IDs.
+
+    Returns:
+        The mapping, with one period. The parameter IDs are the estimated
+        control parameters of the encoded problem.
+    """
+    from .controls import ControlSet, get_control_order
+
+    control_df = petab_control_problem.control_df
+    control_ids = control_df[CONTROL_ID].to_numpy()[
+        get_control_order(control_df)
+    ]
+    # The controls of `ControlSet.from_control_df` are in the same order.
+    control_parameter_ids = ControlSet.from_control_df(
+        control_df,
+        start_time=start_time,
+    ).control_parameter_ids
+    estimate = petab_problem.parameter_df.loc[
+        control_parameter_ids,
+        ESTIMATE,
+    ]
+    x_indices = {x_name: index for index, x_name in enumerate(x_names)}
+
+    parameter_ids = []
+    rows = []
+    for control_id, (control_parameter_id, estimate_) in zip(
+        control_ids,
+        estimate.items(),
+    ):
+        if estimate_ != 1 or control_id not in x_indices:
+            continue
+        rows.append(x_indices[control_id])
+        parameter_ids.append(control_parameter_id)
+
+    matrix = scipy.sparse.coo_matrix(
+        (np.ones(len(rows)), (rows, np.arange(len(rows)))),
+        shape=(len(x_names), len(parameter_ids)),
+    ).tocsr()
+    return GradientMapping(matrix=matrix, parameter_ids=parameter_ids)
+
+
+def choose_sensitivity_method(
+    n_parameters: int,
+    n_states: int,
+    sensitivity_method: str = SENSITIVITY_METHOD_FORWARD,
+) -> str:
+    """Resolve the method to compute the gradient of the control objective.
+
+    Forward sensitivities require one sensitivity equation per parameter, so
+    their cost grows with the number of parameters. The cost of adjoint
+    sensitivities is mostly independent of the number of parameters, but
+    they require a backward simulation, and the import of the
+    events-encoded problem. Hence, adjoint sensitivities are only used if
+    requested.
+
+    Args:
+        n_parameters:
+            The number of estimated parameters.
+        n_states:
+            The number of model states.
+        sensitivity_method:
+            One of `SENSITIVITY_METHODS`. Adjoint sensitivities are used with
+            `SENSITIVITY_METHOD_ADJOINT`, or with `SENSITIVITY_METHOD_AUTO`
+            if there are many more parameters than states.
+
+    Returns:
+        `SENSITIVITY_METHOD_FORWARD` or `SENSITIVITY_METHOD_ADJOINT`.
+    """
+    if sensitivity_method not in SENSITIVITY_METHODS:
+        raise ValueError(
+            f'Unknown sensitivity method: `{sensitivity_method}`. Available '
+            f'methods: {SENSITIVITY_METHODS}'
+        )
+    if sensitivity_method != SENSITIVITY_METHOD_AUTO:
+        return sensitivity_method
+    if n_parameters > ADJOINT_PARAMETER_STATE_RATIO * n_states:
+        return SENSITIVITY_METHOD_ADJOINT
+    return SENSITIVITY_METHOD_FORWARD
+
+
+def get_failed_gradient(gradient_mapping: GradientMapping) -> np.ndarray:
+    """Get the gradient of a failed simulation.
+
+    Args:
+        gradient_mapping:
+            The gradient mapping of the objective.
+
+    Returns:
+        The gradient, which is `nan` for all optimizer parameters, like the
+        objective value.
+    """
+    return np.full(gradient_mapping.matrix.shape[0], np.nan)
+
+
+@contextmanager
+def sensitivity_order(
+    amici_solver: 'amici.Solver',
+    sensitivities: bool,
+):
+    """Temporarily disable sensitivities of an AMICI solver.
+
+    Args:
+        amici_solver:
+            The AMICI solver. Nothing is changed if this is `None`.
+        sensitivities:
+            Whether sensitivities are computed. If `True`, the sensitivity
+            order of the solver is used.
+    """
+    if sensitivities or amici_solver is None:
+        yield
+        return
+
+    import amici
+
+    order = amici_solver.getSensitivityOrder()
+    amici_solver.setSensitivityOrder(amici.SensitivityOrder.none)
+    try:
+        yield
+    finally:
+        amici_solver.setSensitivityOrder(order)
+
+
+def simulate_objective(
+    x: Sequence[float],
+    petab_control_problem: 'Problem',
+    x_names: Sequence[str],
+    gradient_mapping: GradientMapping = None,
+    sensitivities: bool = True,
+    residuals: bool = False,
+) -> Dict[str, Any]:
+    """Simulate the objective of a PEtab Control problem.
+
+    Args:
+        x:
+            See `pypesto_fun`.
+        petab_control_problem:
+            See `pypesto_fun`.
+        x_names:
+            See `pypesto_fun`.
+        gradient_mapping:
+            See `pypesto_fun`.
+        sensitivities:
+            Whether to compute the gradient. If not, sensitivities are
+            disabled for the simulation, if the simulator has an AMICI
+            solver.
+        residuals:
+            Whether to compute the residuals, and, with `sensitivities`,
+            the residual sensitivities and the Gauss-Newton Hessian. See
+            `GradientMapping.get_residuals`. Requires a
+            `petab_control.simulator.ControlSimulator`.
+
+    Returns:
+        The objective value (`FVAL`), and the gradient (`GRAD`) if it was
+        computed, and the outputs of `GradientMapping.get_residuals` if
+        `residuals`.
+    """
+    problem_parameters = dict(zip(x_names, x))
+    simulate_kwargs = {}
+    if residuals:
+        # Residuals are read from the AMICI return data.
+        simulate_kwargs['full_results'] = True
+
+    with sensitivity_order(
+        amici_solver=getattr(
+            petab_control_problem.simulator,
+            'amici_solver',
+            None,
+        ),
+        sensitivities=sensitivities,
+    ):
+        results = petab_control_problem.simulate(
+            problem_parameters=problem_parameters,
+            **simulate_kwargs,
+        )
+
+    result_dict = {FVAL: -results[LLH]}
+    if (sensitivities or residuals) and gradient_mapping is None:
+        gradient_mapping = get_gradient_mapping(
+            petab_control_problem=petab_control_problem,
+            x_names=x_names,
+        )
+    if sensitivities:
+        result_dict[GRAD] = \
+            -gradient_mapping.get_gradient(results[PERIODS_RESULTS])
+    if residuals:
+        result_dict.update(gradient_mapping.get_residuals(
+            periods_results=results[PERIODS_RESULTS],
+            sensitivities=sensitivities,
+        ))
+    return result_dict
+
+
+def simulate_encoded_objective(
+    x: Sequence[float],
+    petab_problem: 'petab.Problem',
+    amici_model: 'amici.Model',
+    amici_solver: 'amici.Solver',
+    gradient_mapping: GradientMapping,
+    sensitivities: bool = True,
+) -> Dict[str, Any]:
+    """Simulate the objective of a control problem, with an encoded problem.
+
+    The encoded problem is simulated in a single AMICI simulation, which
+    supports adjoint sensitivities, e.g. with an AMICI solver that has
+    `amici.SensitivityMethod.adjoint`.
+
+    Args:
+        x:
+            See `pypesto_fun`.
+        petab_problem:
+            The encoded problem, e.g. from
+            `get_control_events_petab_problem` with `ENCODING_EVENTS`.
+        amici_model:
+            The AMICI model of the encoded problem.
+        amici_solver:
+            The AMICI solver.
+        gradient_mapping:
+            From `get_encoded_gradient_mapping`.
+        sensitivities:
+            See `simulate_objective`.
+
+    Returns:
+        See `simulate_objective`.
+    """
+    import amici
+    import amici.petab_objective
+
+    parameter_values = \
+        gradient_mapping.matrix.T @ np.asarray(x, dtype=float)
+    with sensitivity_order(
+        amici_solver=amici_solver,
+        sensitivities=sensitivities,
+    ):
+        results = amici.petab_objective.simulate_petab(
+            petab_problem=petab_problem,
+            amici_model=amici_model,
+            solver=amici_solver,
+            problem_parameters=dict(zip(
+                gradient_mapping.parameter_ids,
+                parameter_values,
+            )),
+            scaled_parameters=True,
+        )
+
+    llh = results[LLH]
+    if any(
+        rdata.status != amici.AMICI_SUCCESS
+        for rdata in results[RDATAS]
+    ):
+        llh = np.nan
+    result_dict = {FVAL: -llh}
+    if sensitivities and np.isnan(llh):
+        result_dict[GRAD] = get_failed_gradient(gradient_mapping)
+    elif sensitivities:
+        sllh = results[SLLH] or {}
+        result_dict[GRAD] = -(gradient_mapping.matrix @ np.array(
+            [
+                sllh.get(parameter_id, 0.0)
+                for parameter_id in gradient_mapping.parameter_ids
+            ],
+            dtype=float,
+        ))
+    return result_dict
 
 
 def pypesto_fun(
     x: Sequence[float],
-    petab_control_problem: Problem,
+    petab_control_problem: 'Problem',
     x_names: Sequence[str],
+    gradient_mapping: GradientMapping = None,
 ):
     """Get pyPESTO-compatible objective information.
 
@@ -68,137 +599,832 @@ def pypesto_fun(
         x_names:
             The parameter IDs, with an order that corresponds to
             `x`.
+        gradient_mapping:
+            The precomputed mapping of period gradients to `x`. Computed on
+            each call if not supplied.
 
     Returns:
         The objective result.
     """
-    problem_parameters = dict(zip(x_names, x))
-
-    results = petab_control_problem.simulate(
-        problem_parameters=problem_parameters,
+    result_dict = simulate_objective(
+        x=x,
+        petab_control_problem=petab_control_problem,
+        x_names=x_names,
+        gradient_mapping=gradient_mapping,
     )
 
-    estimated_parameters = (
-        petab_control_problem
-        .control_parameter_df
-        .loc[
-            petab_control_problem
-            .control_parameter_df
-            [ESTIMATE]
-            ==
-            1
-        ]
-        .index
-    )
+    result = [
+        result_dict[output]
+        for output in PYPESTO_FUNCTION_ORDER
+    ]
 
-    grad = {
-        id_: 0
-        for id_ in
-        [
-            *petab_control_problem.simulator_control_parameters,
-            *problem_parameters,
-        ]
-    }
-    for period_index in range(len(
-        petab_control_problem
-        .simulator
-        .timecourse
-        .periods
-    )):
-        gradients_assigned = {
-            parameter_id: False
-            for parameter_id in estimated_parameters
+    return result
+
+
+class CachedObjective():
+    """An LRU cache of objective results, keyed by the parameter vector.
+
+    Line searches often request the objective value and the gradient at the
+    same parameters in separate calls. Results are cached by the rounded
+    parameter vector, such that each parameter vector is simulated once.
+
+    Attributes:
+        simulate:
+            Computes the objective results, e.g. `simulate_objective` or
+            `simulate_objective_state` with all arguments except `x` and
+            `sensitivities` bound by `functools.partial`. Called as
+            `simulate(x, sensitivities=...)`, and returns a dictionary with
+            at least `FVAL`, and `GRAD` if sensitivities are computed, and
+            optionally other results, e.g. residuals.
+        max_size:
+            The maximum number of cached parameter vectors.
+        decimals:
+            Parameter vectors are rounded to this number of decimals for
+            the cache key.
+        gradient_on_demand:
+            Whether `fun` only computes the objective value, without
+            sensitivities. Else, the gradient is always computed with the
+            objective value, for later calls of `grad`.
+        simulate_batch:
+            Computes the objective results of many parameter vectors, e.g.
+            `simulate_objective_state_batch` with all arguments except `xs`
+            and `sensitivities` bound. Called as
+            `simulate_batch(xs, sensitivities=...)`, and returns a
+            dictionary of results with one row per parameter vector. If not
+            supplied, batches are simulated with `simulate`, one parameter
+            vector at a time.
+        hits:
+            The number of calls that were answered from the cache.
+        misses:
+            The number of calls that required a simulation.
+    """
+    def __init__(
+        self,
+        simulate: Callable[..., Dict[str, Any]],
+        max_size: int = 16,
+        decimals: int = 12,
+        gradient_on_demand: bool = False,
+        simulate_batch: Callable[..., Dict[str, np.ndarray]] = None,
+    ):
+        """Create an empty cache.
+
+        Args:
+            simulate:
+                See the class attributes.
+            max_size:
+                See the class attributes.
+            decimals:
+                See the class attributes.
+            gradient_on_demand:
+                See the class attributes.
+            simulate_batch:
+                See the class attributes.
+        """
+        self.simulate = simulate
+        self.max_size = max_size
+        self.decimals = decimals
+        self.gradient_on_demand = gradient_on_demand
+        self.simulate_batch = simulate_batch
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Cached results are not sent to other processes.
+        state = self.__dict__.copy()
+        state['_results'] = OrderedDict()
+        return state
+
+    def get_key(self, x: Sequence[float]) -> bytes:
+        """Get the cache key of a parameter vector.
+
+        Args:
+            x:
+                The parameter vector.
+
+        Returns:
+            The key.
+        """
+        # Adding zero replaces `-0.0` with `0.0`.
+        rounded = np.round(np.asarray(x, dtype=float), self.decimals) + 0.0
+        return hashlib.blake2b(rounded.tobytes(), digest_size=16).digest()
+
+    def get_results(
+        self,
+        x: Sequence[float],
+        outputs: Sequence[str],
+    ) -> Dict[str, Any]:
+        """Get cached results, or simulate them.
+
+        Args:
+            x:
+                The parameter vector.
+            outputs:
+                The required results, e.g. `[FVAL, GRAD]`.
+
+        Returns:
+            The results at `x`.
+        """
+        key = self.get_key(x)
+        results = self._results.get(key)
+        if results is not None and all(output in results for output in outputs):
+            self.hits += 1
+            self._results.move_to_end(key)
+            return results
+
+        self.misses += 1
+        sensitivities = (
+            any(output in SENSITIVITY_OUTPUTS for output in outputs)
+            or not self.gradient_on_demand
+        )
+        results = {
+            **(results or {}),
+            **self.simulate(x, sensitivities=sensitivities),
         }
-        for control_parameter_id, control_information in (
-            petab_control_problem
-            .simulator_control_parameters
-            .items()
-        ):
-            if period_index not in control_information[PERIODS]:
-                continue
+        self._store(key, results)
+        return results
 
-            parameter_id = control_information[PARAMETER_ID]
+    def _store(self, key: bytes, results: Dict[str, Any]) -> None:
+        self._results[key] = results
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
 
-            grad[control_parameter_id] += (
-                results
-                [PERIODS_RESULTS]
-                [period_index]
-                [SLLH]
-                [control_information[PARAMETER_ID]]
-            )
+    def get_results_batch(
+        self,
+        xs: np.ndarray,
+        outputs: Sequence[str],
+    ) -> List[Dict[str, Any]]:
+        """Get cached results of many parameter vectors, or simulate them.
+
+        Parameter vectors without cached results are simulated together
+        with `simulate_batch`.
 
-            if parameter_id in gradients_assigned:
-                gradients_assigned[parameter_id] = True
-            gradients_assigned[control_information[PARAMETER_ID]] = True
+        Args:
+            xs:
+                The parameter vectors, of shape
+                (number of vectors, number of parameters).
+            outputs:
+                The required results, e.g. `[FVAL, GRAD]`.
 
-        # FIXME parameters that have corresponding control
-        #       parameters
-        for parameter_id in problem_parameters:
+        Returns:
+            The results of each parameter vector.
+        """
+        xs = np.atleast_2d(np.asarray(xs, dtype=float))
+        if self.simulate_batch is None:
+            return [self.get_results(x, outputs=outputs) for x in xs]
+
+        keys = [self.get_key(x) for x in xs]
+        results_batch = [self._results.get(key) for key in keys]
+        missing = {}
+        for index, (key, results) in enumerate(zip(keys, results_batch)):
             if (
-                parameter_id not in gradients_assigned
-                or gradients_assigned[parameter_id]
+                results is not None
+                and all(output in results for output in outputs)
             ):
-                #if gradients_assigned.get(parameter_id, True):
-                continue
-            grad[parameter_id] += (
-                results
-                [PERIODS_RESULTS]
-                [period_index]
-                [SLLH]
-                [parameter_id]
-            )
+                self.hits += 1
+                self._results.move_to_end(key)
+            else:
+                # Duplicate parameter vectors are simulated once.
+                missing.setdefault(key, []).append(index)
+        if not missing:
+            return results_batch
 
-    result_dict = {
-        FVAL: -results[LLH],
-        GRAD: [
-            -grad[parameter_id]
-            for parameter_id in x_names
-        ]
-    }
+        self.misses += sum(len(indices) for indices in missing.values())
+        sensitivities = (
+            any(output in SENSITIVITY_OUTPUTS for output in outputs)
+            or not self.gradient_on_demand
+        )
+        simulated = self.simulate_batch(
+            xs[[indices[0] for indices in missing.values()]],
+            sensitivities=sensitivities,
+        )
+        for row, (key, indices) in enumerate(missing.items()):
+            results = {
+                **(results_batch[indices[0]] or {}),
+                **{output: values[row] for output, values in simulated.items()},
+            }
+            self._store(key, results)
+            for index in indices:
+                results_batch[index] = results
+        return results_batch
 
-    result = [
-        result_dict[output]
-        for output in PYPESTO_FUNCTION_ORDER
-    ]
+    def evaluate_batch(
+        self,
+        xs: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the objective values and gradients of many parameter vectors.
 
-    return result
+        For example, to evaluate all startpoints of a multi-start
+        optimization in one call.
 
+        Args:
+            xs:
+                The parameter vectors, of shape
+                (number of vectors, number of parameters).
 
-def get_pypesto_problem(
-    petab_control_problem: Problem,
-    setup_simulator_kwargs: Dict,
-    petab_importer_kwargs: Dict,
-):
-    petab_control_problem.setup_simulator(**setup_simulator_kwargs)
+        Returns:
+            The objective values, of shape (number of vectors,), and the
+            gradients, of shape (number of vectors, number of parameters).
+        """
+        results_batch = self.get_results_batch(
+            xs,
+            outputs=PYPESTO_FUNCTION_ORDER,
+        )
+        return (
+            np.array([results[FVAL] for results in results_batch]),
+            np.array([results[GRAD] for results in results_batch]),
+        )
 
-    x_names = [
-        x_name
-        for x_index, x_name in enumerate(
-            petab_control_problem
-            .optimizer_control_petab_problem
-            .parameter_df
-            .index
+    def clear(self) -> None:
+        """Remove all cached results, and reset the counters."""
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def fun(self, x: Sequence[float]) -> float:
+        """Get the objective value.
+
+        Args:
+            x:
+                The parameter vector.
+
+        Returns:
+            The objective value.
+        """
+        return self.get_results(x, outputs=[FVAL])[FVAL]
+
+    def grad(self, x: Sequence[float]) -> np.ndarray:
+        """Get the gradient.
+
+        Args:
+            x:
+                The parameter vector.
+
+        Returns:
+            The gradient.
+        """
+        return self.get_results(x, outputs=[GRAD])[GRAD]
+
+    def hess(self, x: Sequence[float]) -> np.ndarray:
+        """Get the Hessian.
+
+        Requires a `simulate` that computes the Hessian, e.g.
+        `simulate_objective` with `residuals`.
+
+        Args:
+            x:
+                The parameter vector.
+
+        Returns:
+            The Hessian.
+        """
+        return self.get_results(x, outputs=[HESS])[HESS]
+
+    def res(self, x: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the residuals and residual sensitivities.
+
+        Requires a `simulate` that computes residuals, e.g.
+        `simulate_objective` with `residuals`.
+
+        Args:
+            x:
+                The parameter vector.
+
+        Returns:
+            The residuals and the residual sensitivities, as expected by
+            `pypesto.objective.Objective` with `sres=True`.
+        """
+        results = self.get_results(x, outputs=[RES, SRES])
+        return results[RES], results[SRES]
+
+    def __call__(self, x: Sequence[float]) -> List:
+        """Get pyPESTO-compatible objective information.
+
+        Args:
+            x:
+                The parameter vector.
+
+        Returns:
+            The objective value and the gradient.
+        """
+        results = self.get_results(x, outputs=PYPESTO_FUNCTION_ORDER)
+        return [results[output] for output in PYPESTO_FUNCTION_ORDER]
+
+
+@dataclass(frozen=True)
+class OptimizerParameter:
+    """A placeholder for the value of an optimizer parameter.
+
+    Attributes:
+        index:
+            The index of the parameter in the optimizer parameter vector.
+    """
+    index: int
+
+
+@dataclass
+class ObjectiveState:
+    """The data required to evaluate the objective of a control problem.
+
+    This is a compact, picklable alternative to the PEtab Control problem
+    and its simulator, e.g. to send to worker processes. Each process imports
+    the compiled AMICI model of the state once, then reuses it for all
+    evaluations. See `evaluate_objective_state`.
+
+    Attributes:
+        key:
+            Identifies the state in the caches of worker processes.
+        model_module_name:
+            The name of the compiled AMICI model module.
+        model_module_path:
+            The directory of the compiled AMICI model module.
+        model_settings:
+            Keys are AMICI model setters, values are supplied to the setters.
+        solver_settings:
+            Keys are AMICI solver setters, values are supplied to the setters.
+        parameter_scales:
+            The AMICI parameter scale of each model parameter.
+        period_start_times:
+            The start time of each period.
+        timepoints_periods:
+            The timepoints of each period.
+        observed_data_periods:
+            The flattened measurements of each period, of shape
+            (number of timepoints, number of observables).
+        parameters_periods:
+            The model parameters of each period, on parameter scale, of
+            shape (number of periods, number of model parameters). Parameters
+            that take optimizer parameter values are overwritten.
+        fixed_parameters_periods:
+            The fixed parameters of each period, of shape
+            (number of periods, number of fixed parameters).
+        x_indices_periods:
+            For each period, the optimizer parameters that model parameters
+            take the value of.
+        parameter_indices_periods:
+            For each period, the model parameters that take the values of
+            `x_indices_periods`.
+        fixed_x_indices_periods:
+            As `x_indices_periods`, for fixed parameters.
+        fixed_parameter_indices_periods:
+            As `parameter_indices_periods`, for fixed parameters.
+        sensitivity_columns_periods:
+            The sensitivity parameters of each period, with gradient columns
+            in the order of `gradient_mapping.parameter_ids`.
+        prefix_period_count:
+            See `PeriodSimulator.prefix_period_count`.
+        gradient_mapping:
+            Maps the gradients of all periods to the optimizer parameters.
+        checkpoint_max_bytes:
+            See `PeriodSimulator.checkpoint_max_bytes`. Checkpoints are
+            kept in each process.
+    """
+    key: str
+    model_module_name: str
+    model_module_path: str
+    model_settings: Dict[str, Any]
+    solver_settings: Dict[str, Any]
+    parameter_scales: List[int]
+    period_start_times: np.ndarray
+    timepoints_periods: List[np.ndarray]
+    observed_data_periods: List[np.ndarray]
+    parameters_periods: np.ndarray
+    fixed_parameters_periods: np.ndarray
+    x_indices_periods: List[np.ndarray]
+    parameter_indices_periods: List[np.ndarray]
+    fixed_x_indices_periods: List[np.ndarray]
+    fixed_parameter_indices_periods: List[np.ndarray]
+    sensitivity_columns_periods: List[SensitivityColumns]
+    prefix_period_count: int
+    gradient_mapping: GradientMapping
+    checkpoint_max_bytes: int = 0
+
+    def get_parameters(
+        self,
+        x: np.ndarray,
+        period_index: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the AMICI parameter vectors of a period.
+
+        Args:
+            x:
+                The optimizer parameters.
+            period_index:
+                The index of the period.
+
+        Returns:
+            The model parameters on parameter scale, and the fixed
+            parameters.
+        """
+        parameters = self.parameters_periods[period_index].copy()
+        parameters[self.parameter_indices_periods[period_index]] = \
+            x[self.x_indices_periods[period_index]]
+        fixed_parameters = self.fixed_parameters_periods[period_index].copy()
+        fixed_parameters[self.fixed_parameter_indices_periods[period_index]] \
+            = x[self.fixed_x_indices_periods[period_index]]
+        return parameters, fixed_parameters
+
+    def get_parameters_batch(
+        self,
+        xs: np.ndarray,
+        period_index: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the AMICI parameter vectors of a period, for many candidates.
+
+        Args:
+            xs:
+                The optimizer parameters of each candidate, of shape
+                (number of candidates, number of optimizer parameters).
+            period_index:
+                The index of the period.
+
+        Returns:
+            The model parameters on parameter scale, and the fixed
+            parameters, with one row per candidate.
+        """
+        parameters = np.repeat(
+            self.parameters_periods[period_index][np.newaxis],
+            len(xs),
+            axis=0,
         )
-    ]
+        parameters[:, self.parameter_indices_periods[period_index]] = \
+            xs[:, self.x_indices_periods[period_index]]
+        fixed_parameters = np.repeat(
+            self.fixed_parameters_periods[period_index][np.newaxis],
+            len(xs),
+            axis=0,
+        )
+        fixed_parameters[
+            :,
+            self.fixed_parameter_indices_periods[period_index],
+        ] = xs[:, self.fixed_x_indices_periods[period_index]]
+        return parameters, fixed_parameters
 
-    pypesto_importer = pypesto.petab.PetabImporter(
-        petab_problem=(
-            petab_control_problem
-            .optimizer_control_petab_problem
+
+def get_objective_state(
+    petab_control_problem: 'Problem',
+    x_names: Sequence[str],
+    gradient_mapping: GradientMapping = None,
+) -> ObjectiveState:
+    """Get the compact objective state of a control problem.
+
+    Args:
+        petab_control_problem:
+            The PEtab Control problem. NB: should already be setup with a
+            `petab_control.simulator.ControlSimulator`, with a model that
+            was imported from a model module, e.g. with
+            `amici.petab_import.import_petab_problem`.
+        x_names:
+            The optimizer parameter IDs.
+        gradient_mapping:
+            The mapping of period gradients to the optimizer parameters.
+            Computed if not supplied.
+
+    Returns:
+        The objective state.
+    """
+    simulator = petab_control_problem.simulator
+    if not hasattr(simulator, 'amici_edata_periods'):
+        raise TypeError(
+            'Objective states require a '
+            '`petab_control.simulator.ControlSimulator`.'
+        )
+    model_module = getattr(simulator.amici_model, 'module', None)
+    if getattr(model_module, '__file__', None) is None:
+        raise ValueError(
+            'The AMICI model must be imported from a model module, e.g. with '
+            '`amici.petab_import.import_petab_problem`, such that other '
+            'processes can import it.'
+        )
+    if gradient_mapping is None:
+        gradient_mapping = get_gradient_mapping(
+            petab_control_problem=petab_control_problem,
+            x_names=x_names,
+        )
+
+    parameter_indices = {
+        parameter_id: index
+        for index, parameter_id in enumerate(simulator.parameter_ids)
+    }
+    fixed_parameter_indices = {
+        parameter_id: index
+        for index, parameter_id in enumerate(simulator.fixed_parameter_ids)
+    }
+
+    # Resolve all period parameters that do not depend on the optimizer
+    # parameters once, with the same logic as `Problem.simulate`.
+    problem_parameters_periods = \
+        petab_control_problem.get_problem_parameters_periods({
+            x_name: OptimizerParameter(index=index)
+            for index, x_name in enumerate(x_names)
+        })
+
+    parameters_periods = []
+    fixed_parameters_periods = []
+    x_indices_periods = []
+    parameter_indices_periods = []
+    fixed_x_indices_periods = []
+    fixed_parameter_indices_periods = []
+    for period_index, problem_parameters in enumerate(
+        problem_parameters_periods
+    ):
+        optimizer_parameters = {
+            parameter_id: value
+            for parameter_id, value in problem_parameters.items()
+            if isinstance(value, OptimizerParameter)
+        }
+        parameters, fixed_parameters = simulator.get_period_parameters(
+            problem_parameters={
+                parameter_id: value
+                for parameter_id, value in problem_parameters.items()
+                if parameter_id not in optimizer_parameters
+            },
+            scaled_parameters=True,
+        )
+        parameters_periods.append(parameters)
+        fixed_parameters_periods.append(fixed_parameters)
+
+        x_indices, indices, fixed_x_indices, fixed_indices = [], [], [], []
+        for parameter_id, value in optimizer_parameters.items():
+            if parameter_id in parameter_indices:
+                x_indices.append(value.index)
+                indices.append(parameter_indices[parameter_id])
+            elif parameter_id in fixed_parameter_indices:
+                fixed_x_indices.append(value.index)
+                fixed_indices.append(fixed_parameter_indices[parameter_id])
+        x_indices_periods.append(np.array(x_indices, dtype=int))
+        parameter_indices_periods.append(np.array(indices, dtype=int))
+        fixed_x_indices_periods.append(np.array(fixed_x_indices, dtype=int))
+        fixed_parameter_indices_periods.append(
+            np.array(fixed_indices, dtype=int)
+        )
+
+    return ObjectiveState(
+        key=uuid.uuid4().hex,
+        model_module_name=model_module.__name__,
+        model_module_path=str(Path(model_module.__file__).parent.parent),
+        model_settings=dict(
+            getattr(petab_control_problem, 'simulator_model_settings', {})
+        ),
+        solver_settings=dict(
+            getattr(petab_control_problem, 'simulator_solver_settings', {})
+        ),
+        parameter_scales=[
+            int(scale) for scale in simulator.amici_parameter_scales
+        ],
+        period_start_times=np.array(simulator.period_start_times, dtype=float),
+        timepoints_periods=[
+            np.array(amici_edata.getTimepoints(), dtype=float)
+            for amici_edata in simulator.amici_edata_periods
+        ],
+        observed_data_periods=[
+            np.array(amici_edata.getObservedData(), dtype=float)
+            for amici_edata in simulator.amici_edata_periods
+        ],
+        parameters_periods=np.array(parameters_periods, dtype=float),
+        fixed_parameters_periods=np.array(fixed_parameters_periods, dtype=float),
+        x_indices_periods=x_indices_periods,
+        parameter_indices_periods=parameter_indices_periods,
+        fixed_x_indices_periods=fixed_x_indices_periods,
+        fixed_parameter_indices_periods=fixed_parameter_indices_periods,
+        sensitivity_columns_periods=get_sensitivity_columns(
+            sensitivity_sources_periods=[
+                simulator.get_sensitivity_sources(period_index)
+                for period_index in range(len(problem_parameters_periods))
+            ],
+            parameter_ids=simulator.parameter_ids,
+            sllh_source_ids=gradient_mapping.parameter_ids,
         ),
-        **petab_importer_kwargs,
+        prefix_period_count=getattr(simulator, 'prefix_period_count', 0),
+        gradient_mapping=gradient_mapping,
+        checkpoint_max_bytes=getattr(simulator, 'checkpoint_max_bytes', 0),
     )
 
-    pypesto_problem = pypesto_importer.create_problem(
-        objective=pypesto.objective.Objective(
-            fun=partial(
-                pypesto_fun,
-                petab_control_problem=petab_control_problem,
-                x_names=x_names,
-            ),
-            grad=True,
+
+# The maximum number of simulators kept in each process. Each simulator
+# keeps its AMICI objects and checkpoints, so the least recently used
+# simulators are dropped, e.g. when many objectives are created.
+SIMULATION_CONTEXTS_MAX_SIZE = 4
+# The simulators of this process, by objective state key, from least to
+# most recently used.
+_SIMULATION_CONTEXTS: 'OrderedDict[str, PeriodSimulator]' = OrderedDict()
+
+
+def get_simulation_context(
+    objective_state: ObjectiveState,
+) -> PeriodSimulator:
+    """Get the simulator of an objective state, creating it once.
+
+    The simulator keeps the AMICI objects, the cached prefix and the
+    checkpoints of the objective state in this process. At most
+    `SIMULATION_CONTEXTS_MAX_SIZE` simulators are kept.
+
+    Args:
+        objective_state:
+            The objective state.
+
+    Returns:
+        The simulator of the objective state in this process.
+    """
+    if objective_state.key in _SIMULATION_CONTEXTS:
+        _SIMULATION_CONTEXTS.move_to_end(objective_state.key)
+        return _SIMULATION_CONTEXTS[objective_state.key]
+
+    import amici
+
+    model_module = amici.import_model_module(
+        objective_state.model_module_name,
+        objective_state.model_module_path,
+    )
+    amici_model = model_module.getModel()
+    for setter, value in objective_state.model_settings.items():
+        getattr(amici_model, setter)(value)
+    amici_solver = amici_model.getSolver()
+    for setter, value in objective_state.solver_settings.items():
+        getattr(amici_solver, setter)(value)
+
+    parameter_scales = amici.parameterScalingFromIntVector(
+        objective_state.parameter_scales,
+    )
+    amici_edatas = []
+    for timepoints, observed_data in zip(
+        objective_state.timepoints_periods,
+        objective_state.observed_data_periods,
+    ):
+        amici_edata = amici.ExpData(amici_model.get())
+        amici_edata.setTimepoints(timepoints)
+        amici_edata.setObservedData(observed_data)
+        amici_edata.pscale = parameter_scales
+        amici_edatas.append(amici_edata)
+
+    simulator = PeriodSimulator(
+        amici_model=amici_model,
+        amici_solver=amici_solver,
+        amici_edata_periods=amici_edatas,
+        period_start_times=objective_state.period_start_times,
+        sensitivity_columns_periods=(
+            objective_state.sensitivity_columns_periods
         ),
-        problem_kwargs={'copy_objective': False},
+        sllh_size=len(objective_state.gradient_mapping.parameter_ids),
+        prefix_period_count=objective_state.prefix_period_count,
+        checkpoint_max_bytes=objective_state.checkpoint_max_bytes,
+    )
+    _SIMULATION_CONTEXTS[objective_state.key] = simulator
+    while len(_SIMULATION_CONTEXTS) > SIMULATION_CONTEXTS_MAX_SIZE:
+        _SIMULATION_CONTEXTS.popitem(last=False)
+    return simulator
+
+
+def simulate_objective_state(
+    x: Sequence[float],
+    objective_state: ObjectiveState,
+    sensitivities: bool = True,
+) -> Dict[str, Any]:
+    """Simulate the objective of an objective state.
+
+    The equivalent of `simulate_objective`, for use with e.g.
+    `pypesto.engine.MultiProcessEngine`, where only the objective state is
+    sent to the worker processes.
+
+    Args:
+        x:
+            The parameter vector from pyPESTO.
+        objective_state:
+            The objective state, from `get_objective_state`.
+        sensitivities:
+            See `simulate_objective`.
+
+    Returns:
+        See `simulate_objective`.
+    """
+    simulator = get_simulation_context(objective_state)
+    x = np.asarray(x, dtype=float)
+    n_periods = len(objective_state.period_start_times)
+    with sensitivity_order(
+        amici_solver=simulator.amici_solver,
+        sensitivities=sensitivities,
+    ):
+        checkpoints = simulator.simulate_periods([
+            objective_state.get_parameters(x=x, period_index=period_index)
+            for period_index in range(n_periods)
+        ])
+
+    # The last period is `nan` if a simulation failed.
+    llh = sum(checkpoint.llh for checkpoint in checkpoints)
+    result_dict = {FVAL: -llh}
+    if sensitivities and np.isnan(llh):
+        result_dict[GRAD] = \
+            get_failed_gradient(objective_state.gradient_mapping)
+    elif sensitivities:
+        sllh_periods = np.zeros((n_periods, simulator.sllh_size))
+        for period_index, checkpoint in enumerate(checkpoints):
+            if checkpoint.sllh is not None:
+                sllh_periods[period_index] = checkpoint.sllh
+        result_dict[GRAD] = \
+            -(objective_state.gradient_mapping.matrix @ sllh_periods.ravel())
+    return result_dict
+
+
+def evaluate_objective_state(
+    x: Sequence[float],
+    objective_state: ObjectiveState,
+):
+    """Get pyPESTO-compatible objective information from an objective state.
+
+    The equivalent of `pypesto_fun`. See `simulate_objective_state`.
+
+    Args:
+        x:
+            The parameter vector from pyPESTO.
+        objective_state:
+            The objective state, from `get_objective_state`.
+
+    Returns:
+        The objective result.
+    """
+    result_dict = simulate_objective_state(
+        x=x,
+        objective_state=objective_state,
     )
+    return [
+        result_dict[output]
+        for output in PYPESTO_FUNCTION_ORDER
+    ]
+
+
+def simulate_objective_state_batch(
+    xs: np.ndarray,
+    objective_state: ObjectiveState,
+    sensitivities: bool = True,
+    num_threads: int = 1,
+) -> Dict[str, np.ndarray]:
+    """Simulate the objective of an objective state for many candidates.
+
+    The candidates are simulated together, period by period, with one
+    `amici.runAmiciSimulations` call per period. The model, solver and
+    experimental data of the process are reused. See
+    `PeriodSimulator.simulate_periods_batch`.
+
+    Args:
+        xs:
+            The optimizer parameters of each candidate, of shape
+            (number of candidates, number of optimizer parameters).
+        objective_state:
+            The objective state, from `get_objective_state`.
+        sensitivities:
+            See `simulate_objective`.
+        num_threads:
+            The number of threads that simulate the candidates. Requires an
+            AMICI installation with OpenMP.
+
+    Returns:
+        As `simulate_objective_state`, with one row per candidate.
+    """
+    simulator = get_simulation_context(objective_state)
+    xs = np.atleast_2d(np.asarray(xs, dtype=float))
+    n_periods = len(objective_state.period_start_times)
+    parameters_periods = [
+        objective_state.get_parameters_batch(xs=xs, period_index=period_index)
+        for period_index in range(n_periods)
+    ]
+    with sensitivity_order(
+        amici_solver=simulator.amici_solver,
+        sensitivities=sensitivities,
+    ):
+        checkpoints_candidates = simulator.simulate_periods_batch(
+            parameters_periods_candidates=[
+                [
+                    (parameters[index], fixed_parameters[index])
+                    for parameters, fixed_parameters in parameters_periods
+                ]
+                for index in range(len(xs))
+            ],
+            num_threads=num_threads,
+        )
+
+    llhs = np.array([
+        sum(checkpoint.llh for checkpoint in checkpoints)
+        for checkpoints in checkpoints_candidates
+    ])
+    result_dict = {FVAL: -llhs}
+    if sensitivities:
+        sllh_periods = np.zeros((len(xs), n_periods, simulator.sllh_size))
+        for candidate_index, checkpoints in enumerate(checkpoints_candidates):
+            for period_index, checkpoint in enumerate(checkpoints):
+                if checkpoint.sllh is not None:
+                    sllh_periods[candidate_index, period_index] = \
+                        checkpoint.sllh
+        result_dict[GRAD] = -(
+            objective_state.gradient_mapping.matrix
+            @ sllh_periods.reshape(len(xs), -1).T
+        ).T
+    return result_dict
+
 
-    return pypesto_problem
+def __getattr__(name: str):
+    # Moved to `petab_control.pypesto`, which imports pyPESTO.
+    if name == 'get_pypesto_problem':
+        from .pypesto import get_pypesto_problem
+        return get_pypesto_problem
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,710 @@
+"""Simulate consecutive timecourse periods with AMICI.
+
+Each period is one AMICI simulation, which starts from the state and state
+sensitivities at the end of the previous period. This is the simulation loop
+of `petab_control.simulator.ControlSimulator` and of the objective states of
+`petab_control.objective`. It only depends on NumPy, such that worker
+processes do not import pandas or PEtab. AMICI is imported when simulating.
+"""
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import amici
+
+
+# The fields of AMICI return data that dominate their memory.
+RDATA_ARRAY_FIELDS = [
+    'x',
+    'sx',
+    'y',
+    'sy',
+    'sigmay',
+    'ssigmay',
+    'res',
+    'sres',
+    'FIM',
+    'w',
+]
+
+
+@dataclass
+class SensitivityColumns:
+    """The sensitivity columns of a period.
+
+    Each column is a sensitivity source, i.e. an optimizer parameter whose
+    effect on the state is carried across periods in its own column of state
+    sensitivities, e.g. an estimated control. A source is active in a period
+    if it is the value of a model parameter in the period. Else, the source
+    only affects the period through its initial state sensitivities. Such
+    an inactive source is simulated as a model parameter, and the column of
+    that model parameter with zero initial state sensitivities is subtracted.
+    The state sensitivities are linear, so this removes the direct effect
+    of the model parameter.
+
+    Attributes:
+        plist:
+            The AMICI model parameter index of each column.
+        sx_rows:
+            For each column, the row of the state sensitivities at the end of
+            the previous period, or `-1` if the previous period has no
+            sensitivities for the source.
+        sllh_columns:
+            For each column, its column in the gradient of the period, or
+            `-1` if its gradient is not required.
+        subtract_columns:
+            For each column, the column that is subtracted from its
+            sensitivities, or `-1`. See `subtract`.
+    """
+    plist: np.ndarray
+    sx_rows: np.ndarray
+    sllh_columns: np.ndarray
+    subtract_columns: np.ndarray
+
+    def subtract(self, values: np.ndarray) -> np.ndarray:
+        """Remove the direct effects from the sensitivities of inactive
+        sources.
+
+        Args:
+            values:
+                The sensitivities, with one column per sensitivity column
+                in the last axis, e.g. the gradient or the residual
+                sensitivities.
+
+        Returns:
+            A copy of the sensitivities, without the direct effects on
+            inactive sources.
+        """
+        values = np.array(values, dtype=float)
+        subtracted = self.subtract_columns != -1
+        values[..., subtracted] -= \
+            values[..., self.subtract_columns[subtracted]]
+        return values
+
+
+def get_sensitivity_columns(
+    sensitivity_sources_periods: Sequence[Dict[str, Optional[str]]],
+    parameter_ids: Sequence[str],
+    sllh_source_ids: Sequence[str],
+) -> List[SensitivityColumns]:
+    """Get the sensitivity columns of each period.
+
+    The first columns of each period are its sources, in order. An extra
+    column is added if an inactive source requires it. See
+    `SensitivityColumns`.
+
+    Args:
+        sensitivity_sources_periods:
+            The sensitivity sources of each period. Keys are source IDs,
+            values are the IDs of the model parameters that take the value
+            of the source, or `None` if the source is inactive.
+        parameter_ids:
+            The AMICI model parameters.
+        sllh_source_ids:
+            The sources of the columns of the gradient of each period.
+
+    Returns:
+        The sensitivity columns of each period.
+    """
+    parameter_indices = {
+        parameter_id: index
+        for index, parameter_id in enumerate(parameter_ids)
+    }
+    sllh_indices = {
+        source_id: index
+        for index, source_id in enumerate(sllh_source_ids)
+    }
+    sensitivity_columns_periods = []
+    previous_rows = {}
+    for sensitivity_sources in sensitivity_sources_periods:
+        plist = [
+            parameter_indices[parameter_id] if parameter_id is not None else -1
+            for parameter_id in sensitivity_sources.values()
+        ]
+        sx_rows = [
+            previous_rows.get(source_id, -1)
+            for source_id in sensitivity_sources
+        ]
+        sllh_columns = [
+            sllh_indices.get(source_id, -1)
+            for source_id in sensitivity_sources
+        ]
+        subtract_columns = [-1] * len(plist)
+
+        inactive = [
+            column
+            for column, index in enumerate(plist)
+            if index == -1
+        ]
+        if inactive:
+            # A column with zero initial state sensitivities, which is
+            # subtracted from the columns of the inactive sources.
+            zero_columns = [
+                column
+                for column, (index, row) in enumerate(zip(plist, sx_rows))
+                if index != -1 and row == -1
+            ]
+            if zero_columns:
+                zero_column = zero_columns[0]
+            else:
+                zero_column = len(plist)
+                active_indices = [index for index in plist if index != -1]
+                plist.append(active_indices[0] if active_indices else 0)
+                sx_rows.append(-1)
+                sllh_columns.append(-1)
+                subtract_columns.append(-1)
+            for column in inactive:
+                plist[column] = plist[zero_column]
+                subtract_columns[column] = zero_column
+
+        sensitivity_columns_periods.append(SensitivityColumns(
+            plist=np.array(plist, dtype=int),
+            sx_rows=np.array(sx_rows, dtype=int),
+            sllh_columns=np.array(sllh_columns, dtype=int),
+            subtract_columns=np.array(subtract_columns, dtype=int),
+        ))
+        previous_rows = {
+            source_id: row
+            for row, source_id in enumerate(sensitivity_sources)
+        }
+    return sensitivity_columns_periods
+
+
+@dataclass
+class Checkpoint:
+    """The simulation of a period.
+
+    Later simulations restart from the end of the last period with
+    unchanged parameters.
+
+    Attributes:
+        key:
+            Identifies the parameters that the period was simulated with.
+            See `PeriodSimulator.get_period_key`.
+        sensitivity_order:
+            The sensitivity order of the simulation. A checkpoint is also
+            valid for simulations of a lower order.
+        llh:
+            The log-likelihood, or `nan` if the simulation failed.
+        sllh:
+            The gradient, in the columns of `SensitivityColumns.sllh_columns`,
+            or `None` if it was not computed.
+        x:
+            The state at the end of the period.
+        sx:
+            The state sensitivities at the end of the period, of shape
+            (number of sensitivity columns, number of states), or `None`.
+        rdata:
+            The AMICI return data, if it was kept.
+    """
+    key: Tuple
+    sensitivity_order: int
+    llh: float
+    sllh: np.ndarray
+    x: np.ndarray
+    sx: np.ndarray
+    rdata: Any = None
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory of the checkpoint, in bytes."""
+        nbytes = sum(
+            array.nbytes
+            for array in [self.sllh, self.x, self.sx]
+            if array is not None
+        )
+        for field in RDATA_ARRAY_FIELDS:
+            value = getattr(self.rdata, field, None)
+            if value is not None:
+                nbytes += np.asarray(value).nbytes
+        return nbytes
+
+
+def set_start_time(
+    amici_model: 'amici.Model',
+    amici_edata: 'amici.ExpData',
+    time: float,
+) -> None:
+    """Set the time that an AMICI simulation starts at.
+
+    Args:
+        amici_model:
+            The AMICI model.
+        amici_edata:
+            The AMICI experimental data. Newer AMICI versions take the start
+            time from here, rather than from the model.
+        time:
+            The start time.
+    """
+    amici_model.setT0(time)
+    if hasattr(amici_edata, 'tstart_'):
+        amici_edata.tstart_ = time
+
+
+class PeriodSimulator():
+    """Simulate consecutive periods, one AMICI simulation per period.
+
+    The state and state sensitivities at the end of each period are the
+    initial state and state sensitivities of the next period.
+
+    Attributes:
+        amici_model:
+            The AMICI model.
+        amici_solver:
+            The AMICI solver.
+        amici_edata_periods:
+            The AMICI experimental data of each period, with the timepoints
+            and measurements of the period. The last timepoint is the end
+            of the period.
+        period_start_times:
+            The start time of each period.
+        sensitivity_columns_periods:
+            The sensitivity columns of each period.
+        sllh_size:
+            The number of columns of the gradient of each period.
+        prefix_period_count:
+            The number of leading periods that are simulated once and cached.
+            The parameters of these periods must not depend on the
+            estimated parameters, e.g. the periods of the original PEtab
+            estimation problem, before the start of the controls. The cache
+            is recomputed if the parameters of these periods change.
+        checkpoint_max_bytes:
+            The maximum memory of the checkpoints after the prefix, in
+            bytes. The simulation of each period is kept as a checkpoint,
+            and the next simulation restarts from the end of the last period
+            with unchanged parameters, e.g. if an optimizer only changes
+            late controls. Checkpoints of the earliest periods are kept
+            first. `0` disables checkpoints, and `None` removes the limit.
+        checkpoints:
+            The checkpoints of the last simulation, of consecutive periods
+            from the first period. Includes the prefix.
+        batch_amici_edatas:
+            Copies of the AMICI experimental data of each period, for batch
+            simulations. Reused across batches.
+    """
+    def __init__(
+        self,
+        amici_model: 'amici.Model',
+        amici_solver: 'amici.Solver',
+        amici_edata_periods: List['amici.ExpData'],
+        period_start_times: Sequence[float],
+        sensitivity_columns_periods: List[SensitivityColumns],
+        sllh_size: int,
+        prefix_period_count: int = 0,
+        checkpoint_max_bytes: int = 0,
+    ):
+        """Set up the simulator.
+
+        Args:
+            amici_model:
+                See the class attributes.
+            amici_solver:
+                See the class attributes.
+            amici_edata_periods:
+                See the class attributes.
+            period_start_times:
+                See the class attributes.
+            sensitivity_columns_periods:
+                See the class attributes.
+            sllh_size:
+                See the class attributes.
+            prefix_period_count:
+                See the class attributes.
+            checkpoint_max_bytes:
+                See the class attributes.
+        """
+        self.amici_model = amici_model
+        self.amici_solver = amici_solver
+        self.amici_edata_periods = amici_edata_periods
+        self.period_start_times = period_start_times
+        self.sensitivity_columns_periods = sensitivity_columns_periods
+        self.sllh_size = sllh_size
+        self.prefix_period_count = prefix_period_count
+        self.checkpoint_max_bytes = checkpoint_max_bytes
+        self.checkpoints = []
+        self.batch_amici_edatas = []
+
+    def get_batch_edatas(
+        self,
+        period_index: int,
+        n_candidates: int,
+    ) -> List['amici.ExpData']:
+        """Get AMICI experimental data of a period, for a batch.
+
+        Args:
+            period_index:
+                The index of the period.
+            n_candidates:
+                The number of candidates in the batch.
+
+        Returns:
+            One AMICI experimental data object per candidate.
+        """
+        import amici
+
+        if not self.batch_amici_edatas:
+            self.batch_amici_edatas = [[] for _ in self.amici_edata_periods]
+        edatas = self.batch_amici_edatas[period_index]
+        while len(edatas) < n_candidates:
+            edatas.append(
+                amici.ExpData(self.amici_edata_periods[period_index])
+            )
+        return edatas[:n_candidates]
+
+    def get_period_key(
+        self,
+        parameters: np.ndarray,
+        fixed_parameters: np.ndarray,
+    ) -> Tuple:
+        """Identify the simulation of a period.
+
+        The key does not depend on the initial state, so a checkpoint is
+        only valid if the checkpoints of all earlier periods are valid. The
+        key does not depend on the sensitivity order either, which is
+        checked separately (see `Checkpoint.sensitivity_order`).
+
+        Args:
+            parameters:
+                The model parameters, on parameter scale.
+            fixed_parameters:
+                The fixed parameters.
+
+        Returns:
+            The key.
+        """
+        return (
+            np.asarray(parameters, dtype=float).tobytes(),
+            np.asarray(fixed_parameters, dtype=float).tobytes(),
+        )
+
+    def simulate_periods(
+        self,
+        parameters_periods: Sequence[Tuple[np.ndarray, np.ndarray]],
+        keep_rdatas: bool = False,
+    ) -> List[Checkpoint]:
+        """Simulate all periods, restarting from the checkpoints.
+
+        Args:
+            parameters_periods:
+                The model parameters on parameter scale, and the fixed
+                parameters, of each period. Can be the leading periods only,
+                e.g. the prefix.
+            keep_rdatas:
+                Whether to keep the AMICI return data of each period, e.g.
+                for the trajectories or residuals.
+
+        Returns:
+            The simulation of each period. Periods after a failed simulation
+            are not simulated, so are missing. Restored checkpoints may have
+            sensitivities of a higher order than the solver.
+        """
+        sensitivity_order = int(self.amici_solver.getSensitivityOrder())
+        period_keys = [
+            self.get_period_key(parameters, fixed_parameters)
+            for parameters, fixed_parameters in parameters_periods
+        ]
+        checkpoints = []
+        for checkpoint, period_key in zip(self.checkpoints, period_keys):
+            if (
+                checkpoint.key != period_key
+                or checkpoint.sensitivity_order < sensitivity_order
+                or (keep_rdatas and checkpoint.rdata is None)
+            ):
+                break
+            checkpoints.append(checkpoint)
+
+        simulated_checkpoints, = self._simulate_periods(
+            parameters_periods_candidates=[parameters_periods],
+            period_keys_candidates=[period_keys],
+            period_indices=range(len(checkpoints), len(parameters_periods)),
+            initial_checkpoint=checkpoints[-1] if checkpoints else None,
+            keep_rdatas=keep_rdatas,
+        )
+        self._store_checkpoints(
+            checkpoints=checkpoints,
+            simulated_checkpoints=simulated_checkpoints,
+        )
+        return [*checkpoints, *simulated_checkpoints]
+
+    def simulate_periods_batch(
+        self,
+        parameters_periods_candidates: Sequence[
+            Sequence[Tuple[np.ndarray, np.ndarray]]
+        ],
+        num_threads: int = 1,
+    ) -> List[List[Checkpoint]]:
+        """Simulate all periods for many candidates.
+
+        The leading periods with the same parameters for all candidates,
+        e.g. the prefix, are simulated once with `simulate_periods`, so
+        restart from the checkpoints. Each later period is one
+        `amici.runAmiciSimulations` call for all candidates that have not
+        failed yet.
+
+        Args:
+            parameters_periods_candidates:
+                The parameters of each period, of each candidate. See
+                `simulate_periods`.
+            num_threads:
+                The number of threads of `amici.runAmiciSimulations`.
+                Requires an AMICI installation with OpenMP.
+
+        Returns:
+            The simulation of each period, of each candidate. See
+            `simulate_periods`.
+        """
+        period_keys_candidates = [
+            [
+                self.get_period_key(parameters, fixed_parameters)
+                for parameters, fixed_parameters in parameters_periods
+            ]
+            for parameters_periods in parameters_periods_candidates
+        ]
+        shared_period_count = 0
+        for period_keys in zip(*period_keys_candidates):
+            if any(key != period_keys[0] for key in period_keys):
+                break
+            shared_period_count += 1
+
+        shared_checkpoints = self.simulate_periods(
+            parameters_periods_candidates[0][:shared_period_count],
+        )
+        initial_checkpoint = None
+        if shared_checkpoints:
+            initial_checkpoint = shared_checkpoints[-1]
+        if initial_checkpoint is not None and np.isnan(initial_checkpoint.llh):
+            checkpoints_candidates = [
+                [] for _ in parameters_periods_candidates
+            ]
+        else:
+            checkpoints_candidates = self._simulate_periods(
+                parameters_periods_candidates=parameters_periods_candidates,
+                period_keys_candidates=period_keys_candidates,
+                period_indices=range(
+                    shared_period_count,
+                    len(parameters_periods_candidates[0]),
+                ),
+                initial_checkpoint=initial_checkpoint,
+                keep_rdatas=False,
+                num_threads=num_threads,
+            )
+        return [
+            [*shared_checkpoints, *checkpoints]
+            for checkpoints in checkpoints_candidates
+        ]
+
+    def _store_checkpoints(
+        self,
+        checkpoints: List[Checkpoint],
+        simulated_checkpoints: List[Checkpoint],
+    ) -> None:
+        """Keep the prefix, and later checkpoints within the memory limit.
+
+        Args:
+            checkpoints:
+                The restored checkpoints, of consecutive periods from the
+                first period.
+            simulated_checkpoints:
+                The checkpoints of the periods that follow.
+        """
+        # The checkpoints of later periods remain valid.
+        if not simulated_checkpoints:
+            return
+        checkpoints = list(checkpoints)
+        nbytes = sum(
+            checkpoint.nbytes
+            for checkpoint in checkpoints[self.prefix_period_count:]
+        )
+        for checkpoint in simulated_checkpoints:
+            # Later periods cannot be restored without this period.
+            if np.isnan(checkpoint.llh):
+                break
+            if len(checkpoints) >= self.prefix_period_count:
+                nbytes += checkpoint.nbytes
+                if (
+                    self.checkpoint_max_bytes is not None
+                    and nbytes > self.checkpoint_max_bytes
+                ):
+                    break
+            checkpoints.append(checkpoint)
+        self.checkpoints = checkpoints
+
+    def _simulate_periods(
+        self,
+        parameters_periods_candidates: Sequence[
+            Sequence[Tuple[np.ndarray, np.ndarray]]
+        ],
+        period_keys_candidates: Sequence[Sequence[Tuple]],
+        period_indices: Sequence[int],
+        initial_checkpoint: Checkpoint,
+        keep_rdatas: bool,
+        num_threads: int = 1,
+    ) -> List[List[Checkpoint]]:
+        """Simulate consecutive periods, for one or many candidates.
+
+        Each period is one AMICI simulation per candidate that has not
+        failed yet. The simulations of many candidates are one
+        `amici.runAmiciSimulations` call.
+
+        Args:
+            parameters_periods_candidates:
+                The parameters of each period, of each candidate. See
+                `simulate_periods`.
+            period_keys_candidates:
+                The key of each period, of each candidate. See
+                `get_period_key`.
+            period_indices:
+                The periods to simulate.
+            initial_checkpoint:
+                The simulation of the period before the first simulated
+                period, which provides the initial state and state
+                sensitivities of all candidates. `None` for the initial state
+                of the model.
+            keep_rdatas:
+                See `simulate_periods`.
+            num_threads:
+                See `simulate_periods_batch`.
+
+        Returns:
+            The simulation of each period, of each candidate, until a
+            simulation of the candidate fails.
+        """
+        import amici
+
+        n_candidates = len(parameters_periods_candidates)
+        checkpoints_candidates = [[] for _ in range(n_candidates)]
+        states = [(None, None)] * n_candidates
+        if initial_checkpoint is not None:
+            states = [
+                (initial_checkpoint.x, initial_checkpoint.sx)
+            ] * n_candidates
+        active = list(range(n_candidates))
+        for period_index in period_indices:
+            if not active:
+                break
+            sensitivity_columns = \
+                self.sensitivity_columns_periods[period_index]
+            plist = sensitivity_columns.plist
+            amici_edatas = [self.amici_edata_periods[period_index]]
+            if n_candidates > 1:
+                amici_edatas = self.get_batch_edatas(
+                    period_index=period_index,
+                    n_candidates=len(active),
+                )
+            for candidate_index, amici_edata in zip(active, amici_edatas):
+                x0, sx0 = states[candidate_index]
+                # Sources and columns that are added in this period have zero
+                # initial state sensitivities.
+                if x0 is not None:
+                    rows = sensitivity_columns.sx_rows
+                    mapped_sx0 = np.zeros((len(plist), len(x0)))
+                    if sx0 is not None:
+                        mapped_sx0[rows != -1] = sx0[rows[rows != -1]]
+                    sx0 = mapped_sx0
+
+                parameters_periods = \
+                    parameters_periods_candidates[candidate_index]
+                parameters, fixed_parameters = parameters_periods[period_index]
+                set_start_time(
+                    self.amici_model,
+                    amici_edata,
+                    self.period_start_times[period_index],
+                )
+                amici_edata.parameters = parameters
+                amici_edata.fixedParameters = fixed_parameters
+                amici_edata.plist = plist
+                amici_edata.x0 = x0 if x0 is not None else []
+                amici_edata.sx0 = (
+                    sx0.flatten()
+                    if sx0 is not None and len(plist)
+                    else []
+                )
+
+            if n_candidates == 1:
+                rdatas = [amici.runAmiciSimulation(
+                    self.amici_model,
+                    self.amici_solver,
+                    amici_edatas[0],
+                )]
+            else:
+                rdatas = amici.runAmiciSimulations(
+                    self.amici_model,
+                    self.amici_solver,
+                    amici_edatas,
+                    failfast=False,
+                    num_threads=num_threads,
+                )
+
+            next_active = []
+            for candidate_index, rdata in zip(active, rdatas):
+                checkpoint = self._get_checkpoint(
+                    rdata=rdata,
+                    key=period_keys_candidates[candidate_index][period_index],
+                    sensitivity_columns=sensitivity_columns,
+                    keep_rdata=keep_rdatas,
+                )
+                checkpoints_candidates[candidate_index].append(checkpoint)
+                if np.isnan(checkpoint.llh):
+                    continue
+                states[candidate_index] = (checkpoint.x, checkpoint.sx)
+                next_active.append(candidate_index)
+            active = next_active
+        return checkpoints_candidates
+
+    def _get_checkpoint(
+        self,
+        rdata: 'amici.ReturnData',
+        key: Tuple,
+        sensitivity_columns: SensitivityColumns,
+        keep_rdata: bool,
+    ) -> Checkpoint:
+        """Get the checkpoint of a simulated period.
+
+        Args:
+            rdata:
+                The AMICI return data of the period.
+            key:
+                See `Checkpoint.key`.
+            sensitivity_columns:
+                The sensitivity columns of the period.
+            keep_rdata:
+                Whether to keep the AMICI return data.
+
+        Returns:
+            The checkpoint.
+        """
+        import amici
+
+        kept_rdata = rdata if keep_rdata else None
+        sensitivity_order = int(self.amici_solver.getSensitivityOrder())
+        if rdata.status != amici.AMICI_SUCCESS:
+            return Checkpoint(
+                key=key,
+                sensitivity_order=sensitivity_order,
+                llh=np.nan,
+                sllh=None,
+                x=None,
+                sx=None,
+                rdata=kept_rdata,
+            )
+
+        sllh = None
+        if rdata.sllh is not None:
+            columns = sensitivity_columns.sllh_columns
+            sllh = np.zeros(self.sllh_size)
+            sllh[columns[columns != -1]] = \
+                sensitivity_columns.subtract(rdata.sllh)[columns != -1]
+        sx = None
+        if rdata.sx is not None:
+            sx = sensitivity_columns.subtract(np.asarray(rdata.sx[-1]).T).T
+        return Checkpoint(
+            key=key,
+            sensitivity_order=sensitivity_order,
+            llh=rdata.llh,
+            sllh=sllh,
+            x=np.array(rdata.x[-1]),
+            sx=sx,
+            rdata=kept_rdata,
+        )
@@ -1,6 +1,9 @@
+import copy
+import hashlib
 from pathlib import Path
 from typing import Dict, List, Sequence, Union
 
+import libsbml
 from more_itertools import one
 import numpy as np
 import pandas as pd
@@ -9,6 +12,7 @@ from petab import (
     get_condition_df,
     get_parameter_df,
 )
+from petab.models.sbml_model import SbmlModel
 from petab.C import (
     CONDITION_ID,
     NOMINAL_VALUE,
@@ -40,9 +44,11 @@ from .constants import (
     CONTROL_ID,
     VALUE,
 )
+from .controls import ControlSet, get_control_set
 from .misc import (
     problem_experimental_conditions,
 )
+from .sbml import get_control_default_parameter_id
 
 
 class TimeHorizonProblem(petab.Problem):
@@ -63,36 +69,152 @@ class TimeHorizonProblem(petab.Problem):
         )
 
 
-def get_switch_condition_id(
-    switch_id: str,
-) -> str:
-    return f'condition_{switch_id}'
+def get_switch_condition_id(time: float) -> str:
+    """Get the ID of the condition that sets the switches at some time.
+
+    Args:
+        time:
+            The control time.
+
+    Returns:
+        The condition ID.
+    """
+    return f'switch_condition__time__{get_slug(float(time))}'
 
 
 def get_switch_condition_df(
-    switch_ids: Sequence[str],
-    #target_values: Sequence[float],
-    #condition_ids: Sequence[str],
-):
-    columns = np.diag(len(switch_ids))
-    df = pd.DataFrame(data={
-        #CONDITION_ID: condition_ids,
-        CONDITION_ID: [
-            get_switch_condition_id(switch_id)
-            for switch_id in switch_ids
-        ],
-        **{
-            switch_ids[index]: columns[:, index]
-            for index in range(len(switch_ids))
-        },
-    })
+    parameter_controls: Union[
+        ControlSet,
+        Dict[str, Sequence['ParameterControl']],
+    ],
+) -> pd.DataFrame:
+    """Get the conditions that set the switch parameters.
+
+    Args:
+        parameter_controls:
+            The controls.
+
+    Returns:
+        One condition per distinct control time, in order of time. The
+        switch parameter of each control is `1` while the control is active,
+        else `0`.
+    """
+    control_set = get_control_set(parameter_controls)
+    times = np.unique(control_set.times)
+    switches = np.zeros((len(times), len(control_set)))
+    for indices in control_set.get_active_indices(times).values():
+        active = indices >= 0
+        switches[np.flatnonzero(active), indices[active]] = 1
+    df = pd.DataFrame(
+        data=switches,
+        columns=control_set.switch_parameter_ids,
+        index=pd.Index(
+            [get_switch_condition_id(time) for time in times],
+            name=CONDITION_ID,
+        ),
+    )
     return petab.get_condition_df(df)
 
 
 def get_switch_timecourse_df(
-    switch_ids: Sequence[str],
+    parameter_controls: Union[
+        ControlSet,
+        Dict[str, Sequence['ParameterControl']],
+    ],
+    timecourse_id: str,
 ) -> pd.DataFrame:
-    pass
+    """Get the timecourse that applies the switch conditions.
+
+    Args:
+        parameter_controls:
+            The controls.
+        timecourse_id:
+            The ID of the timecourse.
+
+    Returns:
+        The timecourse table, with the conditions of
+        `get_switch_condition_df` at their times.
+    """
+    control_set = get_control_set(parameter_controls)
+    return get_timecourse_df(pd.DataFrame(data={
+        TIMECOURSE_ID: [timecourse_id],
+        TIMECOURSE: [
+            PERIOD_DELIMITER.join([
+                f'{time}:{get_switch_condition_id(time)}'
+                for time in map(float, np.unique(control_set.times))
+            ]),
+        ],
+    }))
+
+
+def derive_petab_problem(
+    petab_problem: petab.Problem,
+    clone_model: bool = True,
+) -> petab.Problem:
+    """Create a PEtab problem that shares the tables of another problem.
+
+    This is a cheap alternative to `copy.deepcopy`, for problems that are
+    derived from another problem by replacing some tables. Tables are shared
+    until they are replaced, so tables of the derived problem must be
+    replaced rather than edited in-place, e.g. with `pandas.DataFrame.assign`
+    instead of item assignment.
+
+    Args:
+        petab_problem:
+            The PEtab problem.
+        clone_model:
+            Whether to clone the SBML document, e.g. if the model of the
+            derived problem is edited. Otherwise, the model is also shared.
+
+    Returns:
+        The derived PEtab problem.
+    """
+    derived_petab_problem = copy.copy(petab_problem)
+    derived_petab_problem.extensions_config = \
+        copy.copy(petab_problem.extensions_config)
+    if clone_model:
+        sbml_document = petab_problem.sbml_document.clone()
+        derived_petab_problem.model = SbmlModel(
+            sbml_model=sbml_document.getModel(),
+            sbml_document=sbml_document,
+            model_id=petab_problem.model.model_id,
+        )
+    return derived_petab_problem
+
+
+def get_structural_hash(petab_problem: petab.Problem) -> str:
+    """Get a hash of the parts of a PEtab problem that affect compilation.
+
+    The hash covers the SBML model, the observables, the parameters that
+    are set by the conditions table, and the estimated parameters, since
+    AMICI compiles parameters that are not estimated as constants. Parameter
+    values and measurements are not covered, so problems that only differ
+    in these share a hash.
+
+    Args:
+        petab_problem:
+            The PEtab problem.
+
+    Returns:
+        The hash, as a hexadecimal string.
+    """
+    condition_columns = [
+        # Numeric condition table columns become fixed parameters in AMICI.
+        f'{column}:{pd.api.types.is_numeric_dtype(dtype)}'
+        for column, dtype in petab_problem.condition_df.dtypes.items()
+    ]
+    estimated_parameter_ids = []
+    if petab_problem.parameter_df is not None:
+        estimated_parameter_ids = sorted(petab_problem.parameter_df.index[
+            petab_problem.parameter_df[ESTIMATE] == 1
+        ])
+    structure = '\n'.join([
+        libsbml.writeSBMLToString(petab_problem.sbml_document),
+        petab_problem.observable_df.to_csv(sep='\t'),
+        '\t'.join(condition_columns),
+        '\t'.join(estimated_parameter_ids),
+    ])
+    return hashlib.sha256(structure.encode()).hexdigest()
 
 
 def read_control_df(
@@ -108,7 +230,14 @@ def read_control_df(
         The control dataframe.
     """
     if not isinstance(df, pd.DataFrame):
-        df = pd.read_csv(df, sep='\t', float_precision='round_trip')
+        df = pd.read_csv(
+            df,
+            sep='\t',
+            float_precision='round_trip',
+            # Times of multiple periods are delimited strings, so a file
+            # without such times must not be parsed as numbers.
+            dtype={TIME: str},
+        )
     petab.lint.assert_no_leading_trailing_whitespace(
         df.columns.values,
         CONTROL,
@@ -137,18 +266,42 @@ def write_control_df(df: pd.DataFrame, filename: str) -> None:
 
 
 def parameter_controls_to_formulae(
-    # FIXME reorganize code to remove circular dependencies
-    # TODO make a class for sets of parameter controls, grouped by parameter ID
-    parameter_controls: Dict[str, Sequence['ParameterControl']],
+    parameter_controls: Union[
+        ControlSet,
+        Dict[str, Sequence['ParameterControl']],
+    ],
 ) -> Dict[str, str]:
+    """Get the formulae of parameters that are controlled by switches.
+
+    Each controlled parameter is the sum of the switch parameter of each of
+    its controls, multiplied by the control parameter. While all switches of
+    a parameter are off, i.e. before its first control, the parameter takes
+    its value before any control.
+
+    Args:
+        parameter_controls:
+            The controls.
+
+    Returns:
+        Keys are the IDs of the controlled parameters, values are the
+        formulae.
+    """
+    control_set = get_control_set(parameter_controls)
     formulae = {}
-    for parameter_id, controls in parameter_controls.items():
-        formula = ' + '.join([
-            f'{control.get_switch_parameter_id()}*'
-            f'{control.get_control_parameter_id()}'
-            for control in controls
+    for parameter_id, rows in control_set.target_rows.items():
+        switch_ids = control_set.switch_parameter_ids[rows]
+        switches = ' + '.join(switch_ids)
+        formulae[parameter_id] = ' + '.join([
+            *[
+                f'{switch_id}*{control_parameter_id}'
+                for switch_id, control_parameter_id in zip(
+                    switch_ids,
+                    control_set.control_parameter_ids[rows],
+                )
+            ],
+            f'(1 - ({switches}))*'
+            f'{get_control_default_parameter_id(parameter_id)}',
         ])
-        formulae[parameter_id] = formula
     return formulae
 
 
@@ -241,63 +394,28 @@ def parameter_controls_to_parameter_df(
 #
 #    return condition_df, timecourse_df
 
-def get_controls_at_timepoint(
-    parameter_controls,  # typehint
-    timepoint: float,
-) -> Dict[str, str]:
-    sorted_controls = {
-        parameter_id: sorted(
-            controls,
-            key=lambda control: control.time,
-        )
-        for parameter_id, controls in parameter_controls.items()
-    }
-    controls = {control_id: None for control_id in sorted_controls}
-    for control_id in controls:
-        for control_index, control in enumerate(sorted_controls[control_id]):
-            if (
-                # Current control is at or before the timepoint
-                control.time <= timepoint
-                and (
-                    # Next control is after the timepoint
-                    (
-                        control_index + 1 < len(sorted_controls[control_id])
-                        and sorted_controls[control_id][control_index + 1].time > timepoint
-                    )
-                    # Or this is the last control
-                    or (
-                        control_index + 1 == len(sorted_controls[control_id])
-                    )
-                )
-            ):
-                controls[control_id] = control
-                break
-    return controls
-
 def parameter_controls_to_timecourse_new(
-    parameter_controls: Dict[str, Sequence['ParameterControl']],
+    parameter_controls: Union[
+        ControlSet,
+        Dict[str, Sequence['ParameterControl']],
+    ],
     petab_problem: petab.Problem,
     petab_control_problem: 'petab_control.Problem',
     timecourse_id: str,
 ) -> List[pd.DataFrame]:
     # FIXME currently assumes only one experimental condition
     #       (asserted in `petab_control.Problem.__init__`)
-    #print(problem_experimental_conditions(problem))
-    #condition_id = one(problem_experimental_conditions(problem))
-    #condition_id = "timecourse1"
+    control_set = get_control_set(parameter_controls)
+
     condition_template = {}
     if timecourse_id in petab_problem.condition_df.index:
         condition_template = dict(petab_problem.condition_df.loc[timecourse_id])
 
-    times = sorted(set(
-        control.time
-        for controls in parameter_controls.values()
-        for control in controls
-    ))
+    times = np.unique(control_set.times)
 
     timecourse_condition_ids = {
         time: f'timecourse_condition_{get_slug(time)}'
-        for time in times
+        for time in map(float, times)
     }
 
     timecourse_data = {
@@ -311,50 +429,40 @@ def parameter_controls_to_timecourse_new(
     }
     timecourse_df = get_timecourse_df(pd.DataFrame(data=timecourse_data))
 
-    condition_data = [
-        {
-            CONDITION_ID: timecourse_condition_id,
-            **condition_template,
-
-            **{
-                parameter_id: (
-                    control.get_control_parameter_id()
-                    if control is not None
-                    else None
-                )
-                for parameter_id, control in get_controls_at_timepoint(
-                    parameter_controls,
-                    time,
-                ).items()
-            }
-        }
-        for time, timecourse_condition_id in timecourse_condition_ids.items()
-    ]
-    condition_data.append({
-        CONDITION_ID: timecourse_id,
-    })
-
-    condition_df = get_condition_df(pd.DataFrame(data=condition_data))
-
-    parameter_data = [
-        {
-            PARAMETER_ID: control.get_control_parameter_id(),
-            **petab_control_problem.control_parameter_df.loc[parameter_id].to_dict(),
-            NOMINAL_VALUE: (
-                control.value
-                if control.value != ESTIMATE
-                else None
-            ),
-            ESTIMATE: int(control.value == ESTIMATE),
-            CONTROL_TARGET: control.target_id,
-            CONTROL_TIME: control.time,
-        }
-        for parameter_id, controls in parameter_controls.items()
-        for control in controls
-    ]
-    #for parameter_id in parameter_controls:
-    #    print(petab_control_problem.control_parameter_df.loc[parameter_id].to_dict())
-
-    parameter_df = get_parameter_df(pd.DataFrame(data=parameter_data))
+    # One column per condition table column, with one row per control time.
+    condition_data = {
+        CONDITION_ID: list(timecourse_condition_ids.values()),
+        **{
+            column: [value] * len(times)
+            for column, value in condition_template.items()
+        },
+    }
+    # Index `-1` (no active control) selects the trailing `None`.
+    control_parameter_ids = np.append(control_set.control_parameter_ids, None)
+    for parameter_id, indices in control_set.get_active_indices(times).items():
+        condition_data[parameter_id] = control_parameter_ids[indices]
+
+    condition_df = get_condition_df(pd.concat([
+        pd.DataFrame(data=condition_data),
+        pd.DataFrame(data={CONDITION_ID: [timecourse_id]}),
+    ], ignore_index=True))
+
+    # The control parameters inherit the estimation problem of their target.
+    parameter_df = (
+        petab_control_problem.control_parameter_df
+        .loc[control_set.target_ids]
+        .iloc[control_set.target_indices]
+        .reset_index(drop=True)
+    )
+    parameter_df.insert(0, PARAMETER_ID, control_set.control_parameter_ids)
+    parameter_df[NOMINAL_VALUE] = control_set.numeric_values
+    parameter_df[ESTIMATE] = control_set.estimate.astype(int)
+    parameter_df[CONTROL_TARGET] = np.array(
+        control_set.target_ids,
+        dtype=object,
+    )[control_set.target_indices]
+    parameter_df[CONTROL_TIME] = control_set.times
+
+    parameter_df = get_parameter_df(parameter_df)
 
     return condition_df, parameter_df, timecourse_df
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, List, Sequence, Union
 
@@ -30,15 +31,25 @@ from .constants import (
     ESTIMATE,
     TYPE_PATH,
 
+    CONTROL_TARGET,
     CONTROL_TIME,
 
     CATEGORY,
+    ENCODING_EVENTS,
     ORIGINAL,
 )
 from .misc import (
     problem_experimental_conditions,
 )
-from .problem import Problem
+from .petab import derive_petab_problem
+from .problem import (
+    Problem,
+    get_control_events_petab_problem,
+)
+
+
+# The categories of measurements and parameters in a combined PEtab problem.
+CATEGORY_DTYPE = pd.CategoricalDtype([ORIGINAL, CONTROL])
 
 
 def control_problem_to_petab_timecourse_problem(
@@ -111,49 +122,353 @@ def control_problem_yaml_to_petab_problem(
 
 
 def get_combined_petab_problem(
-    control_yaml,
-    petab_yaml,
+    control_yaml: TYPE_PATH,
+    petab_yaml: Union[petab.Problem, TYPE_PATH],
+    timecourse_id: str = None,
+    encoding: str = ENCODING_EVENTS,
 ) -> petab.Problem:
-    original_petab_problem = petab.Problem.from_yaml(str(petab_yaml))
-    control_petab_problem = \
-        control_problem_yaml_to_petab_problem(
-            control_yaml,
-            petab_yaml,
-        )
-    original_petab_problem.measurement_df[CATEGORY] = ORIGINAL
-    control_petab_problem.measurement_df[CATEGORY] = CONTROL
-    original_petab_problem.parameter_df[CATEGORY] = ORIGINAL
-    control_petab_problem.parameter_df[CATEGORY] = CONTROL
-
-    combined_petab_problem = \
-        control_problem_yaml_to_petab_problem(
-            control_yaml,
-            petab_yaml,
+    """Combine a PEtab problem and its PEtab Control problem.
+
+    The original parameters remain estimated, so the combined problem can be
+    used to alternately fit the original parameters and optimize the
+    controls, e.g. with `get_finite_petab_problem` and
+    `get_finite_control_petab_problem`.
+
+    Each input file is read once, and the control problem is built once.
+    The IDs of the control parameters must differ from the IDs of the
+    original parameters.
+
+    Args:
+        control_yaml:
+            The location of the PEtab Control YAML file.
+        petab_yaml:
+            The original PEtab problem, or the location of its YAML file.
+        timecourse_id:
+            See `get_control_events_petab_problem`.
+        encoding:
+            See `get_control_events_petab_problem`.
+
+    Returns:
+        The combined PEtab problem. The measurement and parameter tables have
+        a categorical `CATEGORY` column, which is `ORIGINAL` for the
+        original measurements and parameters, and `CONTROL` for the control
+        objective measurements and the controls.
+    """
+    original_petab_problem = petab_yaml
+    if not isinstance(original_petab_problem, petab.Problem):
+        original_petab_problem = petab.Problem.from_yaml(str(petab_yaml))
+    control_problem = Problem.from_yaml(yaml_path=control_yaml)
+
+    original_parameter_df = original_petab_problem.parameter_df
+    # Only used to build the control problem; the original parameters remain
+    # estimated in the combined problem.
+    unscaled_parameters0 = dict(original_parameter_df.loc[
+        original_parameter_df[ESTIMATE] == 1,
+        NOMINAL_VALUE,
+    ])
+    combined_petab_problem = get_control_events_petab_problem(
+        petab_control_problem=control_problem,
+        petab_problem=original_petab_problem,
+        unscaled_parameters0=unscaled_parameters0,
+        timecourse_id=timecourse_id,
+        consolidate_events=True,
+        encoding=encoding,
+    )
+
+    parameter_df = combined_petab_problem.parameter_df
+    control_parameter_df = parameter_df.loc[
+        parameter_df[CONTROL_TARGET].notna()
+    ]
+    colliding_parameter_ids = \
+        control_parameter_df.index.intersection(original_parameter_df.index)
+    if not colliding_parameter_ids.empty:
+        raise ValueError(
+            'The IDs of some control parameters are also IDs of parameters '
+            'of the original PEtab problem. Please rename the original '
+            f'parameters: {list(colliding_parameter_ids)}'
         )
     combined_petab_problem.measurement_df = pd.concat([
-        original_petab_problem.measurement_df,
-        control_petab_problem.measurement_df,
-    ])
+        original_petab_problem.measurement_df.assign(**{CATEGORY: ORIGINAL}),
+        combined_petab_problem.measurement_df.assign(**{CATEGORY: CONTROL}),
+    ], ignore_index=True).astype({CATEGORY: CATEGORY_DTYPE})
     combined_petab_problem.parameter_df = pd.concat([
-        original_petab_problem.parameter_df,
-        control_petab_problem.parameter_df,
-    ])
+        original_parameter_df.assign(**{CATEGORY: ORIGINAL}),
+        control_parameter_df.assign(**{CATEGORY: CONTROL}),
+    ]).astype({CATEGORY: CATEGORY_DTYPE})
     return combined_petab_problem
 
 
+INCLUSIVE_OPTIONS = ['both', 'neither', 'left', 'right']
+
+
+class TimeIndex():
+    """Time-sorted positions of the rows of a table.
+
+    Attributes:
+        times:
+            The sorted times. Missing times are sorted last.
+        positions:
+            The positions of the rows in the table, in order of `times`.
+    """
+    def __init__(self, times: pd.Series):
+        """Sort the times.
+
+        Args:
+            times:
+                The time of each row of the table.
+        """
+        times = times.to_numpy(dtype=float)
+        self.positions = np.argsort(times, kind='stable')
+        self.times = times[self.positions]
+
+    def get_bounds(
+        self,
+        t0: float,
+        t1: float,
+        inclusive: str = 'left',
+    ) -> slice:
+        """Get the sorted positions of rows in a time window.
+
+        Args:
+            t0:
+                The start of the time window.
+            t1:
+                The end of the time window.
+            inclusive:
+                How the bounds `t0` and `t1` are treated, as in
+                `pandas.Series.between`.
+
+        Returns:
+            The slice of `positions` (or of the table, if the table is
+            sorted) with the rows in the time window.
+        """
+        if inclusive not in INCLUSIVE_OPTIONS:
+            raise ValueError(
+                f'Unknown option `inclusive={inclusive}`. Available options: '
+                f'{INCLUSIVE_OPTIONS}'
+            )
+        start = np.searchsorted(
+            self.times,
+            t0,
+            side='left' if inclusive in ['both', 'left'] else 'right',
+        )
+        stop = np.searchsorted(
+            self.times,
+            t1,
+            side='right' if inclusive in ['both', 'right'] else 'left',
+        )
+        return slice(start, max(start, stop))
+
+    def get_mask(
+        self,
+        t0: float,
+        t1: float,
+        inclusive: str = 'left',
+    ) -> np.ndarray:
+        """Get the rows of the table in a time window.
+
+        Args:
+            t0:
+                See `get_bounds`.
+            t1:
+                See `get_bounds`.
+            inclusive:
+                See `get_bounds`.
+
+        Returns:
+            A boolean mask of the rows of the table.
+        """
+        mask = np.zeros(len(self.positions), dtype=bool)
+        mask[self.positions[self.get_bounds(t0, t1, inclusive)]] = True
+        return mask
+
+
+class FiniteHorizonIndex():
+    """Time windows of a combined PEtab problem.
+
+    The measurements of each category are sorted by time once, so the
+    measurements of a time window are a slice of the sorted measurements.
+    Windows are created without editing the combined problem, so many
+    windows can be created from the same combined problem.
+
+    Attributes:
+        petab_problem:
+            The combined PEtab problem (e.g. the returned value from the
+            `petab_control.petab.get_combined_petab_problem` method).
+        measurement_dfs:
+            Keys are `ORIGINAL` and `CONTROL`, values are the measurements
+            that are used to fit parameters or optimize controls,
+            respectively, sorted by time.
+        measurement_indices:
+            The time index of each table in `measurement_dfs`.
+        control_time_index:
+            The time index of the parameters table, by control time.
+    """
+    def __init__(self, petab_problem: petab.Problem):
+        """Sort the tables.
+
+        Args:
+            petab_problem:
+                See the class attributes.
+        """
+        self.petab_problem = petab_problem
+        measurement_df = petab_problem.measurement_df
+        categories = measurement_df[CATEGORY]
+        self.measurement_dfs = {
+            # Fitting ignores the control measurements, and vice versa.
+            ORIGINAL: measurement_df.loc[categories != CONTROL],
+            CONTROL: measurement_df.loc[categories != ORIGINAL],
+        }
+        self.measurement_indices = {}
+        for category, category_measurement_df in self.measurement_dfs.items():
+            time_index = TimeIndex(category_measurement_df[TIME])
+            self.measurement_dfs[category] = \
+                category_measurement_df.iloc[time_index.positions]
+            self.measurement_indices[category] = time_index
+        self.control_time_index = TimeIndex(
+            petab_problem.parameter_df[CONTROL_TIME]
+        )
+
+    def get_window(
+        self,
+        category: str,
+        t0: float,
+        t1: float,
+        nominal_values: Dict[str, float] = None,
+        inclusive: str = 'left',
+    ) -> 'FiniteHorizonWindow':
+        """Get a time window.
+
+        Args:
+            category:
+                `ORIGINAL` to fit the original parameters, or `CONTROL` to
+                optimize the controls.
+            t0:
+                See `get_finite_petab_problem`.
+            t1:
+                See `get_finite_petab_problem`.
+            nominal_values:
+                See `get_finite_petab_problem`.
+            inclusive:
+                See `get_finite_petab_problem`.
+
+        Returns:
+            The window.
+        """
+        if category not in self.measurement_dfs:
+            raise ValueError(
+                f'Unknown category `{category}`. Available categories: '
+                f'{list(self.measurement_dfs)}'
+            )
+        return FiniteHorizonWindow(
+            index=self,
+            category=category,
+            t0=t0,
+            t1=t1,
+            nominal_values=nominal_values,
+            inclusive=inclusive,
+        )
+
+
+@dataclass(frozen=True)
+class FiniteHorizonWindow:
+    """A time window of a combined PEtab problem.
+
+    Attributes:
+        index:
+            The index of the combined PEtab problem.
+        category:
+            See `FiniteHorizonIndex.get_window`.
+        t0:
+            See `FiniteHorizonIndex.get_window`.
+        t1:
+            See `FiniteHorizonIndex.get_window`.
+        nominal_values:
+            See `FiniteHorizonIndex.get_window`.
+        inclusive:
+            See `FiniteHorizonIndex.get_window`.
+    """
+    index: FiniteHorizonIndex
+    category: str
+    t0: float
+    t1: float
+    nominal_values: Dict[str, float] = None
+    inclusive: str = 'left'
+
+    @property
+    def measurement_df(self) -> pd.DataFrame:
+        """The measurements in the window."""
+        return self.index.measurement_dfs[self.category].iloc[
+            self.index.measurement_indices[self.category].get_bounds(
+                t0=self.t0,
+                t1=self.t1,
+                inclusive=self.inclusive,
+            )
+        ]
+
+    @property
+    def parameter_df(self) -> pd.DataFrame:
+        """The parameters, with estimated flags and values of the window."""
+        parameter_df = self.index.petab_problem.parameter_df.copy()
+        categories = parameter_df[CATEGORY]
+        if self.category == ORIGINAL:
+            # Fix control parameters to zero.
+            parameter_df.loc[
+                categories == CONTROL,
+                [ESTIMATE, NOMINAL_VALUE],
+            ] = 0
+        else:
+            # Only estimate control parameters
+            parameter_df.loc[categories == ORIGINAL, ESTIMATE] = 0
+            # Only estimate control parameters for current future time
+            # window. Just in case, can prevent earlier "skipped" (never
+            # estimated in a finite horizon loop iteration) controls from
+            # being fixed to their value in the PEtab parameter table.
+            outside_window = ~self.index.control_time_index.get_mask(
+                t0=self.t0,
+                t1=self.t1,
+                inclusive=self.inclusive,
+            )
+            parameter_df.loc[outside_window, [ESTIMATE, NOMINAL_VALUE]] = 0
+
+        # Fix previously estimated parameters
+        if self.nominal_values is not None:
+            parameter_df.update(
+                pd.Series(self.nominal_values, name=NOMINAL_VALUE)
+            )
+        return parameter_df
+
+    def to_petab_problem(self) -> petab.Problem:
+        """Create the PEtab problem of the window.
+
+        Returns:
+            The PEtab problem, which shares all other tables and the model
+            with the combined PEtab problem.
+        """
+        petab_problem = derive_petab_problem(
+            self.index.petab_problem,
+            clone_model=False,
+        )
+        petab_problem.measurement_df = self.measurement_df
+        petab_problem.parameter_df = self.parameter_df
+        return petab_problem
+
+
 def get_finite_petab_problem(
     petab_problem: petab.Problem,
     t0: float,
     t1: float,
     nominal_values: Dict[str, float] = None,
     inclusive='left',
+    index: FiniteHorizonIndex = None,
 ) -> petab.Problem:
-    """Truncate a combined PEtab problem.
+    """Truncate a combined PEtab problem, to fit the original parameters.
 
     Args:
         petab_problem:
             A combined PEtab problem (e.g. the returned value from the
-            `petab_control.petab.get_combined_petab_problem` method).
+            `petab_control.petab.get_combined_petab_problem` method). Not
+            edited.
         t0:
             The start of the time window.
         t1:
@@ -164,38 +479,24 @@ def get_finite_petab_problem(
             nominal values (e.g. fix parameters to a previous estimate, for
             optimization of a subsequent fitting or optimal control).
         inclusive:
-            How the bounds `t0` and `t1` are treated (passed on to the
+            How the bounds `t0` and `t1` are treated (as in the
             `pandas.Series.between` method).
+        index:
+            The index of the combined PEtab problem. Reuse the same index
+            for many windows, to sort the tables only once.
 
     Returns:
         The truncated PEtab problem.
     """
-    # Fix control parameters to zero.
-    petab_problem.parameter_df[ESTIMATE].loc[
-        petab_problem.parameter_df[CATEGORY] == CONTROL
-    ] = 0
-    petab_problem.parameter_df[NOMINAL_VALUE].loc[
-        petab_problem.parameter_df[CATEGORY] == CONTROL
-    ] = 0
-    # Fix previously estimated control parameters
-    if nominal_values is not None:
-        nominal_values_series = pd.Series(nominal_values, name=NOMINAL_VALUE)
-        petab_problem.parameter_df.update(nominal_values_series)
-
-    petab_problem.measurement_df = petab_problem.measurement_df.loc[
-        petab_problem.measurement_df[TIME].between(
-            t0,
-            t1,
-            inclusive=inclusive,
-        )
-    ]
-    petab_problem.measurement_df.drop(
-        petab_problem.measurement_df.index[
-            petab_problem.measurement_df[CATEGORY] == CONTROL,
-        ],
-        inplace=True,
-    )
-    return petab_problem
+    if index is None:
+        index = FiniteHorizonIndex(petab_problem)
+    return index.get_window(
+        category=ORIGINAL,
+        t0=t0,
+        t1=t1,
+        nominal_values=nominal_values,
+        inclusive=inclusive,
+    ).to_petab_problem()
 
 
 def get_finite_control_petab_problem(
@@ -204,70 +505,34 @@ def get_finite_control_petab_problem(
     t1: float,
     nominal_values: Dict[str, float] = None,
     inclusive: str = 'left',
+    index: FiniteHorizonIndex = None,
 ) -> petab.Problem:
-    """Truncate a combined PEtab problem.
+    """Truncate a combined PEtab problem, to optimize the controls.
 
     Args:
         petab_problem:
-            A combined PEtab problem (e.g. the returned value from the
-            `petab_control.petab.get_combined_petab_problem` method).
+            See `get_finite_petab_problem`.
         t0:
-            The start of the time window.
+            See `get_finite_petab_problem`.
         t1:
-            The end of the time window.
+            See `get_finite_petab_problem`.
         nominal_values:
-            Update the PEtab problem parameter table nominal values with
-            a dictionary where keys are parameter IDs and values are
-            nominal values (e.g. fix parameters to a previous estimate, for
-            optimization of a subsequent fitting or optimal control).
+            See `get_finite_petab_problem`. Should never be `None` unless
+            optimal control is performed before fitting for some reason.
         inclusive:
-            How the bounds `t0` and `t1` are treated (passed on to the
-            `pandas.Series.between` method).
+            See `get_finite_petab_problem`.
+        index:
+            See `get_finite_petab_problem`.
 
     Returns:
         The truncated PEtab problem.
     """
-
-    # Only estimate control parameters
-    petab_problem.parameter_df[ESTIMATE].loc[
-        petab_problem.parameter_df[CATEGORY] == ORIGINAL
-    ] = 0
-    #petab_problem.parameter_df[NOMINAL_VALUE].loc[
-    #    petab_problem.parameter_df[CATEGORY] == ORIGINAL
-    #] = 0
-
-    # Only estimate control parameters for current future time window
-    desired_control_times = petab_problem.parameter_df[CONTROL_TIME].between(
-        t0,
-        t1,
+    if index is None:
+        index = FiniteHorizonIndex(petab_problem)
+    return index.get_window(
+        category=CONTROL,
+        t0=t0,
+        t1=t1,
+        nominal_values=nominal_values,
         inclusive=inclusive,
-    )
-    petab_problem.parameter_df[ESTIMATE].loc[~desired_control_times] = 0
-    # Just in case, can prevent earlier "skipped" (never estimated in a finite
-    # horizon loop iteration) controls from being fixed to
-    # their value in the PEtab parameter table.
-    petab_problem.parameter_df[NOMINAL_VALUE].loc[~desired_control_times] = 0
-
-    petab_problem.parameter_df[NOMINAL_VALUE].loc[~desired_control_times] = 0
-
-    # Should never be `None` unless optimal control is performed before fitting
-    # for some reason.
-    if nominal_values is not None:
-        nominal_values_series = pd.Series(nominal_values, name=NOMINAL_VALUE)
-        petab_problem.parameter_df.update(nominal_values_series)
-
-    # subset measurements
-    petab_problem.measurement_df = petab_problem.measurement_df.loc[
-        petab_problem.measurement_df[TIME].between(
-            t0,
-            t1,
-            inclusive=inclusive,
-        )
-    ]
-    petab_problem.measurement_df.drop(
-        petab_problem.measurement_df.index[
-            petab_problem.measurement_df[CATEGORY] == ORIGINAL,
-        ],
-        inplace=True,
-    )
-    return petab_problem
+    ).to_petab_problem()
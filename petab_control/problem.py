@@ -1,7 +1,10 @@
 import abc
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import copy
 from dataclasses import dataclass
-from typing import Any, Dict, List, Sequence, Union
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 import warnings
 
 import libsbml
@@ -9,10 +12,6 @@ from more_itertools import one
 import numpy as np
 import pandas as pd
 import petab
-#from amici.petab_objective import (
-#    LLH,
-#    SLLH,
-#)
 from petab import (
     get_measurement_df,
     get_observable_df,
@@ -75,17 +74,42 @@ from .constants import (
     #PARAMETER_CONTROL_ID,
     CONTROL_ID,
     PERIODS_RESULTS,
+    LLH,
+    SLLH,
+    ENCODING_EVENTS,
+    ENCODING_TIMECOURSE,
+    ENCODING_SWITCHES,
+    ENCODING_SWITCH_CONDITIONS,
+    ENCODINGS,
+    PETAB_CONTROL_PROBLEM,
+    ENCODED_PETAB_PROBLEM,
+)
+from .cache import (
+    METADATA_FILENAME,
+    get_cached,
+    get_files_hash,
+    read_petab_problem,
+    read_tables,
+    write_petab_problem,
+    write_tables,
 )
+from .controls import ControlSet, get_control_set
 from .misc import (
     parse_path,
     problem_experimental_conditions,
 )
 from .sbml import (
+    SbmlBatchEditor,
     add_parameter,
     add_assignment_rule,
+    get_control_default_parameter_id,
+    get_time_event_id,
+    set_control_parameters_not_constant,
 )
 from .petab import (
+    derive_petab_problem,
     get_switch_condition_df,
+    get_switch_timecourse_df,
     parameter_controls_to_formulae,
     parameter_controls_to_parameter_df,
     parameter_controls_to_timecourse_new,
@@ -201,6 +225,78 @@ class ParameterControl(Control):
         return f'control_event__{self.get_id()}'
 
 
+class ParameterControlSlot():
+    """The model entities for the n-th control of some parameter.
+
+    The control time and value are model parameters, so the model does not
+    depend on the control times and values.
+    """
+    def __init__(
+        self,
+        parameter_id: str,
+        index: int,
+    ):
+        self.target_id = parameter_id
+        self.index = index
+
+    def get_id(self) -> str:
+        return f'target__{self.target_id}__slot__{self.index}'
+
+    def get_value_parameter_id(self):
+        return f'control_value__{self.get_id()}'
+
+    def get_time_parameter_id(self):
+        return f'control_time__{self.get_id()}'
+
+    def get_event_id(self):
+        return f'control_event__{self.get_id()}'
+
+
+@dataclass
+class PeriodsParameters:
+    """The controls that are applied at the start of each timecourse period.
+
+    Attributes:
+        periods_parameters:
+            One dictionary per period. Keys are control parameter IDs, values
+            are the ID of the control that is applied at the start of the
+            period, or `None`.
+        control_parameters:
+            Keys are control IDs. Values are dictionaries with the `VALUE` of
+            the control, the `PERIODS` where it is applied, and the
+            `PARAMETER_ID` of the control parameter.
+        control_indices:
+            `periods_parameters` as an array of shape
+            (number of periods, number of control parameters). Entries are
+            indices into `control_ids`, or `-1` if the parameter is not
+            updated at the start of the period. Rows are not offset by the
+            start period index.
+        control_ids:
+            The control IDs, in order of their first period.
+        parameter_ids:
+            The control parameter IDs, in the order of the columns of
+            `control_indices`.
+    """
+    periods_parameters: List[Dict[str, str]]
+    control_parameters: Dict[str, Dict[str, Any]]
+    control_indices: np.ndarray
+    control_ids: List[str]
+    parameter_ids: List[str]
+
+
+def get_period_start_times(control_df: pd.DataFrame) -> np.ndarray:
+    """Get the start times of the control timecourse periods.
+
+    Args:
+        control_df:
+            The controls table.
+
+    Returns:
+        The sorted, unique control times, including `0`.
+    """
+    return np.unique(np.append(control_df[TIME].to_numpy(dtype=float), 0))
+
+
 class Problem():
     def __init__(
         self,
@@ -213,6 +309,11 @@ class Problem():
     ):
         self.problem_id = problem_id
 
+        # Incremented whenever the cached tables that are derived from
+        # `control_df` and `control_parameter_df` are invalidated.
+        self.tables_version = 0
+        self._cache = {}
+
         self.control_df = control_df
         self.control_parameter_df = control_parameter_df
         self.objective_observable_df = objective_observable_df
@@ -254,68 +355,212 @@ class Problem():
         #self.condition_id = one(condition_ids)
 
     @staticmethod
-    def from_yaml(yaml_path: TYPE_PATH) -> 'Problem':
+    def from_yaml(
+        yaml_path: TYPE_PATH,
+        problem_id: str = None,
+        cache_dir: TYPE_PATH = None,
+        max_workers: int = None,
+    ) -> 'Problem':
+        """Read a problem from a PEtab Control YAML file.
+
+        Args:
+            yaml_path:
+                The YAML file.
+            problem_id:
+                The ID of the problem. Required if the YAML file specifies
+                multiple problems.
+            cache_dir:
+                If specified, the parsed tables are cached in this
+                directory, under a hash of the YAML file and all files that
+                it references. Later calls with unchanged files read the
+                cached tables instead of parsing the files.
+            max_workers:
+                The number of threads that read the tables. Defaults to the
+                `concurrent.futures.ThreadPoolExecutor` default.
+
+        Returns:
+            The problem.
+        """
+        if cache_dir is not None:
+            return get_cached(
+                cache_dir=cache_dir,
+                key=get_files_hash(
+                    [yaml_path],
+                    cached=PETAB_CONTROL_PROBLEM,
+                    problem_id=problem_id,
+                ),
+                create=lambda: Problem.from_yaml(
+                    yaml_path,
+                    problem_id=problem_id,
+                    max_workers=max_workers,
+                ),
+                write=Problem.write_cache_entry,
+                read=Problem.read_cache_entry,
+            )
+
         yaml_path = parse_path(yaml_path)
-        petab_path = yaml_path.parent
+        problem_dicts = read_problem_dicts(yaml_path)
+        if problem_id is None:
+            if len(problem_dicts) != 1:
+                raise KeyError(
+                    'Please specify the problem ID when using a specification '
+                    'with multiple control problems. Problem IDs: '
+                    f'{list(problem_dicts)}'
+                )
+            problem_id = one(problem_dicts)
+
+        return Problem.from_problem_dict(
+            problem_dict=problem_dicts[problem_id],
+            petab_path=yaml_path.parent,
+            max_workers=max_workers,
+        )
 
-        with open(yaml_path, 'r') as f:
-            yaml_dict = yaml.safe_load(f)
+    @staticmethod
+    def from_yaml_all(
+        yaml_path: TYPE_PATH,
+        cache_dir: TYPE_PATH = None,
+        max_workers: int = None,
+    ) -> 'LazyProblems':
+        """Read all problems from a PEtab Control YAML file.
 
-        if len(yaml_dict[PROBLEMS]) != 1:
-            raise NotImplementedError(
-                'Currently, specification of one and only one control problem '
-                'is supported.'
-            )
-            raise KeyError(
-                'Please specify the problem ID when using a specification '
-                'with multiple control problems.'
-            )
-        problem_dict = one(yaml_dict[PROBLEMS])
+        Only the YAML file is read here. The tables of each problem are read
+        when the problem is first accessed.
 
-        if len(problem_dict[CONTROL][CONTROL_FILES]) != 1:
-            raise NotImplementedError(
-                'Multiple PEtab control, control files are not yet supported.'
-            )
-        control_df = read_control_df(
-            petab_path / one(problem_dict[CONTROL][CONTROL_FILES]),
+        Args:
+            yaml_path:
+                The YAML file.
+            cache_dir:
+                See `from_yaml`.
+            max_workers:
+                See `from_yaml`.
+
+        Returns:
+            The problems, by problem ID.
+        """
+        yaml_path = parse_path(yaml_path)
+        return LazyProblems(
+            yaml_path=yaml_path,
+            problem_ids=list(read_problem_dicts(yaml_path)),
+            cache_dir=cache_dir,
+            max_workers=max_workers,
         )
 
-        if len(problem_dict[CONTROL][CONTROL_PARAMETER_FILES]) != 1:
-            raise NotImplementedError(
-                'Multiple PEtab control, control parameter files are not yet '
-                'supported.'
-            )
-        control_parameter_df = get_parameter_df(str(
-            petab_path / one(problem_dict[CONTROL][CONTROL_PARAMETER_FILES]),
-        ))
-
-        if len(problem_dict[OBJECTIVE][OBSERVABLE_FILES]) != 1:
-            raise NotImplementedError(
-                'Multiple PEtab control, objective observable files are not '
-                'yet supported.'
-            )
-        objective_observable_df = get_observable_df(str(
-            petab_path / one(problem_dict[OBJECTIVE][OBSERVABLE_FILES]),
-        ))
-
-        if len(problem_dict[OBJECTIVE][MEASUREMENT_FILES]) != 1:
-            raise NotImplementedError(
-                'Multiple PEtab control, objective measurement files are not '
-                'yet supported.'
+    @staticmethod
+    def from_problem_dict(
+        problem_dict: Dict[str, Any],
+        petab_path: TYPE_PATH,
+        max_workers: int = None,
+    ) -> 'Problem':
+        """Read a problem from its specification in a YAML file.
+
+        All tables are read concurrently. Tables that are split across
+        multiple files are concatenated, then validated.
+
+        Args:
+            problem_dict:
+                The specification of the problem, from the `problems` list of
+                the YAML file.
+            petab_path:
+                The directory that file names are relative to.
+            max_workers:
+                See `from_yaml`.
+
+        Returns:
+            The problem.
+        """
+        petab_path = parse_path(petab_path)
+        table_files = {
+            CONTROL_FILES: (
+                read_control_df,
+                problem_dict[CONTROL][CONTROL_FILES],
+            ),
+            CONTROL_PARAMETER_FILES: (
+                get_parameter_df,
+                problem_dict[CONTROL][CONTROL_PARAMETER_FILES],
+            ),
+            OBSERVABLE_FILES: (
+                get_observable_df,
+                problem_dict[OBJECTIVE][OBSERVABLE_FILES],
+            ),
+            MEASUREMENT_FILES: (
+                get_measurement_df,
+                problem_dict[OBJECTIVE][MEASUREMENT_FILES],
+            ),
+        }
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                key: [
+                    executor.submit(read, str(petab_path / filename))
+                    for filename in filenames
+                ]
+                for key, (read, filenames) in table_files.items()
+            }
+        tables = {
+            key: concat_tables(
+                [future.result() for future in key_futures],
+                table_name=key,
             )
-        objective_measurement_df = get_measurement_df(str(
-            petab_path / one(problem_dict[OBJECTIVE][MEASUREMENT_FILES]),
-        ))
+            for key, key_futures in futures.items()
+        }
 
-        start_time = problem_dict[START_TIME]
+        for key in [CONTROL_PARAMETER_FILES, OBSERVABLE_FILES]:
+            duplicates = tables[key].index[tables[key].index.duplicated()]
+            if not duplicates.empty:
+                raise ValueError(
+                    f'Duplicate IDs in the `{key}` of problem '
+                    f'`{problem_dict[PROBLEM_ID]}`: '
+                    f'{sorted(set(duplicates))}'
+                )
 
         return Problem(
             problem_id=problem_dict[PROBLEM_ID],
-            control_df=control_df,
-            control_parameter_df=control_parameter_df,
-            objective_observable_df=objective_observable_df,
-            objective_measurement_df=objective_measurement_df,
-            start_time=start_time,
+            control_df=tables[CONTROL_FILES],
+            control_parameter_df=tables[CONTROL_PARAMETER_FILES],
+            objective_observable_df=tables[OBSERVABLE_FILES],
+            objective_measurement_df=tables[MEASUREMENT_FILES],
+            start_time=problem_dict[START_TIME],
+        )
+
+    def write_cache_entry(self, directory: TYPE_PATH) -> None:
+        """Write the problem to a cache entry.
+
+        Args:
+            directory:
+                The directory of the cache entry.
+        """
+        write_tables(directory, {
+            'control_df': self.control_df,
+            'control_parameter_df': self.control_parameter_df,
+            'objective_observable_df': self.objective_observable_df,
+            'objective_measurement_df': self.objective_measurement_df,
+        })
+        with open(Path(directory) / METADATA_FILENAME, 'w') as f:
+            yaml.safe_dump({
+                PROBLEM_ID: self.problem_id,
+                START_TIME: self.start_time,
+            }, f)
+
+    @staticmethod
+    def read_cache_entry(directory: TYPE_PATH) -> 'Problem':
+        """Read a problem that was written with `write_cache_entry`.
+
+        Args:
+            directory:
+                The directory of the cache entry.
+
+        Returns:
+            The problem.
+        """
+        tables = read_tables(directory)
+        with open(Path(directory) / METADATA_FILENAME, 'r') as f:
+            metadata = yaml.safe_load(f)
+        return Problem(
+            problem_id=metadata[PROBLEM_ID],
+            control_df=tables['control_df'],
+            control_parameter_df=tables['control_parameter_df'],
+            objective_observable_df=tables['objective_observable_df'],
+            objective_measurement_df=tables['objective_measurement_df'],
+            start_time=metadata[START_TIME],
         )
 
     def to_files(self):
@@ -324,56 +569,110 @@ class Problem():
         # - `objective_measurement_df`
         raise NotImplementedError
 
+    @property
+    def control_df(self) -> pd.DataFrame:
+        """The controls table.
+
+        The derived tables, e.g. `parameter_df`, are recomputed when it is
+        replaced. After in-place edits, call `invalidate_cache`.
+        """
+        return self._control_df
+
+    @control_df.setter
+    def control_df(self, control_df: pd.DataFrame) -> None:
+        self._control_df = control_df
+        self.invalidate_cache()
+
+    @property
+    def control_parameter_df(self) -> pd.DataFrame:
+        """The control parameters table.
+
+        The derived tables, e.g. `parameter_df`, are recomputed when it is
+        replaced. After in-place edits, call `invalidate_cache`.
+        """
+        return self._control_parameter_df
+
+    @control_parameter_df.setter
+    def control_parameter_df(self, control_parameter_df: pd.DataFrame) -> None:
+        self._control_parameter_df = control_parameter_df
+        self.invalidate_cache()
+
+    def invalidate_cache(self) -> None:
+        """Clear the tables that are derived from the control tables.
+
+        Called when a control table is replaced. Required after in-place
+        edits of the control tables.
+        """
+        self.tables_version += 1
+        self._cache = {}
+
+    def _get_cached(self, key: Any, compute: Callable[[], Any]) -> Any:
+        """Get a derived table, computing it if it is not cached.
+
+        Shallow copies are returned, which share their data with the cache,
+        as with `petab.derive_petab_problem`. Hence, attributes or columns
+        of a returned table may be replaced, but not edited in place.
+
+        Args:
+            key:
+                The key of the derived table in the cache.
+            compute:
+                Computes the derived table.
+
+        Returns:
+            A shallow copy of the derived table.
+        """
+        if key not in self._cache:
+            self._cache[key] = compute()
+        value = self._cache[key]
+        if isinstance(value, pd.DataFrame):
+            return value.copy(deep=False)
+        return copy.copy(value)
+
     @property
     def parameter_df(self) -> pd.DataFrame:
-        rows = []
-        control_parameter_ids = []
-        for _, control_row in self.control_df.iterrows():
-            # The estimation problem for all controls with the same
-            # control parameter ID must be the same, hence only
-            # need to estimate it once.
-            if control_row[CONTROL_ID] in control_parameter_ids:
-                continue
-            control_parameter_ids.append(control_row[CONTROL_ID])
+        """The PEtab parameters table of the controls.
+
+        Computed from the control tables, and cached until they are
+        replaced. See `_get_cached`.
+        """
+        return self._get_cached(PARAMETER_ID, self._get_parameter_df)
+
+    def _get_parameter_df(self) -> pd.DataFrame:
+        # The estimation problem for all controls with the same
+        # control parameter ID must be the same, hence only
+        # need to estimate it once.
+        controls = self.control_df.drop_duplicates(CONTROL_ID)
+
+        df = self.control_parameter_df.loc[controls[PARAMETER_ID]]
+        df.index = pd.Index(controls[CONTROL_ID], name=PARAMETER_ID)
+
+        estimate = (controls[VALUE] == ESTIMATE).to_numpy()
+        df[ESTIMATE] = estimate.astype(int)
+        df.loc[~estimate, NOMINAL_VALUE] = (
+            controls.loc[~estimate, VALUE].astype(float).to_numpy()
+        )
 
-            row = (
-                self
-                .control_parameter_df.
-                loc[control_row[PARAMETER_ID]]
-                .copy()
-            )
-            #row[CONTROL_TARGET] = row.name
-            #row[CONTROL_TIME] = control_row[TIME]
-            row.name = control_row[CONTROL_ID]
-            #row.name = get_control_id(
-            #    parameter_id=control_row[PARAMETER_ID],
-            #    period_index=index,
-            #)
-            if control_row[VALUE] == ESTIMATE:
-                row[ESTIMATE] = 1
-            else:
-                row[NOMINAL_VALUE] = float(control_row[VALUE])
-                row[ESTIMATE] = 0
-            rows.append(row)
-        df = pd.DataFrame(data=rows)
-        df.index.name = PARAMETER_ID
         df = petab.get_parameter_df(df)
         return df
 
     @property
     def timecourse(self) -> Timecourse:
         """The controls as a timecourse."""
+        return self._get_cached(TIMECOURSE, self._get_timecourse)
+
+    def _get_timecourse(self) -> Timecourse:
         # FIXME use as Timecourse property of Problem class
         #periods_dict = {
         #    time: {}
         #    for time in sorted(set([0, *control_df[TIME].values]))
         #}
-        start_times = sorted(set([0, *self.control_df[TIME]]))
+        start_times = get_period_start_times(self.control_df)
         periods = []
         for period_index, start_time in enumerate(start_times):
             duration = TIME_STEADY_STATE
             if period_index < len(start_times) - 1:
-                duration = start_times[period_index + 1] - start_time
+                duration = float(start_times[period_index + 1] - start_time)
             period = Period(
                 duration=duration,
                 condition_id=CONTROL_CONDITION_ID,
@@ -386,15 +685,9 @@ class Problem():
         return timecourse
 
     def get_periods_parameters(self, start_period_index: int = 0):
-        time = 0
-        periods_parameters = []
+        """Get the controls that are applied in each timecourse period.
 
-        #parameter_values = {}
-        control_parameters = {}
-        """
-        Keys are control parameter IDs.
-        Values are dictionaries with a required `VALUE` key, and
-        an optional `PARAMETER_ID` key if `VALUE == ESTIMATE`.
+        See `get_periods_parameters_map`.
 
         Args:
             start_period_index:
@@ -402,374 +695,765 @@ class Problem():
                 Useful when simulating since some timecourse from the
                 original PEtab estimation problem may be prepended to the
                 PEtab Control timecourse.
+
+        Returns:
+            The `periods_parameters` and `control_parameters` attributes of
+            the `PeriodsParameters` object.
         """
+        periods_parameters_map = self.get_periods_parameters_map(
+            start_period_index=start_period_index,
+        )
+        return (
+            periods_parameters_map.periods_parameters,
+            periods_parameters_map.control_parameters,
+        )
+
+    def get_periods_parameters_map(
+        self,
+        start_period_index: int = 0,
+    ) -> 'PeriodsParameters':
+        """Get the controls that are applied in each timecourse period.
+
+        The controls table is grouped once by parameter ID and time, instead
+        of being filtered for each combination of period and parameter.
+
+        Args:
+            start_period_index:
+                See `get_periods_parameters`.
+
+        Returns:
+            The controls of each period, which are cached until the control
+            tables are replaced. See `_get_cached`.
+        """
+        return self._get_cached(
+            (PERIODS, start_period_index),
+            lambda: self._get_periods_parameters_map(
+                start_period_index=start_period_index,
+            ),
+        )
+
+    def _get_periods_parameters_map(
+        self,
+        start_period_index: int,
+    ) -> 'PeriodsParameters':
+        parameter_ids = list(self.control_parameter_df.index)
+        start_times = get_period_start_times(self.control_df)
+
+        controls = self.control_df.loc[
+            self.control_df[PARAMETER_ID].isin(parameter_ids)
+        ]
+
+        duplicated = controls.duplicated([PARAMETER_ID, TIME], keep=False)
+        if duplicated.any():
+            raise ValueError(
+                'Multiple control parameters are defined for the same '
+                'parameter and time. Controls:\n'
+                f'{controls.loc[duplicated]}'
+            )
 
-        period_parameters0 = {
-            parameter_id: None
-            for parameter_id in self.control_parameter_df.index
+        n_values = controls.groupby(CONTROL_ID)[VALUE].nunique(dropna=False)
+        if (n_values > 1).any():
+            raise ValueError(
+                'Unexpected error. An update value for a parameter control '
+                'does not match the update value for the same parameter '
+                'control in a different timecourse period. Controls:\n'
+                f'{controls.loc[controls[CONTROL_ID].isin(n_values.index[n_values > 1])]}'
+            )
+
+        period_indices = np.searchsorted(
+            start_times,
+            controls[TIME].to_numpy(dtype=float),
+        )
+        parameter_indices = pd.Index(parameter_ids).get_indexer(
+            controls[PARAMETER_ID]
+        )
+        # Controls are numbered in order of their first period, then in
+        # order of the control parameters table.
+        order = np.lexsort((parameter_indices, period_indices))
+        period_indices = period_indices[order]
+        parameter_indices = parameter_indices[order]
+        controls = controls.iloc[order]
+        control_codes, control_ids = pd.factorize(controls[CONTROL_ID])
+        control_ids = list(control_ids)
+
+        control_indices = np.full(
+            (len(start_times), len(parameter_ids)),
+            -1,
+            dtype=int,
+        )
+        control_indices[period_indices, parameter_indices] = control_codes
+
+        control_periods = (
+            pd.Series(period_indices + start_period_index)
+            .groupby(control_codes)
+            .agg(list)
+        )
+        first_controls = controls.loc[~controls[CONTROL_ID].duplicated()]
+        control_parameters = {
+            control_id: {
+                VALUE: value,
+                PERIODS: periods,
+                PARAMETER_ID: parameter_id,
+            }
+            for control_id, value, periods, parameter_id in zip(
+                control_ids,
+                first_controls[VALUE],
+                control_periods,
+                first_controls[PARAMETER_ID],
+            )
         }
-        for period_index, period in enumerate(self.timecourse.periods):
-            period_parameters = period_parameters0.copy()
-            for parameter_id in period_parameters:
-                updates = self.control_df.loc[
-                    (self.control_df[PARAMETER_ID] == parameter_id)
-                    & (self.control_df[TIME] == time)
+
+        periods_parameters = [
+            {
+                parameter_id: (
+                    control_ids[control_index]
+                    if control_index != -1
+                    else None
+                )
+                for parameter_id, control_index in zip(
+                    parameter_ids,
+                    period_control_indices,
+                )
+            }
+            for period_control_indices in control_indices
+        ]
+
+        return PeriodsParameters(
+            periods_parameters=periods_parameters,
+            control_parameters=control_parameters,
+            control_indices=control_indices,
+            control_ids=control_ids,
+            parameter_ids=parameter_ids,
+        )
+
+    def setup_simulator(
+        self,
+        simulator_class: type = None,
+        petab_problem: petab.Problem = None,
+        timecourse_id: str = None,
+        default_problem_parameters: Dict[str, float] = None,
+        model_settings: Dict[str, Any] = None,
+        solver_settings: Dict[str, Any] = None,
+        fix_petab_problem_parameters: Dict[str, float] = None,
+        simulator_kwargs: Dict[str, Any] = None,
+        cache_prefix: bool = False,
+        restrict_sensitivities: bool = True,
+        checkpoint_max_bytes: int = 0,
+        lean_results: bool = False,
+    ):
+        """Setup a timecourse simulator to solve the control problem.
+
+        Args:
+            simulator_class:
+                The simulator class to use. Should inherit from
+                `petab_timecourse.Simulator`, or be
+                `petab_control.simulator.ControlSimulator` (the default).
+            petab_problem:
+                The original PEtab problem.
+            timecourse_id:
+                The ID of the timecourse in the original PEtab problem to use.
+            default_problem_parameters:
+                All parameters must have some value for each timecourse period,
+                for all periods in the original PEtab problem, and the control
+                problem. Default values for missing parameters can be provided
+                here. Keys are parameter IDs, values are parameter values.
+            fix_petab_problem_parameters:
+                Keys are parameters IDs in `petab_problem.parameter_df`,
+                values are parameter values. The PEtab problems used by the
+                simulator and optimizer will fix these parameters
+                (i.e. they won't be estimated). Parameter values are expected
+                to be on linear scale.
+            model_settings:
+                Keys are AMICI model setters (e.g. `setAlwaysCheckFinite`)
+                and values are supplied to the setters.
+            solver_settings:
+                Keys are AMICI solver setters (e.g. `setAbsoluteTolerance`)
+                and values are supplied to the setters.
+            simulator_kwargs:
+                Additional keyword arguments for the simulator class.
+            cache_prefix:
+                Whether to simulate the original timecourse up to the
+                `start_time` only once, and start all later simulations of
+                the controls from the cached state and state sensitivities.
+                The original PEtab problem parameters are fixed, so this
+                part of the timecourse is identical for all controls.
+                Requires a `petab_control.simulator.ControlSimulator`.
+            restrict_sensitivities:
+                Whether to only compute sensitivities for an estimated
+                control in the periods where, or after, it is first applied.
+                See `get_periods_sensitivity_sources`.
+            checkpoint_max_bytes:
+                The maximum memory of the checkpoints of the control
+                periods, in bytes. Simulations then restart from the end of
+                the last period with unchanged parameters, e.g. when an
+                optimizer only changes late controls. `0` disables
+                checkpoints, and `None` removes the limit. Requires a
+                `petab_control.simulator.ControlSimulator`. See
+                `ControlSimulator.checkpoint_max_bytes`.
+            lean_results:
+                Whether simulations only keep the log-likelihood and
+                gradient of each period, in arrays that are reused between
+                simulations, instead of the AMICI return data with all
+                trajectories. Full results are still available with
+                `simulate(..., full_results=True)`. Requires a
+                `petab_control.simulator.ControlSimulator`.
+        """
+        if simulator_class is None:
+            from .simulator import ControlSimulator
+            simulator_class = ControlSimulator
+        if simulator_kwargs is None:
+            simulator_kwargs = {}
+
+        if default_problem_parameters is None:
+            default_problem_parameters = {}
+        if fix_petab_problem_parameters is None:
+            fix_petab_problem_parameters = {}
+
+        for parameter_id, parameter_value in default_problem_parameters.items():
+            default_problem_parameters[parameter_id] = \
+                petab.to_float_if_float(parameter_value)
+
+        petab_problem = derive_petab_problem(petab_problem, clone_model=False)
+
+        if fix_petab_problem_parameters:
+            parameter_df = petab_problem.parameter_df.copy()
+            for parameter_id, parameter_value in \
+                    fix_petab_problem_parameters.items():
+                parameter_df.loc[parameter_id, [
+                    NOMINAL_VALUE,
+                    ESTIMATE,
+                ]] = [
+                    parameter_value,
+                    0,
                 ]
-                if updates.empty:
-                    continue
-                try:
-                    _, update = one(updates.iterrows())
-                except ValueError:
-                    raise ValueError(
-                        'Multiple control parameters are defined for the same '
-                        f'parameter and time. Parameter: {parameter_id}. '
-                        f'Time: {time}. Controls:\n{updates}'
+            petab_problem.parameter_df = parameter_df
+
+        self.simulator_control_petab_problem = \
+            get_control_petab_problem(
+                petab_control_problem=self,
+                petab_problem=petab_problem,
+                timecourse_id=timecourse_id,
+            )
+
+        self.optimizer_control_petab_problem = derive_petab_problem(
+            self.simulator_control_petab_problem,
+            clone_model=False,
+        )
+        self.optimizer_control_petab_problem.parameter_df = (
+            pd.concat([
+                petab_problem.parameter_df.copy(),
+                self.parameter_df,
+            ])
+        )
+
+        self.simulator_control_petab_problem.parameter_df = (
+            pd.concat([
+                petab_problem.parameter_df.copy(),
+                self.control_parameter_df,
+            ])
+        )
+
+        self.simulator = simulator_class(
+            petab_problem=self.simulator_control_petab_problem,
+            timecourse_id=CONTROL_TIMECOURSE_ID,
+            **simulator_kwargs,
+        )
+
+        original_conditions = {
+            original_condition_id: dict(
+                petab_problem
+                .condition_df
+                .loc[original_condition_id]
+            )
+            for original_condition_id in set(
+                period.condition_id
+                for period in Timecourse.from_df(
+                    timecourse_df=petab_problem.timecourse_df,
+                    timecourse_id=timecourse_id,
+                ).periods
+            )
+        }
+        if CONTROL_CONDITION_ID in original_conditions:
+            raise ValueError(
+                'Please reimplement the PEtab problem to not have a condition with '
+                f'ID: {CONTROL_CONDITION_ID}'
+            )
+        original_conditions[CONTROL_CONDITION_ID] = {}
+
+        # Replace fixed condition parameters with their values.
+        fixed_original_conditions = {
+            condition_id: {
+                k: fix_petab_problem_parameters.get(v, v)
+                for k, v in condition.items()
+            }
+            for condition_id, condition in original_conditions.items()
+        }
+        unreplaced_ids_in_conditions = set.union(*[
+            set([
+                value
+                for value in condition.values()
+                if isinstance(value, str)
+            ])
+            for condition in fixed_original_conditions.values()
+        ])
+        if unreplaced_ids_in_conditions:
+            raise ValueError(
+                "Please supply replacements for any IDs that appear in the "
+                f"original conditions. Unreplaced IDs: {unreplaced_ids_in_conditions}"
+            )
+        # Replace fixed parameter mapping parameters with their values.
+        self.simulator.replace_in_parameter_mapping(
+            replacements=fix_petab_problem_parameters,
+            scaled=False,
+        )
+        # FIXME check if any parameters remain
+
+        simulator_periods_parameters, _ = \
+            self.get_periods_parameters()
+
+        len_original_timecourse = (
+            len(self.simulator.timecourse.periods)
+            - len(self.timecourse.periods)
+        )
+
+        if cache_prefix:
+            if not hasattr(self.simulator, 'prefix_period_count'):
+                raise TypeError(
+                    'Caching the original timecourse requires a simulator '
+                    'that supports it, e.g. '
+                    '`petab_control.simulator.ControlSimulator`.'
+                )
+            self.simulator.prefix_period_count = len_original_timecourse
+
+        if checkpoint_max_bytes != 0:
+            if not hasattr(self.simulator, 'checkpoint_max_bytes'):
+                raise TypeError(
+                    'Checkpoints require a simulator that supports them, '
+                    'e.g. `petab_control.simulator.ControlSimulator`.'
+                )
+            self.simulator.checkpoint_max_bytes = checkpoint_max_bytes
+
+        if lean_results:
+            if not hasattr(self.simulator, 'lean_results'):
+                raise TypeError(
+                    'Lean results require a simulator that supports them, '
+                    'e.g. `petab_control.simulator.ControlSimulator`.'
+                )
+            self.simulator.lean_results = lean_results
+
+        _, self.simulator_control_parameters = \
+            self.get_periods_parameters(
+                start_period_index=len_original_timecourse,
+            )
+
+        if hasattr(self.simulator, 'sensitivity_sources_periods'):
+            self.simulator.sensitivity_sources_periods = \
+                self.get_periods_sensitivity_sources(
+                    sensitivity_parameter_ids=(
+                        self.simulator.sensitivity_parameter_ids
+                    ),
+                    n_periods=len(self.simulator.timecourse.periods),
+                    restrict_sensitivities=restrict_sensitivities,
+                )
+
+        self.simulator_default_problem_parameters_periods = [
+            {
+                **default_problem_parameters,
+                **fixed_original_conditions[period.condition_id],
+                # FIXME assumes the control timecourse always appears after the
+                #       original timecourse
+                **(
+                    simulator_periods_parameters[
+                        period_index - len_original_timecourse
+                    ]
+                    if period_index - len_original_timecourse >= 0
+                    else {}
+                ),
+            }
+            for period_index, period in enumerate(
+                self.simulator.timecourse.periods
+            )
+        ]
+
+        # Kept to set up the same model and solver in other processes.
+        self.simulator_model_settings = dict(model_settings or {})
+        self.simulator_solver_settings = dict(solver_settings or {})
+
+        if model_settings is not None:
+            for setter, value in model_settings.items():
+                getattr(self.simulator.amici_model, setter)(value)
+
+        if solver_settings is not None:
+            for setter, value in solver_settings.items():
+                getattr(self.simulator.amici_solver, setter)(value)
+
+    def get_periods_sensitivity_sources(
+        self,
+        sensitivity_parameter_ids: Sequence[str],
+        n_periods: int,
+        restrict_sensitivities: bool = True,
+    ) -> List[Dict[str, Optional[str]]]:
+        """Get the sensitivity sources of each simulator period.
+
+        Each estimated control of a sensitivity parameter is a source, which
+        is active in the periods of the control. Each sensitivity parameter
+        is also a source, which is active in the periods without controls
+        of the parameter. A source affects all periods after it is first
+        active through the state, so has its own state sensitivities, even
+        if other sources of the same parameter are active. See
+        `petab_control.periods.SensitivityColumns`.
+
+        Args:
+            sensitivity_parameter_ids:
+                The sensitivity parameters of the simulator.
+            n_periods:
+                The number of simulator periods.
+            restrict_sensitivities:
+                Whether to skip sources in the periods before they are first
+                active, and the sources of control parameters that are not
+                estimated. A control cannot affect the periods before it is
+                first applied.
+
+        Returns:
+            The sensitivity sources of each period. Keys are source IDs,
+            i.e. parameter IDs or control IDs, values are the parameters
+            that take the values of the sources, or `None` if the source is
+            inactive. Parameter sources are first.
+        """
+        assigned_periods = {}
+        control_sources = {}
+        for control_id, control_information in (
+            self.simulator_control_parameters.items()
+        ):
+            parameter_id = control_information[PARAMETER_ID]
+            periods = set(control_information[PERIODS])
+            assigned_periods.setdefault(parameter_id, set()).update(periods)
+            if (
+                control_information[VALUE] == ESTIMATE
+                and parameter_id in sensitivity_parameter_ids
+            ):
+                control_sources[control_id] = (parameter_id, periods)
+
+        estimated_control_parameter_ids = set(
+            self.control_parameter_df.index[
+                self.control_parameter_df[ESTIMATE] == 1
+            ]
+        )
+        parameter_sources = {}
+        for parameter_id in sensitivity_parameter_ids:
+            if (
+                restrict_sensitivities
+                and parameter_id in self.control_parameter_df.index
+                and parameter_id not in estimated_control_parameter_ids
+            ):
+                continue
+            parameter_sources[parameter_id] = (
+                parameter_id,
+                (
+                    set(range(n_periods))
+                    - assigned_periods.get(parameter_id, set())
+                ),
+            )
+
+        sources = {**parameter_sources, **control_sources}
+        first_periods = {
+            source_id: min(periods, default=n_periods)
+            for source_id, (_, periods) in sources.items()
+        }
+        return [
+            {
+                source_id: parameter_id if period_index in periods else None
+                for source_id, (parameter_id, periods) in sources.items()
+                if (
+                    not restrict_sensitivities
+                    or first_periods[source_id] <= period_index
+                )
+            }
+            for period_index in range(n_periods)
+        ]
+
+    def get_problem_parameters_periods(
+        self,
+        problem_parameters: Dict[str, Any],
+    ) -> List[Dict[str, Any]]:
+        """Get the parameters of each simulator period.
+
+        Args:
+            problem_parameters:
+                See `simulate`.
+
+        Returns:
+            The parameters of each period, as supplied to the simulator.
+            Values from `problem_parameters` are used as is, so they may also
+            be placeholders, e.g. to find which period parameters take which
+            problem parameter values.
+        """
+        # Copy to avoid overwriting user's object.
+        problem_parameters_periods = copy.deepcopy(
+            self.simulator_default_problem_parameters_periods
+        )
+
+        for period_index, problem_parameters_period in enumerate(problem_parameters_periods):
+            for parameter_id, parameter_value in problem_parameters_period.items():
+                # Use the provided value for the control parameter
+                if (
+                    isinstance(parameter_value, str)
+                    and parameter_value in problem_parameters
+                ):
+                    if parameter_id in problem_parameters:
+                        warnings.warn(
+                            f'The parameter `{parameter_id}` takes the value of '
+                            f'the control parameter `{parameter_value}` (period '
+                            f'index: {period_index}). However, values for both the '
+                            'parameter and the control parameter were provided. '
+                            'The value for the control parameter will be used.'
+                        )
+                    parameter_value = problem_parameters[parameter_value]
+                # Else use the provided value for the corresponding
+                # parameter
+                elif parameter_id in problem_parameters:
+                    parameter_value = problem_parameters[parameter_id]
+                # Else use the default value provided to `setup_simulator`
+                elif isinstance(parameter_value, float):
+                    pass
+                # Else use the default value for the
+                # control parameter
+                elif (
+                    isinstance(parameter_value, str)
+                    and isinstance(
+                        (
+                            self
+                            .simulator_control_parameters
+                            [parameter_value]
+                            [VALUE]
+                        ),
+                        float,
                     )
-                control_id = update[CONTROL_ID]
-                if control_id in control_parameters:
-                    control_parameters[control_id][PERIODS].append(
-                        period_index + start_period_index,
+                ):
+                    parameter_value = (
+                        self
+                        .simulator_control_parameters
+                        [parameter_value]
+                        [VALUE]
                     )
-                    if control_parameters[control_id][VALUE] != update[VALUE]:
-                        raise ValueError(
-                            'Unexpected error. An update value for a parameter control '
-                            'does not match the update value for the same parameter '
-                            'control in a different timecourse period. '
-                            f'Parameter:\n{control_parameters[control_id]}\n'
-                            f'Update:\n{update}'
-                        )
-                    # TODO assert the lowest period index is used for the control
-                    # parameter ID?
+                # Else use nominal value from the control
+                # parameters table, for the corresponding parameter
+                elif not np.isnan(
+                    self
+                    .control_parameter_df
+                    .loc[
+                        self
+                        .simulator_control_parameters
+                        [parameter_value]
+                        [PARAMETER_ID]
+                    ]
+                    [NOMINAL_VALUE]
+                ):
+                    parameter_value = (
+                        self
+                        .control_parameter_df
+                        .loc[
+                            self
+                            .simulator_control_parameters
+                            [parameter_value]
+                            [PARAMETER_ID]
+                        ]
+                        [NOMINAL_VALUE]
+                    )
+                # Else fail
                 else:
-                    control_parameters[control_id] = {
-                        VALUE: update[VALUE],
-                        PERIODS: [period_index + start_period_index],
-                        PARAMETER_ID: parameter_id,
-                    }
-                period_parameters[parameter_id] = control_id
-            time += period.duration
-            periods_parameters.append(period_parameters)
-        return periods_parameters, control_parameters
-
-#    def setup_simulator(
-#        self,
-#        simulator_class: Simulator,
-#        petab_problem: petab.Problem,
-#        timecourse_id: str = None,
-#        default_problem_parameters: Dict[str, float] = None,
-#        model_settings: Dict[str, Any] = None,
-#        solver_settings: Dict[str, Any] = None,
-#        fix_petab_problem_parameters: Dict[str, float] = None,
-#    ):
-#        """Setup a timecourse simulator to solve the control problem.
-#
-#        Args:
-#            simulator_class:
-#                The simulator class to use. Should inherit from
-#                `petab_timecourse.Simulator`.
-#            petab_problem:
-#                The original PEtab problem.
-#            timecourse_id:
-#                The ID of the timecourse in the original PEtab problem to use.
-#            default_problem_parameters:
-#                All parameters must have some value for each timecourse period,
-#                for all periods in the original PEtab problem, and the control
-#                problem. Default values for missing parameters can be provided
-#                here. Keys are parameter IDs, values are parameter values.
-#            fix_petab_problem_parameters:
-#                Keys are parameters IDs in `petab_problem.parameter_df`,
-#                values are parameter values. The PEtab problems used by the
-#                simulator and optimizer will fix these parameters
-#                (i.e. they won't be estimated). Parameter values are expected
-#                to be on linear scale.
-#            model_settings:
-#                Keys are AMICI model setters (e.g. `setAlwaysCheckFinite`)
-#                and values are supplied to the setters.
-#            solver_settings:
-#                Keys are AMICI solver setters (e.g. `setAbsoluteTolerance`)
-#                and values are supplied to the setters.
-#        """
-#        if default_problem_parameters is None:
-#            default_problem_parameters = {}
-#
-#        for parameter_id, parameter_value in default_problem_parameters.items():
-#            default_problem_parameters[parameter_id] = \
-#                petab.to_float_if_float(parameter_value)
-#
-#        petab_problem = copy.deepcopy(petab_problem)
-#
-#        if fix_petab_problem_parameters is None:
-#            fix_petab_problem_parameters = {}
-#        for parameter_id, parameter_value in fix_petab_problem_parameters.items():
-#            petab_problem.parameter_df.loc[parameter_id, [
-#                NOMINAL_VALUE,
-#                ESTIMATE,
-#            ]] = [
-#                parameter_value,
-#                0,
-#            ]
-#
-#        self.simulator_control_petab_problem = \
-#            get_control_petab_problem(
-#                petab_control_problem=self,
-#                petab_problem=petab_problem,
-#                timecourse_id=timecourse_id,
-#            )
-#
-#        self.optimizer_control_petab_problem = copy.deepcopy(
-#            self.simulator_control_petab_problem
-#        )
-#        self.optimizer_control_petab_problem.parameter_df = (
-#            pd.concat([
-#                petab_problem.parameter_df.copy(),
-#                self.parameter_df,
-#            ])
-#        )
-#
-#        self.simulator_control_petab_problem.parameter_df = (
-#            pd.concat([
-#                petab_problem.parameter_df.copy(),
-#                self.control_parameter_df,
-#            ])
-#        )
-#
-#        self.simulator = simulator_class(
-#            petab_problem=self.simulator_control_petab_problem,
-#            timecourse_id=CONTROL_TIMECOURSE_ID,
-#        )
-#
-#        # FIXME check whether explicit specification of `plist` is important
-#        #if self.simulator.amici_model is None:
-#        #    raise ValueError(
-#        #        'Simulator must have an AMICI model, to set '
-#        #        'sensitivities correctly.'
-#        #    )
-#        #sensitivity_parameters = {
-#        #    parameter_id: (
-#        #        self
-#        #        .simulator
-#        #        .amici_model
-#        #        .getParameterIds()
-#        #        .index(parameter_id)
-#        #    )
-#        #    for parameter_id in self.simulator_control_petab_problem.x_free_ids
-#        #}
-#
-#        #for amici_edata in self.simulator.amici_edata_periods:
-#        #    amici_edata.plist = list(sensitivity_parameters.values())
-#
-#        original_conditions = {
-#            original_condition_id: dict(
-#                petab_problem
-#                .condition_df
-#                .loc[original_condition_id]
-#            )
-#            for original_condition_id in set(
-#                period.condition_id
-#                for period in Timecourse.from_df(
-#                    timecourse_df=petab_problem.timecourse_df,
-#                    timecourse_id=timecourse_id,
-#                ).periods
-#            )
-#        }
-#        if CONTROL_CONDITION_ID in original_conditions:
-#            raise ValueError(
-#                'Please reimplement the PEtab problem to not have a condition with '
-#                f'ID: {CONTROL_CONDITION_ID}'
-#            )
-#        original_conditions[CONTROL_CONDITION_ID] = {}
-#
-#        # Replace fixed condition parameters with their values.
-#        fixed_original_conditions = {
-#            condition_id: {
-#                k: fix_petab_problem_parameters.get(v, v)
-#                for k, v in condition.items()
-#            }
-#            for condition_id, condition in original_conditions.items()
-#        }
-#        unreplaced_ids_in_conditions = set.union(*[
-#            set([
-#                value
-#                for value in condition.values()
-#                if isinstance(value, str)
-#            ])
-#            for condition in fixed_original_conditions.values()
-#        ])
-#        if unreplaced_ids_in_conditions:
-#            raise ValueError(
-#                "Please supply replacements for any IDs that appear in the "
-#                f"original conditions. Unreplaced IDs: {unreplaced_ids_in_conditions}"
-#            )
-#        # Replace fixed parameter mapping parameters with their values.
-#        self.simulator.replace_in_parameter_mapping(
-#            replacements=fix_petab_problem_parameters,
-#            scaled=False,
-#        )
-#        # FIXME check if any parameters remain
-#
-#        simulator_periods_parameters, _ = \
-#            self.get_periods_parameters()
-#
-#        len_original_timecourse = (
-#            len(self.simulator.timecourse.periods)
-#            - len(self.timecourse.periods)
-#        )
-#
-#        _, self.simulator_control_parameters = \
-#            self.get_periods_parameters(
-#                start_period_index=len_original_timecourse,
-#            )
-#
-#        self.simulator_default_problem_parameters_periods = [
-#            {
-#                **default_problem_parameters,
-#                **fixed_original_conditions[period.condition_id],
-#                # FIXME assumes the control timecourse always appears after the
-#                #       original timecourse
-#                **(
-#                    simulator_periods_parameters[
-#                        period_index - len_original_timecourse
-#                    ]
-#                    if period_index - len_original_timecourse >= 0
-#                    else {}
-#                ),
-#            }
-#            for period_index, period in enumerate(
-#                self.simulator.timecourse.periods
-#            )
-#        ]
-#
-#        if model_settings is not None:
-#            for setter, value in model_settings.items():
-#                getattr(self.simulator.amici_model, setter)(value)
-#
-#        if solver_settings is not None:
-#            for setter, value in solver_settings.items():
-#                getattr(self.simulator.amici_solver, setter)(value)
-#
-#    def simulate(
-#        self,
-#        problem_parameters: Dict[str, float],
-#    ):
-#        """Simulate the timecourse for a control problem.
-#
-#        All parameters that appear in any timecourse period condition
-#        should have at least default values in for all timecourse periods.
-#        i.e. the problem parameters should be a list of dictionaries where
-#        all dictionaries have the same keys.
-#
-#        Args:
-#            problem_parameters:
-#                Values to substitute in for estimated control parameters,
-#                on parameter scale.
-#        """
-#        # Copy to avoid overwriting user's object.
-#        problem_parameters_periods = copy.deepcopy(
-#            self.simulator_default_problem_parameters_periods
-#        )
-#
-#        for period_index, problem_parameters_period in enumerate(problem_parameters_periods):
-#            for parameter_id, parameter_value in problem_parameters_period.items():
-#                # Use the provided value for the control parameter
-#                if (
-#                    isinstance(parameter_value, str)
-#                    and parameter_value in problem_parameters
-#                ):
-#                    if parameter_id in problem_parameters:
-#                        warnings.warn(
-#                            f'The parameter `{parameter_id}` takes the value of '
-#                            f'the control parameter `{parameter_value}` (period '
-#                            f'index: {period_index}). However, values for both the '
-#                            'parameter and the control parameter were provided. '
-#                            'The value for the control parameter will be used.'
-#                        )
-#                    parameter_value = problem_parameters[parameter_value]
-#                # Else use the provided value for the corresponding
-#                # parameter
-#                elif parameter_id in problem_parameters:
-#                    parameter_value = problem_parameters[parameter_id]
-#                # Else use the default value provided to `setup_simulator`
-#                elif isinstance(parameter_value, float):
-#                    pass
-#                # Else use the default value for the
-#                # control parameter
-#                elif (
-#                    isinstance(parameter_value, str)
-#                    and isinstance(
-#                        (
-#                            self
-#                            .simulator_control_parameters
-#                            [parameter_value]
-#                            [VALUE]
-#                        ),
-#                        float,
-#                    )
-#                ):
-#                    parameter_value = (
-#                        self
-#                        .simulator_control_parameters
-#                        [parameter_value]
-#                        [VALUE]
-#                    )
-#                # Else use nominal value from the control
-#                # parameters table, for the corresponding parameter
-#                elif not np.isnan(
-#                    self
-#                    .control_parameter_df
-#                    .loc[
-#                        self
-#                        .simulator_control_parameters
-#                        [parameter_value]
-#                        [PARAMETER_ID]
-#                    ]
-#                    [NOMINAL_VALUE]
-#                ):
-#                    parameter_value = (
-#                        self
-#                        .control_parameter_df
-#                        .loc[
-#                            self
-#                            .simulator_control_parameters
-#                            [parameter_value]
-#                            [PARAMETER_ID]
-#                        ]
-#                        [NOMINAL_VALUE]
-#                    )
-#                # Else fail
-#                else:
-#                    breakpoint()
-#                    raise ValueError(
-#                        'Please supply a value for the control parameter '
-#                        f'`{parameter_value}` (instance of parameter `{parameter_id}`). '
-#                        'This can be supplied in multiple ways, for example, '
-#                        'as a key-value pair in the `problem_parameters` '
-#                        'argument of this method.'
-#                    )
-#                problem_parameters_periods[period_index][parameter_id] = \
-#                    parameter_value
-#
-#        periods_results = self.simulator.simulate(
-#            problem_parameters_periods=problem_parameters_periods,
-#            scaled_parameters=True,
-#            control_parameters=self.simulator_control_parameters,
-#        )
-#
-#        llh = sum(period_results[LLH] for period_results in periods_results)
-#        sllh = {}
-#        for control_parameter_id, control_description in self.simulator_control_parameters.items():
-#            sllh[control_parameter_id] = sum(
-#                period_results[SLLH][control_description[PARAMETER_ID]]
-#                for period_index, period_results in enumerate(periods_results)
-#                if period_index in control_description[PERIODS]
-#            )
-#
-#        results = {
-#            LLH: llh,
-#            SLLH: sllh,
-#            PERIODS_RESULTS: periods_results,
-#        }
-#
-#        return results
+                    raise ValueError(
+                        'Please supply a value for the control parameter '
+                        f'`{parameter_value}` (instance of parameter `{parameter_id}`). '
+                        'This can be supplied in multiple ways, for example, '
+                        'as a key-value pair in the `problem_parameters` '
+                        'argument of this method.'
+                    )
+                problem_parameters_periods[period_index][parameter_id] = \
+                    parameter_value
+        return problem_parameters_periods
+
+    def simulate(
+        self,
+        problem_parameters: Dict[str, float],
+        full_results: bool = False,
+    ):
+        """Simulate the timecourse for a control problem.
+
+        All parameters that appear in any timecourse period condition
+        should have at least default values in for all timecourse periods.
+        i.e. the problem parameters should be a list of dictionaries where
+        all dictionaries have the same keys.
+
+        Args:
+            problem_parameters:
+                Values to substitute in for estimated control parameters,
+                on parameter scale.
+            full_results:
+                Whether to return the AMICI return data of each period, if
+                the simulator was setup with `lean_results`, e.g. for the
+                trajectories of the final solution.
+        """
+        problem_parameters_periods = self.get_problem_parameters_periods(
+            problem_parameters=problem_parameters,
+        )
+
+        simulate_kwargs = {}
+        if full_results and getattr(self.simulator, 'lean_results', False):
+            simulate_kwargs['lean_results'] = False
+        periods_results = self.simulator.simulate(
+            problem_parameters_periods=problem_parameters_periods,
+            scaled_parameters=True,
+            control_parameters=self.simulator_control_parameters,
+            **simulate_kwargs,
+        )
+
+        llh = sum(period_results[LLH] for period_results in periods_results)
+        sllh = {}
+        # The gradients of simulators with sensitivity sources are by
+        # control, and include the effects on later periods.
+        by_source = (
+            getattr(self.simulator, 'sensitivity_sources_periods', None)
+            is not None
+        )
+        for control_parameter_id, control_description in self.simulator_control_parameters.items():
+            if by_source:
+                sllh[control_parameter_id] = sum(
+                    period_results[SLLH].get(control_parameter_id, 0)
+                    for period_results in periods_results
+                )
+                continue
+            sllh[control_parameter_id] = sum(
+                period_results[SLLH].get(control_description[PARAMETER_ID], 0)
+                for period_index, period_results in enumerate(periods_results)
+                if period_index in control_description[PERIODS]
+            )
+
+        results = {
+            LLH: llh,
+            SLLH: sllh,
+            PERIODS_RESULTS: periods_results,
+        }
+
+        return results
+
+
+class LazyProblems(Mapping):
+    """The problems of a PEtab Control YAML file, read on first access.
+
+    Attributes:
+        yaml_path:
+            The YAML file.
+        problem_ids:
+            The IDs of the problems, in the order of the YAML file.
+        cache_dir:
+            See `Problem.from_yaml`.
+        max_workers:
+            See `Problem.from_yaml`.
+    """
+    def __init__(
+        self,
+        yaml_path: TYPE_PATH,
+        problem_ids: List[str],
+        cache_dir: TYPE_PATH = None,
+        max_workers: int = None,
+    ):
+        self.yaml_path = yaml_path
+        self.problem_ids = problem_ids
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self._problems = {}
+
+    def __getitem__(self, problem_id: str) -> Problem:
+        if problem_id not in self._problems:
+            if problem_id not in self.problem_ids:
+                raise KeyError(problem_id)
+            self._problems[problem_id] = Problem.from_yaml(
+                self.yaml_path,
+                problem_id=problem_id,
+                cache_dir=self.cache_dir,
+                max_workers=self.max_workers,
+            )
+        return self._problems[problem_id]
+
+    def __iter__(self):
+        return iter(self.problem_ids)
+
+    def __len__(self) -> int:
+        return len(self.problem_ids)
+
+
+def read_problem_dicts(yaml_path: TYPE_PATH) -> Dict[str, Dict[str, Any]]:
+    """Read the problem specifications of a PEtab Control YAML file.
+
+    Args:
+        yaml_path:
+            The YAML file.
+
+    Returns:
+        Keys are problem IDs, values are the specifications of the problems.
+    """
+    with open(yaml_path, 'r') as f:
+        yaml_dict = yaml.safe_load(f)
+
+    problem_dicts = {}
+    for problem_dict in yaml_dict[PROBLEMS]:
+        problem_id = problem_dict[PROBLEM_ID]
+        if problem_id in problem_dicts:
+            raise ValueError(
+                f'Duplicate problem ID `{problem_id}` in `{yaml_path}`.'
+            )
+        problem_dicts[problem_id] = problem_dict
+    return problem_dicts
+
+
+def concat_tables(
+    tables: List[pd.DataFrame],
+    table_name: str,
+) -> pd.DataFrame:
+    """Concatenate the tables that were read from the files of one table.
+
+    Args:
+        tables:
+            The tables.
+        table_name:
+            The name of the table, for error messages.
+
+    Returns:
+        The concatenated table. A single table is returned as is.
+    """
+    if not tables:
+        raise ValueError(f'No files were specified for `{table_name}`.')
+    if len(tables) == 1:
+        return tables[0]
+    return pd.concat(
+        tables,
+        sort=False,
+        ignore_index=all(
+            isinstance(table.index, pd.RangeIndex)
+            for table in tables
+        ),
+    )
+
+
+def get_start_time(
+    petab_control_problem: Problem,
+    petab_problem: petab.Problem,
+) -> float:
+    """Get the time when the controls start.
+
+    Args:
+        petab_control_problem:
+            The PEtab Control problem.
+        petab_problem:
+            The original PEtab problem.
+
+    Returns:
+        The start time. Control times are relative to it.
+    """
+    if petab_control_problem.start_time == LAST_MEASURED_TIMEPOINT:
+        return petab_problem.measurement_df[TIME].max()
+    return petab_control_problem.start_time
 
 
 def get_period_id(period_index: int, time: float):
@@ -781,7 +1465,447 @@ def get_control_events_petab_problem(
     petab_problem: petab.Problem,
     unscaled_parameters0: Dict[str, float] = None,
     timecourse_id: str = None,
+    consolidate_events: bool = False,
+    encoding: str = ENCODING_EVENTS,
 ) -> petab.Problem:
+    """Create a PEtab problem with the controls in some encoding.
+
+    All encodings produce equivalent problems, with the same parameter and
+    measurement tables. The encodings differ in how the controls are applied
+    during simulation, which may affect compile, simulation and gradient
+    times. See `benchmarks/benchmark_encodings.py`.
+
+    Args:
+        petab_control_problem:
+            The PEtab Control problem.
+        petab_problem:
+            The original PEtab problem.
+        unscaled_parameters0:
+            Estimates for all estimated parameters of the original PEtab
+            problem, on linear scale. These are fixed in the returned problem.
+        timecourse_id:
+            The ID of the controlled timecourse.
+        consolidate_events:
+            Whether to create a single event for all controls at the same
+            time, with one event assignment per control, instead of one
+            event per control. Only used with `ENCODING_EVENTS`.
+        encoding:
+            The encoding of the controls. One of `ENCODINGS`:
+            - `ENCODING_EVENTS`: SBML events that assign the control
+              parameters (see `add_control_events`);
+            - `ENCODING_TIMECOURSE`: PEtab timecourse conditions that assign
+              the control parameters (see
+              `petab.parameter_controls_to_timecourse_new`);
+            - `ENCODING_SWITCHES`: SBML events that apply the switch
+              conditions (see `petab.get_switch_condition_df`), and an
+              assignment rule for each controlled parameter that sums the
+              switches multiplied by the control parameters (see
+              `petab.parameter_controls_to_formulae`); or
+            - `ENCODING_SWITCH_CONDITIONS`: as `ENCODING_SWITCHES`, but the
+              switch conditions are PEtab timecourse conditions.
+
+    Returns:
+        The PEtab problem. With `ENCODING_EVENTS` or `ENCODING_SWITCHES`,
+        the problem can be simulated with a standard PEtab simulator, and
+        has no timecourse table or timecourse extension. The other
+        encodings are simulated with `petab_timecourse`.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(
+            f'Unknown encoding: `{encoding}`. Available encodings: {ENCODINGS}'
+        )
+
+    if timecourse_id is None:
+        timecourse_id = one(petab_problem.condition_df.index)
+
+    condition_template = {}
+    if timecourse_id in petab_problem.condition_df.index:
+        condition_template = dict(
+            petab_problem.condition_df.loc[timecourse_id]
+        )
+
+    model_id_suffix = 'control_events_petab_problem'
+    if encoding != ENCODING_EVENTS:
+        model_id_suffix = f'control_{encoding}_petab_problem'
+    petab_problem, control_set = _get_control_petab_problem_base(
+        petab_control_problem=petab_control_problem,
+        petab_problem=petab_problem,
+        unscaled_parameters0=unscaled_parameters0,
+        timecourse_id=timecourse_id,
+        model_id_suffix=model_id_suffix,
+    )
+
+    if encoding == ENCODING_TIMECOURSE:
+        set_control_parameters_not_constant(
+            petab_control_problem=petab_control_problem,
+            petab_problem=petab_problem,
+        )
+        return petab_problem
+
+    if encoding == ENCODING_EVENTS:
+        add_control_events(
+            sbml_model=petab_problem.sbml_model,
+            parameter_controls=control_set,
+            consolidate_events=consolidate_events,
+        )
+    else:
+        _add_control_defaults(
+            petab_problem=petab_problem,
+            parameter_ids=control_set.target_ids,
+        )
+        formulae = parameter_controls_to_formulae(control_set)
+        SbmlBatchEditor(petab_problem.sbml_model).add_assignment_rules(
+            target_ids=list(formulae),
+            formulae=list(formulae.values()),
+        )
+        switch_condition_df = get_switch_condition_df(control_set)
+        if encoding == ENCODING_SWITCH_CONDITIONS:
+            petab_problem.condition_df = petab.get_condition_df(pd.concat([
+                switch_condition_df.reset_index().assign(
+                    **condition_template,
+                ),
+                pd.DataFrame(data={CONDITION_ID: [timecourse_id]}),
+            ], ignore_index=True))
+            petab_problem.timecourse_df = get_switch_timecourse_df(
+                parameter_controls=control_set,
+                timecourse_id=timecourse_id,
+            )
+            return petab_problem
+        add_condition_events(
+            sbml_model=petab_problem.sbml_model,
+            condition_df=switch_condition_df,
+            times=np.unique(control_set.times),
+        )
+
+    # The controls are now encoded in the model, so only the controlled
+    # timecourse remains as a (non-timecourse) experimental condition, and
+    # the problem does not use the timecourse extension.
+    condition_df = petab_problem.condition_df.loc[[timecourse_id]]
+    petab_problem.condition_df = condition_df.dropna(axis=1, how='all')
+    petab_problem.timecourse_df = None
+    petab_problem.extensions_config = {
+        extension_id: extension_config
+        for extension_id, extension_config in (
+            petab_problem.extensions_config or {}
+        ).items()
+        if extension_id != TIMECOURSE
+    }
+
+    return petab_problem
+
+
+def add_control_events(
+    sbml_model: libsbml.Model,
+    parameter_controls: Union[ControlSet, Dict[str, List[ParameterControl]]],
+    consolidate_events: bool = False,
+) -> None:
+    """Encode controls as SBML events.
+
+    Args:
+        sbml_model:
+            The SBML model, which already contains the control parameters.
+        parameter_controls:
+            The controls.
+        consolidate_events:
+            See `get_control_events_petab_problem`.
+    """
+    control_set = get_control_set(parameter_controls)
+    assigned_values = np.where(
+        control_set.estimate,
+        control_set.control_parameter_ids,
+        control_set.values,
+    )
+    # Events that apply controls at the same time can be consolidated into
+    # a single event, to reduce the number of roots for the integrator.
+    event_keys = (
+        control_set.times
+        if consolidate_events
+        else control_set.event_ids
+    )
+    events_assignments = {}
+    for event_key, time, target_index, assigned_value in zip(
+        event_keys,
+        control_set.times,
+        control_set.target_indices,
+        assigned_values,
+    ):
+        if event_key not in events_assignments:
+            events_assignments[event_key] = (time, {})
+        _, assignments = events_assignments[event_key]
+        target_id = control_set.target_ids[target_index]
+        if target_id in assignments:
+            raise ValueError(
+                'Multiple controls are defined for the same parameter and '
+                f'time. Parameter: {target_id}. '
+                f'Time: {time}.'
+            )
+        assignments[target_id] = assigned_value
+
+    SbmlBatchEditor(sbml_model).add_time_events(
+        event_ids=[
+            get_time_event_id(time) if consolidate_events else event_key
+            for event_key, (time, _) in events_assignments.items()
+        ],
+        times=[time for time, _ in events_assignments.values()],
+        assignments=[
+            assignments
+            for _, assignments in events_assignments.values()
+        ],
+    )
+
+
+def get_cached_control_events_petab_problem(
+    petab_control_yaml: TYPE_PATH,
+    petab_yaml: TYPE_PATH,
+    cache_dir: TYPE_PATH,
+    unscaled_parameters0: Dict[str, float] = None,
+    timecourse_id: str = None,
+    consolidate_events: bool = False,
+    encoding: str = ENCODING_EVENTS,
+) -> petab.Problem:
+    """Load a control PEtab problem from files, with a disk cache.
+
+    The generated SBML model and PEtab tables are cached under a hash of both
+    YAML files, all files that they reference, and the other arguments. If
+    the files are unchanged, e.g. in worker processes or repeated runs, the
+    cached problem is read instead of generated.
+
+    Args:
+        petab_control_yaml:
+            The PEtab Control YAML file.
+        petab_yaml:
+            The PEtab (timecourse) YAML file of the original problem.
+        cache_dir:
+            The cache directory.
+        unscaled_parameters0:
+            See `get_control_events_petab_problem`.
+        timecourse_id:
+            See `get_control_events_petab_problem`.
+        consolidate_events:
+            See `get_control_events_petab_problem`.
+        encoding:
+            See `get_control_events_petab_problem`.
+
+    Returns:
+        The PEtab problem.
+    """
+    def create():
+        return get_control_events_petab_problem(
+            petab_control_problem=Problem.from_yaml(
+                petab_control_yaml,
+                cache_dir=cache_dir,
+            ),
+            petab_problem=petab_timecourse.Problem.from_yaml(str(petab_yaml)),
+            unscaled_parameters0=unscaled_parameters0,
+            timecourse_id=timecourse_id,
+            consolidate_events=consolidate_events,
+            encoding=encoding,
+        )
+
+    return get_cached(
+        cache_dir=cache_dir,
+        key=get_files_hash(
+            [petab_control_yaml, petab_yaml],
+            cached=ENCODED_PETAB_PROBLEM,
+            unscaled_parameters0=unscaled_parameters0,
+            timecourse_id=timecourse_id,
+            consolidate_events=consolidate_events,
+            encoding=encoding,
+        ),
+        create=create,
+        write=write_petab_problem,
+        read=lambda directory: read_petab_problem(
+            directory,
+            petab_problem_class=petab_timecourse.Problem,
+        ),
+    )
+
+
+def get_structural_control_petab_problem(
+    petab_control_problem: Problem,
+    petab_problem: petab.Problem,
+    unscaled_parameters0: Dict[str, float] = None,
+    timecourse_id: str = None,
+) -> petab.Problem:
+    """Create a PEtab problem where the model does not depend on control values.
+
+    The model has one event per control, which is triggered at a time stored
+    in a parameter, and assigns a value stored in a parameter. These
+    parameters are set in the conditions table, so the model only depends on
+    which parameters are controlled, and how many times. Hence, problems
+    with different control times or values share the same model, and the
+    same compiled AMICI model. See `simulator.import_cached_petab_problem`.
+
+    Args:
+        petab_control_problem:
+            See `get_control_events_petab_problem`.
+        petab_problem:
+            See `get_control_events_petab_problem`.
+        unscaled_parameters0:
+            See `get_control_events_petab_problem`.
+        timecourse_id:
+            See `get_control_events_petab_problem`.
+
+    Returns:
+        The PEtab problem.
+    """
+    if timecourse_id is None:
+        timecourse_id = one(petab_problem.condition_df.index)
+
+    petab_problem, control_set = _get_control_petab_problem_base(
+        petab_control_problem=petab_control_problem,
+        petab_problem=petab_problem,
+        unscaled_parameters0=unscaled_parameters0,
+        timecourse_id=timecourse_id,
+        model_id_suffix='control_structural_petab_problem',
+        add_control_parameters=False,
+    )
+
+    slots = []
+    condition = {}
+    target_rows = control_set.target_rows
+    for parameter_id in sorted(target_rows):
+        for index, row in enumerate(target_rows[parameter_id]):
+            slot = ParameterControlSlot(parameter_id=parameter_id, index=index)
+            slots.append(slot)
+            condition[slot.get_time_parameter_id()] = \
+                float(control_set.times[row])
+            # All control parameters are in the parameters table, so the
+            # column type, hence the model, is the same for fixed and
+            # estimated controls.
+            condition[slot.get_value_parameter_id()] = \
+                control_set.control_parameter_ids[row]
+
+    sbml_editor = SbmlBatchEditor(petab_problem.sbml_model)
+    # Default values are irrelevant, since they are set by the condition, but
+    # must not depend on the controls.
+    sbml_editor.add_parameters(
+        [
+            parameter_id
+            for slot in slots
+            for parameter_id in [
+                slot.get_time_parameter_id(),
+                slot.get_value_parameter_id(),
+            ]
+        ],
+        ZERO,
+    )
+    sbml_editor.add_time_events(
+        event_ids=[slot.get_event_id() for slot in slots],
+        times=[slot.get_time_parameter_id() for slot in slots],
+        assignments=[
+            {slot.target_id: slot.get_value_parameter_id()}
+            for slot in slots
+        ],
+    )
+
+    condition_df = petab_problem.condition_df.loc[[timecourse_id]]
+    condition_df = condition_df.dropna(axis=1, how='all')
+    petab_problem.condition_df = condition_df.assign(**condition)
+    petab_problem.timecourse_df = None
+
+    return petab_problem
+
+
+def _add_control_defaults(
+    petab_problem: petab.Problem,
+    parameter_ids: List[str],
+) -> None:
+    """Store the values of controlled parameters before any control.
+
+    Controlled parameters are assigned by rules in some encodings, so their
+    values before any control are moved to new parameters.
+
+    Args:
+        petab_problem:
+            The PEtab problem. Edited in-place.
+        parameter_ids:
+            The IDs of the controlled parameters.
+    """
+    sbml_model = petab_problem.sbml_model
+    SbmlBatchEditor(sbml_model).add_parameters(
+        [
+            get_control_default_parameter_id(parameter_id)
+            for parameter_id in parameter_ids
+        ],
+        [
+            sbml_model.getParameter(parameter_id).getValue()
+            for parameter_id in parameter_ids
+        ],
+    )
+    petab_problem.parameter_df = petab_problem.parameter_df.rename(index={
+        parameter_id: get_control_default_parameter_id(parameter_id)
+        for parameter_id in parameter_ids
+    })
+
+
+def add_condition_events(
+    sbml_model: libsbml.Model,
+    condition_df: pd.DataFrame,
+    times: Sequence[float],
+) -> None:
+    """Apply conditions at fixed times with SBML events.
+
+    Each event only assigns the values that differ from the previous
+    condition. Values are assumed to be `0` before the first condition.
+
+    Args:
+        sbml_model:
+            The SBML model, which already contains the parameters that the
+            conditions set, as non-constant parameters.
+        condition_df:
+            The conditions, in order of time. Values must be numeric.
+        times:
+            The time of each condition.
+    """
+    values = condition_df.to_numpy(dtype=float)
+    changed = values != np.vstack([
+        np.zeros((1, values.shape[1])),
+        values[:-1],
+    ])
+    parameter_ids = condition_df.columns.to_numpy()
+    SbmlBatchEditor(sbml_model).add_time_events(
+        event_ids=[get_time_event_id(time) for time in times],
+        times=times,
+        assignments=[
+            dict(zip(parameter_ids[row_changed], row_values[row_changed]))
+            for row_values, row_changed in zip(values, changed)
+        ],
+    )
+
+
+def _get_control_petab_problem_base(
+    petab_control_problem: Problem,
+    petab_problem: petab.Problem,
+    unscaled_parameters0: Dict[str, float],
+    timecourse_id: str,
+    model_id_suffix: str,
+    add_control_parameters: bool = True,
+) -> Tuple[petab.Problem, ControlSet]:
+    """Create the tables and control parameters of a PEtab control problem.
+
+    The control parameters and switch parameters are added to the SBML
+    model, but the controls are not yet encoded in the model.
+
+    Args:
+        petab_control_problem:
+            See `get_control_events_petab_problem`.
+        petab_problem:
+            See `get_control_events_petab_problem`.
+        unscaled_parameters0:
+            See `get_control_events_petab_problem`.
+        timecourse_id:
+            See `get_control_events_petab_problem`.
+        model_id_suffix:
+            Appended to the SBML model ID.
+        add_control_parameters:
+            Whether to add the control and switch parameters to the SBML
+            model.
+
+    Returns:
+        The PEtab problem, and the controls, with times that include the
+        start time.
+    """
     if unscaled_parameters0 is None:
         unscaled_parameters0 = {}
 
@@ -805,76 +1929,42 @@ def get_control_events_petab_problem(
         parameter_data0.append(parameter_datum0)
     parameter_df0 = petab.get_parameter_df(pd.DataFrame(parameter_data0))
 
-    petab_problem = copy.deepcopy(petab_problem)
+    petab_problem = derive_petab_problem(petab_problem)
 
-    start_time = petab_control_problem.start_time
-    if petab_control_problem.start_time == LAST_MEASURED_TIMEPOINT:
-        start_time = petab_problem.measurement_df[TIME].max()
+    start_time = get_start_time(
+        petab_control_problem=petab_control_problem,
+        petab_problem=petab_problem,
+    )
 
     sbml_model = petab_problem.sbml_model
-    model_id = f'{petab_problem.sbml_model.getId()}__control_events_petab_problem'
+    model_id = f'{petab_problem.sbml_model.getId()}__{model_id_suffix}'
     petab_problem.model.sbml_model.setId(model_id)
     petab_problem.model.model_id = model_id
 
     # Generate control and switch parameters
-    parameter_controls = {}
-    for _, row in petab_control_problem.control_df.iterrows():
-        parameter_id = row[PARAMETER_ID]
-        parameter_control = ParameterControl(
-            parameter_id=parameter_id,
-            value=row[VALUE],
-            time=row[TIME] + start_time,
-        )
-        if parameter_id in parameter_controls:
-            parameter_controls[parameter_id].append(parameter_control)
-        else:
-            parameter_controls[parameter_id] = [parameter_control]
-
-    for parameter_id, controls in parameter_controls.items():
-        for control in controls:
-            value = control.value
-            if value == ESTIMATE:
-                value = DUMMY_VALUE
-            add_parameter(
-                sbml_model,
-                control.get_control_parameter_id(),
-                value,
-            )
-            add_parameter(
-                sbml_model,
-                control.get_switch_parameter_id(),
-                ZERO,
-                constant=False,
-            )
-
-    # FIXME move to different file as function...
-    for parameter_id, controls in parameter_controls.items():
-        for control in controls:
-            event_id = control.get_event_id()
-            offset_control_time = control.time + start_time
-            trigger_formula = f'time >= {offset_control_time}'
-            variable = control.target_id
-            event_assignment_formula = control.value
-            if control.value == ESTIMATE:
-                event_assignment_formula = control.get_control_parameter_id()
-
-            event = sbml_model.createEvent()
-            event.setId(event_id)
-            event.setUseValuesFromTriggerTime(True)
-
-            trigger = event.createTrigger()
-            trigger.setInitialValue(True)
-            trigger.setPersistent(True)
-            trigger_math = libsbml.parseL3Formula(trigger_formula)
-            trigger.setMath(trigger_math)
-
-            event_assignment = event.createEventAssignment()
-            event_assignment.setVariable(variable)
-            event_assignment_math = \
-                libsbml.parseL3Formula(str(event_assignment_formula))
-            event_assignment.setMath(event_assignment_math)
-    # END FIXME
+    control_set = ControlSet.from_control_df(
+        petab_control_problem.control_df,
+        start_time=start_time,
+    )
 
+    if add_control_parameters:
+        # Each control parameter is followed by its switch parameter.
+        control_values = np.where(
+            control_set.estimate,
+            DUMMY_VALUE,
+            control_set.values,
+        ).astype(float)
+        SbmlBatchEditor(sbml_model).add_parameters(
+            np.column_stack([
+                control_set.control_parameter_ids,
+                control_set.switch_parameter_ids,
+            ]).ravel(),
+            np.column_stack([
+                control_values,
+                np.full(len(control_set), float(ZERO)),
+            ]).ravel(),
+            constant=np.tile([True, False], len(control_set)),
+        )
 
     #parameter_df = parameter_controls_to_parameter_df(
     #    parameter_controls,
@@ -890,67 +1980,65 @@ def get_control_events_petab_problem(
     condition_df, parameter_df, timecourse_df = \
         parameter_controls_to_timecourse_new(
             # FIXME use kwargs
-            parameter_controls=parameter_controls,
+            parameter_controls=control_set,
             petab_problem=petab_problem,
             petab_control_problem=petab_control_problem,
             timecourse_id=timecourse_id,
         )
 
+    objective_measurement_df = petab_control_problem.objective_measurement_df
+
     petab_problem.condition_df = condition_df
-    petab_problem.measurement_df = petab_control_problem.objective_measurement_df
+    petab_problem.measurement_df = objective_measurement_df.assign(**{
+        TIME: objective_measurement_df[TIME] + start_time,
+        SIMULATION_CONDITION_ID: timecourse_id,
+    })
     petab_problem.parameter_df = pd.concat([parameter_df, parameter_df0])
     petab_problem.observable_df = petab_control_problem.objective_observable_df
     petab_problem.timecourse_df = timecourse_df
 
-    petab_problem.measurement_df[TIME] += start_time
-    petab_problem.measurement_df[SIMULATION_CONDITION_ID] = "timecourse1"
+    return petab_problem, control_set
 
-    return petab_problem
 
 def get_control_petab_timecourse_problem(
     petab_control_problem: Problem,
     petab_problem: petab.Problem,
 ) -> petab.Problem:
-    petab_problem = copy.deepcopy(petab_problem)
+    petab_problem = derive_petab_problem(petab_problem)
 
-    start_time = petab_control_problem.start_time
-    if petab_control_problem.start_time == LAST_MEASURED_TIMEPOINT:
-        start_time = petab_problem.measurement_df[TIME].max()
+    start_time = get_start_time(
+        petab_control_problem=petab_control_problem,
+        petab_problem=petab_problem,
+    )
 
     petab_problem.sbml_model.setId(
         f'{petab_problem.sbml_model.getId()}__control_petab_timecourse_problem'
     )
 
     # Generate control and switch parameters
-    parameter_controls = {}
-    for _, row in petab_control_problem.control_df.iterrows():
-        parameter_id = row[PARAMETER_ID]
-        parameter_control = ParameterControl(
-            parameter_id=parameter_id,
-            value=row[VALUE],
-            time=row[TIME] + start_time,
-        )
-        if parameter_id in parameter_controls:
-            parameter_controls[parameter_id].append(parameter_control)
-        else:
-            parameter_controls[parameter_id] = [parameter_control]
+    control_set = ControlSet.from_control_df(
+        petab_control_problem.control_df,
+        start_time=start_time,
+    )
 
     condition_df, parameter_df, timecourse_df = \
         parameter_controls_to_timecourse_new(
             # FIXME use kwargs
-            parameter_controls,
+            control_set,
             petab_problem,
             petab_control_problem,
         )
 
+    objective_measurement_df = petab_control_problem.objective_measurement_df
+
     petab_problem.condition_df = condition_df
-    petab_problem.measurement_df = petab_control_problem.objective_measurement_df
+    petab_problem.measurement_df = objective_measurement_df.assign(**{
+        TIME: objective_measurement_df[TIME] + start_time,
+    })
     petab_problem.parameter_df = parameter_df
     petab_problem.observable_df = petab_control_problem.objective_observable_df
     petab_problem.timecourse_df = timecourse_df
 
-    petab_problem.measurement_df[TIME] += start_time
-
     return petab_problem
 
 def get_control_petab_problem(
@@ -958,11 +2046,12 @@ def get_control_petab_problem(
     petab_problem: petab.Problem,
     timecourse_id: str,
 ) -> petab.Problem:
-    petab_problem = copy.deepcopy(petab_problem)
+    petab_problem = derive_petab_problem(petab_problem)
 
-    start_time = petab_control_problem.start_time
-    if petab_control_problem.start_time == LAST_MEASURED_TIMEPOINT:
-        start_time = petab_problem.measurement_df[TIME].max()
+    start_time = get_start_time(
+        petab_control_problem=petab_control_problem,
+        petab_problem=petab_problem,
+    )
 
     petab_problem.sbml_model.setId(
         f'{petab_problem.sbml_model.getId()}__control_petab_problem'
@@ -996,7 +2085,7 @@ def get_control_petab_problem(
     '''
 
     condition_df = pd.concat([
-        copy.deepcopy(petab_problem.condition_df),
+        petab_problem.condition_df,
         pd.Series(name=CONTROL_CONDITION_ID).to_frame().T,
         pd.Series(name=CONTROL_TIMECOURSE_ID).to_frame().T,
     ])
@@ -1010,31 +2099,26 @@ def get_control_petab_problem(
     )
     full_timecourse_df = full_timecourse.to_df()
 
-    petab_problem.condition_df = condition_df.copy()
-    petab_problem.measurement_df = \
-        petab_control_problem.objective_measurement_df.copy()
-    petab_problem.observable_df = \
-        petab_control_problem.objective_observable_df.copy()
-    petab_problem.timecourse_df = full_timecourse_df.copy()
+    objective_measurement_df = petab_control_problem.objective_measurement_df
+
+    petab_problem.condition_df = condition_df
+    petab_problem.measurement_df = objective_measurement_df.assign(**{
+        TIME: objective_measurement_df[TIME] + start_time,
+        SIMULATION_CONDITION_ID: CONTROL_TIMECOURSE_ID,
+    })
+    petab_problem.observable_df = petab_control_problem.objective_observable_df
+    petab_problem.timecourse_df = full_timecourse_df
 
-    original_parameter_df = petab_problem.parameter_df.copy()
-    original_parameter_df[ESTIMATE] = 0
-    petab_problem.parameter_df = original_parameter_df
+    original_parameter_df = petab_problem.parameter_df.assign(**{ESTIMATE: 0})
     #petab_problem.parameter_df = pd.concat([
     #    original_parameter_df,
     #    petab_control_problem.parameter_df,
     #])
 
-    petab_problem.measurement_df[TIME] += start_time
-    petab_problem.measurement_df[SIMULATION_CONDITION_ID] = \
-        CONTROL_TIMECOURSE_ID
-
-    petab_problem.parameter_df = (
-        pd.concat([
-            petab_problem.parameter_df.copy(),
-            petab_control_problem.parameter_df,
-        ])
-    )
+    petab_problem.parameter_df = pd.concat([
+        original_parameter_df,
+        petab_control_problem.parameter_df,
+    ])
 
     #breakpoint()
 
@@ -1,4 +1,33 @@
-from typing import Dict, Tuple
+from functools import partial
+from typing import Any, Dict, Sequence, Tuple
+
+import pypesto.objective
+import pypesto.petab
+
+from .constants import (
+    CONTROL_ID,
+    ENCODING_EVENTS,
+    ESTIMATE,
+    SENSITIVITY_METHOD_ADJOINT,
+    SENSITIVITY_METHOD_FORWARD,
+    VALUE,
+)
+from .objective import (
+    CachedObjective,
+    choose_sensitivity_method,
+    get_encoded_gradient_mapping,
+    get_gradient_mapping,
+    get_objective_state,
+    simulate_encoded_objective,
+    simulate_objective,
+    simulate_objective_state,
+    simulate_objective_state_batch,
+)
+from .problem import (
+    Problem,
+    get_control_events_petab_problem,
+    get_start_time,
+)
 
 
 def get_parameters_from_pypesto_result(
@@ -12,3 +41,276 @@ def get_parameters_from_pypesto_result(
     ))
     unscaled_parameters = petab_problem.unscale_parameters(scaled_parameters)
     return scaled_parameters, unscaled_parameters
+
+
+def get_pypesto_problem(
+    petab_control_problem: Problem,
+    setup_simulator_kwargs: Dict,
+    petab_importer_kwargs: Dict,
+    lean_objective: bool = False,
+    cache_size: int = 16,
+    gradient_on_demand: bool = False,
+    num_threads: int = 1,
+    sensitivity_method: str = SENSITIVITY_METHOD_FORWARD,
+    adjoint_import_kwargs: Dict[str, Any] = None,
+    residuals: bool = False,
+):
+    """Create a pyPESTO problem for a PEtab Control problem.
+
+    Args:
+        petab_control_problem:
+            The PEtab Control problem.
+        setup_simulator_kwargs:
+            Passed to `Problem.setup_simulator`.
+        petab_importer_kwargs:
+            Passed to `pypesto.petab.PetabImporter`.
+        lean_objective:
+            Whether the objective only holds a compact objective state,
+            instead of the PEtab Control problem. This reduces the data that
+            is sent to worker processes of e.g.
+            `pypesto.engine.MultiProcessEngine`, which import the compiled
+            model once and reuse it for all their tasks. Requires a
+            `petab_control.simulator.ControlSimulator`. See
+            `petab_control.objective.get_objective_state`.
+        cache_size:
+            The number of parameter vectors with cached objective results.
+            See `petab_control.objective.CachedObjective`.
+        gradient_on_demand:
+            Whether the gradient is only computed when pyPESTO requests it.
+            Objective values alone are then computed without sensitivities.
+        num_threads:
+            The number of threads of batch evaluations with the lean
+            objective, e.g. of multi-start startpoints. Batches are
+            evaluated with `pypesto_problem.objective.cached_objective`,
+            see `petab_control.objective.CachedObjective.evaluate_batch`.
+        sensitivity_method:
+            One of `SENSITIVITY_METHODS`. With `SENSITIVITY_METHOD_ADJOINT`,
+            the objective simulates the events-encoded problem (see
+            `get_control_events_petab_problem`) in a single AMICI
+            simulation with adjoint sensitivities, since adjoint
+            sensitivities cannot be propagated between the periods of the
+            simulator. The encoded problem is imported with AMICI, and
+            requires `setup_simulator_kwargs` with the original
+            `petab_problem`, and `fix_petab_problem_parameters` for all its
+            estimated parameters. `SENSITIVITY_METHOD_AUTO` chooses adjoint
+            sensitivities for problems with many more parameters than
+            states, and forward sensitivities for lean objectives. See
+            `petab_control.objective.choose_sensitivity_method`.
+        adjoint_import_kwargs:
+            Passed to `amici.petab_import.import_petab_problem`, to import
+            the encoded problem for adjoint sensitivities.
+        residuals:
+            Whether the objective also provides residuals (`res`), residual
+            sensitivities (`sres`), and the Gauss-Newton approximation of
+            the Hessian (`hess`), for e.g. trust-region and least-squares
+            optimizers. Requires objective observables with normally
+            distributed noise, forward sensitivities, and no lean
+            objective. See
+            `petab_control.objective.GradientMapping.get_residuals`.
+
+    Returns:
+        The pyPESTO problem.
+    """
+    petab_control_problem.setup_simulator(**setup_simulator_kwargs)
+
+    x_names = [
+        x_name
+        for x_index, x_name in enumerate(
+            petab_control_problem
+            .optimizer_control_petab_problem
+            .parameter_df
+            .index
+        )
+    ]
+    parameter_df = (
+        petab_control_problem
+        .optimizer_control_petab_problem
+        .parameter_df
+    )
+    estimated_x_names = list(
+        parameter_df.loc[parameter_df[ESTIMATE] == 1].index
+    )
+    # Adjoint sensitivities are computed with the encoded problem, where
+    # only the controls are estimated.
+    control_df = petab_control_problem.control_df
+    unsupported_x_names = set(estimated_x_names).difference(
+        control_df.loc[control_df[VALUE] == ESTIMATE, CONTROL_ID]
+    )
+    if residuals and lean_objective:
+        raise ValueError('Lean objectives do not support residuals.')
+    if sensitivity_method == SENSITIVITY_METHOD_ADJOINT:
+        if lean_objective:
+            raise ValueError(
+                'Lean objectives only support forward sensitivities.'
+            )
+        if residuals:
+            raise ValueError(
+                'Residuals require forward sensitivities.'
+            )
+        if unsupported_x_names:
+            raise ValueError(
+                'Adjoint sensitivities only support estimated control '
+                'parameters. Please fix the other estimated parameters with '
+                '`fix_petab_problem_parameters`. Estimated parameters that '
+                f'are not control parameters: {sorted(unsupported_x_names)}'
+            )
+    amici_model = getattr(petab_control_problem.simulator, 'amici_model', None)
+    if (
+        lean_objective
+        or residuals
+        or unsupported_x_names
+        or amici_model is None
+    ):
+        sensitivity_method = SENSITIVITY_METHOD_FORWARD
+    sensitivity_method = choose_sensitivity_method(
+        n_parameters=len(estimated_x_names),
+        n_states=len(amici_model.getStateIds()) if amici_model else 0,
+        sensitivity_method=sensitivity_method,
+    )
+
+    simulate_batch = None
+    if sensitivity_method == SENSITIVITY_METHOD_ADJOINT:
+        simulate = get_adjoint_simulate(
+            petab_control_problem=petab_control_problem,
+            setup_simulator_kwargs=setup_simulator_kwargs,
+            x_names=x_names,
+            adjoint_import_kwargs=adjoint_import_kwargs,
+        )
+    else:
+        gradient_mapping = get_gradient_mapping(
+            petab_control_problem=petab_control_problem,
+            x_names=x_names,
+        )
+        if lean_objective:
+            objective_state = get_objective_state(
+                petab_control_problem=petab_control_problem,
+                x_names=x_names,
+                gradient_mapping=gradient_mapping,
+            )
+            simulate = partial(
+                simulate_objective_state,
+                objective_state=objective_state,
+            )
+            simulate_batch = partial(
+                simulate_objective_state_batch,
+                objective_state=objective_state,
+                num_threads=num_threads,
+            )
+        else:
+            simulate = partial(
+                simulate_objective,
+                petab_control_problem=petab_control_problem,
+                x_names=x_names,
+                gradient_mapping=gradient_mapping,
+                residuals=residuals,
+            )
+    cached_objective = CachedObjective(
+        simulate=simulate,
+        max_size=cache_size,
+        gradient_on_demand=gradient_on_demand,
+        simulate_batch=simulate_batch,
+    )
+    if residuals:
+        objective = pypesto.objective.Objective(
+            fun=cached_objective.fun,
+            grad=cached_objective.grad,
+            hess=cached_objective.hess,
+            res=cached_objective.res,
+            sres=True,
+        )
+    elif gradient_on_demand:
+        objective = pypesto.objective.Objective(
+            fun=cached_objective.fun,
+            grad=cached_objective.grad,
+        )
+    else:
+        objective = pypesto.objective.Objective(
+            fun=cached_objective,
+            grad=True,
+        )
+    objective.cached_objective = cached_objective
+
+    pypesto_importer = pypesto.petab.PetabImporter(
+        petab_problem=(
+            petab_control_problem
+            .optimizer_control_petab_problem
+        ),
+        **petab_importer_kwargs,
+    )
+
+    pypesto_problem = pypesto_importer.create_problem(
+        objective=objective,
+        problem_kwargs={'copy_objective': False},
+    )
+
+    return pypesto_problem
+
+
+def get_adjoint_simulate(
+    petab_control_problem: Problem,
+    setup_simulator_kwargs: Dict,
+    x_names: Sequence[str],
+    adjoint_import_kwargs: Dict[str, Any] = None,
+):
+    """Create an objective simulation with adjoint sensitivities.
+
+    Args:
+        petab_control_problem:
+            The PEtab Control problem, already setup with a simulator.
+        setup_simulator_kwargs:
+            The arguments of `Problem.setup_simulator`.
+        x_names:
+            The optimizer parameter IDs.
+        adjoint_import_kwargs:
+            See `get_pypesto_problem`.
+
+    Returns:
+        The simulation, as `simulate_encoded_objective` with all arguments
+        except `x` and `sensitivities` bound.
+    """
+    import amici
+    import amici.petab_import
+
+    petab_problem = get_control_events_petab_problem(
+        petab_control_problem=petab_control_problem,
+        petab_problem=setup_simulator_kwargs['petab_problem'],
+        unscaled_parameters0=setup_simulator_kwargs.get(
+            'fix_petab_problem_parameters'
+        ),
+        timecourse_id=setup_simulator_kwargs.get('timecourse_id'),
+        consolidate_events=True,
+        encoding=ENCODING_EVENTS,
+    )
+    gradient_mapping = get_encoded_gradient_mapping(
+        petab_control_problem=petab_control_problem,
+        petab_problem=petab_problem,
+        x_names=x_names,
+        start_time=get_start_time(
+            petab_control_problem=petab_control_problem,
+            petab_problem=setup_simulator_kwargs['petab_problem'],
+        ),
+    )
+
+    amici_model = amici.petab_import.import_petab_problem(
+        petab_problem,
+        **(adjoint_import_kwargs or {}),
+    )
+    for setter, value in (
+        setup_simulator_kwargs.get('model_settings') or {}
+    ).items():
+        getattr(amici_model, setter)(value)
+    amici_solver = amici_model.getSolver()
+    for setter, value in (
+        setup_simulator_kwargs.get('solver_settings') or {}
+    ).items():
+        getattr(amici_solver, setter)(value)
+    amici_solver.setSensitivityOrder(amici.SensitivityOrder.first)
+    amici_solver.setSensitivityMethod(amici.SensitivityMethod.adjoint)
+
+    return partial(
+        simulate_encoded_objective,
+        petab_problem=petab_problem,
+        amici_model=amici_model,
+        amici_solver=amici_solver,
+        gradient_mapping=gradient_mapping,
+    )
@@ -0,0 +1,503 @@
+"""Fit-then-control loops over moving time windows, with one compiled model."""
+from dataclasses import dataclass, field
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+import petab
+from petab.C import ESTIMATE, PARAMETER_SCALE
+import pypesto
+import pypesto.optimize
+import pypesto.petab
+
+from .constants import (
+    CATEGORY,
+    CONTROL,
+    CONTROL_TARGET,
+    CONTROL_TIME,
+    TYPE_PATH,
+)
+from .petab import derive_petab_problem
+from .petab_problem import (
+    FiniteHorizonIndex,
+    get_finite_control_petab_problem,
+    get_finite_petab_problem,
+)
+
+
+@dataclass
+class RecedingHorizonWindow:
+    """The results of one window of a receding-horizon loop.
+
+    Attributes:
+        t0:
+            The start of the window, i.e. the current time.
+        t1:
+            The end of the control horizon of the window.
+        fit_result:
+            The pyPESTO result of fitting the original parameters to the
+            measurements before `t0`.
+        control_result:
+            The pyPESTO result of optimizing the controls in `[t0, t1)`.
+        fit_parameters:
+            The fitted original parameters, on linear scale.
+        control_parameters:
+            The optimized controls, on linear scale.
+        timings:
+            The wall times, in seconds, of the steps of the window.
+    """
+    t0: float
+    t1: float
+    fit_result: Any = None
+    control_result: Any = None
+    fit_parameters: Dict[str, float] = field(default_factory=dict)
+    control_parameters: Dict[str, float] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+class RecedingHorizonController():
+    """Alternately fit and control a combined PEtab problem.
+
+    At each time `t`, the original parameters are fitted to the measurements
+    before `t`, then the controls in `[t, t + horizon)` are optimized, and
+    the controls in `[t, t + step)` are applied. Then `t` advances by `step`.
+
+    The AMICI model and the pyPESTO objective are created once from the
+    combined problem, with all parameters estimated. Windows only differ in
+    which parameters are estimated, their nominal values, and which
+    measurements are used. Hence, each window only replaces the
+    experimental data of the objective, and fixes parameters with the
+    pyPESTO problem of the window.
+
+    The fit of each window starts from the previous fit. The control
+    optimization of each window starts from the controls of the previous
+    window, shifted by one step. See `shift_controls`.
+
+    Attributes:
+        petab_problem:
+            The combined PEtab problem, e.g. from `get_combined_petab_problem`.
+        step:
+            The time between windows.
+        horizon:
+            The duration of the control horizon of each window.
+        fit_horizon:
+            The duration before the current time, of the measurements that
+            parameters are fitted to. All earlier measurements are used if
+            `None`.
+        n_starts:
+            The number of optimizer starts per optimization. The first start
+            is the warm start.
+        minimize_kwargs:
+            Passed to `pypesto.optimize.minimize`.
+        importer:
+            The pyPESTO importer of the combined problem, with all
+            parameters estimated.
+        amici_model:
+            The compiled AMICI model of the combined problem.
+        objective:
+            The pyPESTO objective of the combined problem, which is shared
+            by all windows.
+        finite_horizon_index:
+            The time index of the combined problem, to create windows.
+        windows:
+            The results of the windows so far.
+        applied_parameters:
+            The fitted parameters and applied controls so far, on linear
+            scale.
+    """
+    def __init__(
+        self,
+        petab_problem: petab.Problem,
+        step: float,
+        horizon: float,
+        fit_horizon: float = None,
+        n_starts: int = 1,
+        minimize_kwargs: Dict[str, Any] = None,
+        model_output_dir: TYPE_PATH = None,
+    ):
+        """Compile the model and create the objective.
+
+        Args:
+            petab_problem:
+                See the class attributes.
+            step:
+                See the class attributes.
+            horizon:
+                See the class attributes.
+            fit_horizon:
+                See the class attributes.
+            n_starts:
+                See the class attributes.
+            minimize_kwargs:
+                See the class attributes.
+            model_output_dir:
+                Where to compile the AMICI model.
+        """
+        if horizon < step:
+            raise ValueError(
+                'The control horizon must be at least as long as the step. '
+                f'Horizon: {horizon}. Step: {step}.'
+            )
+        self.petab_problem = petab_problem
+        self.step = step
+        self.horizon = horizon
+        self.fit_horizon = fit_horizon
+        self.n_starts = n_starts
+        self.minimize_kwargs = minimize_kwargs or {}
+
+        self.importer_kwargs = {}
+        if model_output_dir is not None:
+            self.importer_kwargs['output_folder'] = str(model_output_dir)
+
+        # Windows fix parameters with their pyPESTO problem, so the
+        # parameter mapping of the objective has all parameters.
+        estimated_petab_problem = derive_petab_problem(
+            petab_problem,
+            clone_model=False,
+        )
+        estimated_petab_problem.parameter_df = \
+            petab_problem.parameter_df.assign(**{ESTIMATE: 1})
+
+        start = time.perf_counter()
+        self.importer = pypesto.petab.PetabImporter(
+            estimated_petab_problem,
+            **self.importer_kwargs,
+        )
+        self.amici_model = self.importer.create_model()
+        self.compile_time = time.perf_counter() - start
+        self.objective = self.importer.create_objective(
+            model=self.amici_model,
+        )
+        self._simulation_conditions = (
+            estimated_petab_problem
+            .get_simulation_conditions_from_measurement_df()
+        )
+
+        self.finite_horizon_index = FiniteHorizonIndex(petab_problem)
+
+        self.windows: List[RecedingHorizonWindow] = []
+        self.applied_parameters: Dict[str, float] = {}
+        self._fit_estimates: Dict[str, float] = {}
+        self._control_estimates: Dict[str, float] = {}
+
+    def get_window_problem(
+        self,
+        t0: float,
+        fit: bool,
+    ) -> petab.Problem:
+        """Get the PEtab problem of a fit or control step of a window.
+
+        Args:
+            t0:
+                The start of the window.
+            fit:
+                Whether to get the problem of the fit step, or else the
+                problem of the control step.
+
+        Returns:
+            The PEtab problem.
+        """
+        nominal_values = dict(self.applied_parameters) or None
+        if fit:
+            return get_finite_petab_problem(
+                petab_problem=self.petab_problem,
+                t0=(
+                    t0 - self.fit_horizon
+                    if self.fit_horizon is not None
+                    else -np.inf
+                ),
+                t1=t0,
+                nominal_values=nominal_values,
+                index=self.finite_horizon_index,
+            )
+        return get_finite_control_petab_problem(
+            petab_problem=self.petab_problem,
+            t0=t0,
+            t1=t0 + self.horizon,
+            nominal_values=nominal_values,
+            index=self.finite_horizon_index,
+        )
+
+    def get_warm_start(
+        self,
+        window_problem: petab.Problem,
+        t0: float,
+        fit: bool,
+    ) -> np.ndarray:
+        """Get the start point of an optimization from previous estimates.
+
+        Args:
+            window_problem:
+                The PEtab problem of the optimization.
+            t0:
+                The start of the window.
+            fit:
+                Whether `window_problem` is the problem of the fit step, or
+                else of the control step.
+
+        Returns:
+            The start point, for all parameters, on parameter scale.
+        """
+        if fit:
+            estimates = self._fit_estimates
+        else:
+            estimates = shift_controls(
+                estimates=self._control_estimates,
+                parameter_df=self.petab_problem.parameter_df,
+                window_parameter_df=window_problem.parameter_df,
+                t0=t0,
+            )
+
+        x_ids = window_problem.x_ids
+        free_ids = set(window_problem.x_free_ids)
+        unscaled_guess = dict(zip(x_ids, window_problem.x_nominal))
+        unscaled_guess.update({
+            parameter_id: estimate
+            for parameter_id, estimate in estimates.items()
+            if parameter_id in free_ids
+        })
+        scaled_guess = window_problem.scale_parameters(unscaled_guess)
+        return np.array([scaled_guess[x_id] for x_id in x_ids])
+
+    def get_pypesto_problem(
+        self,
+        window_problem: petab.Problem,
+    ) -> 'pypesto.Problem':
+        """Get the pyPESTO problem of a window, with the shared objective.
+
+        The experimental data of the objective are replaced by the
+        measurements of the window.
+
+        Args:
+            window_problem:
+                The PEtab problem of the window.
+
+        Returns:
+            The pyPESTO problem, where the parameters that are not estimated
+            in the window are fixed to their nominal values.
+        """
+        import amici.petab_objective
+
+        self.objective.edatas = amici.petab_objective.create_edatas(
+            amici_model=self.amici_model,
+            petab_problem=window_problem,
+            simulation_conditions=self._simulation_conditions,
+        )
+        parameter_df = window_problem.parameter_df
+        return pypesto.Problem(
+            objective=self.objective,
+            lb=window_problem.lb_scaled,
+            ub=window_problem.ub_scaled,
+            x_fixed_indices=window_problem.x_fixed_indices,
+            x_fixed_vals=window_problem.x_nominal_fixed_scaled,
+            x_names=window_problem.x_ids,
+            x_scales=list(parameter_df[PARAMETER_SCALE]),
+            copy_objective=False,
+        )
+
+    def optimize(
+        self,
+        window_problem: petab.Problem,
+        timings: Dict[str, float],
+        t0: float,
+        fit: bool,
+    ):
+        """Optimize the estimated parameters of a window problem.
+
+        Args:
+            window_problem:
+                The PEtab problem.
+            timings:
+                The timings of the window. Edited in-place.
+            t0:
+                The start of the window.
+            fit:
+                Whether `window_problem` is the problem of the fit step, or
+                else of the control step.
+
+        Returns:
+            The pyPESTO result, and the estimates on linear scale.
+        """
+        label = 'fit' if fit else 'control'
+        start = time.perf_counter()
+        pypesto_problem = self.get_pypesto_problem(window_problem)
+        pypesto_problem.set_x_guesses([
+            self.get_warm_start(window_problem=window_problem, t0=t0, fit=fit)
+        ])
+        timings[f'{label}_setup'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = pypesto.optimize.minimize(
+            pypesto_problem,
+            n_starts=self.n_starts,
+            **self.minimize_kwargs,
+        )
+        timings[f'{label}_optimize'] = time.perf_counter() - start
+
+        scaled_estimates = dict(zip(
+            pypesto_problem.x_names,
+            result.optimize_result.list[0].x,
+        ))
+        estimates = window_problem.unscale_parameters({
+            parameter_id: scaled_estimates[parameter_id]
+            for parameter_id in window_problem.x_free_ids
+        })
+        if fit:
+            self._fit_estimates.update(estimates)
+        else:
+            self._control_estimates = estimates
+        return result, estimates
+
+    def run_window(self, t0: float) -> RecedingHorizonWindow:
+        """Fit, then control, then apply the controls of one window.
+
+        Args:
+            t0:
+                The start of the window.
+
+        Returns:
+            The results of the window.
+        """
+        window = RecedingHorizonWindow(t0=t0, t1=t0 + self.horizon)
+
+        fit_problem = self.get_window_problem(t0=t0, fit=True)
+        if is_optimizable(fit_problem):
+            window.fit_result, window.fit_parameters = self.optimize(
+                window_problem=fit_problem,
+                timings=window.timings,
+                t0=t0,
+                fit=True,
+            )
+            self.applied_parameters.update(window.fit_parameters)
+
+        control_problem = self.get_window_problem(t0=t0, fit=False)
+        if not is_optimizable(control_problem):
+            self.windows.append(window)
+            return window
+        window.control_result, window.control_parameters = self.optimize(
+            window_problem=control_problem,
+            timings=window.timings,
+            t0=t0,
+            fit=False,
+        )
+
+        # Apply the controls of the first step. Later controls in the
+        # horizon are only used as the warm start of the next window.
+        control_times = control_problem.parameter_df[CONTROL_TIME]
+        self.applied_parameters.update({
+            parameter_id: value
+            for parameter_id, value in window.control_parameters.items()
+            if control_times[parameter_id] < t0 + self.step
+        })
+
+        self.windows.append(window)
+        return window
+
+    def run(self, t0: float, t_end: float) -> List[RecedingHorizonWindow]:
+        """Run windows from some time until some other time.
+
+        Args:
+            t0:
+                The start of the first window.
+            t_end:
+                No window starts at or after this time.
+
+        Returns:
+            The results of the windows.
+        """
+        windows = []
+        for window_t0 in np.arange(t0, t_end, self.step):
+            windows.append(self.run_window(t0=float(window_t0)))
+        return windows
+
+    def get_timings_df(self) -> pd.DataFrame:
+        """Get the timings of all windows so far.
+
+        Returns:
+            The timings, with one row per window, indexed by window start.
+        """
+        return pd.DataFrame(
+            data=[window.timings for window in self.windows],
+            index=pd.Index(
+                [window.t0 for window in self.windows],
+                name='t0',
+            ),
+        )
+
+
+def is_optimizable(window_problem: petab.Problem) -> bool:
+    """Check whether a window problem has anything to optimize.
+
+    Args:
+        window_problem:
+            The PEtab problem of a fit or control step.
+
+    Returns:
+        Whether the problem has estimated parameters and measurements.
+    """
+    return bool(
+        window_problem.x_free_ids
+        and not window_problem.measurement_df.empty
+    )
+
+
+def shift_controls(
+    estimates: Dict[str, float],
+    parameter_df: pd.DataFrame,
+    window_parameter_df: pd.DataFrame,
+    t0: float,
+) -> Dict[str, float]:
+    """Shift the control estimates of the previous window by one step.
+
+    The controls of each controlled parameter are ordered by time. The
+    controls of the previous window before `t0` were applied in the last
+    step, so the `i`-th estimated control of the current window starts from
+    the `(i + n)`-th control of the previous window, where `n` is the number
+    of applied controls of the same controlled parameter. Controls after the
+    end of the previous window start from its last control.
+
+    Args:
+        estimates:
+            The control estimates of the previous window, on linear scale.
+        parameter_df:
+            The parameter table of the combined PEtab problem, with the
+            control times and targets.
+        window_parameter_df:
+            The parameter table of the current window.
+        t0:
+            The start of the current window.
+
+    Returns:
+        The start values of the estimated controls of the current window,
+        on linear scale.
+    """
+    if not estimates:
+        return {}
+    controls_df = parameter_df.loc[
+        parameter_df[CATEGORY] == CONTROL,
+        [CONTROL_TARGET, CONTROL_TIME],
+    ].sort_values(CONTROL_TIME, kind='stable')
+    window_estimated = window_parameter_df.loc[
+        window_parameter_df[ESTIMATE] == 1
+    ].index
+
+    shifted_estimates = {}
+    for _, target_df in controls_df.groupby(CONTROL_TARGET, sort=False):
+        previous_ids = [
+            parameter_id
+            for parameter_id in target_df.index
+            if parameter_id in estimates
+        ]
+        if not previous_ids:
+            continue
+        n_applied = int(
+            (target_df.loc[previous_ids, CONTROL_TIME] < t0).sum()
+        )
+        window_ids = target_df.index[target_df.index.isin(window_estimated)]
+        for position, parameter_id in enumerate(window_ids):
+            previous_id = previous_ids[
+                min(position + n_applied, len(previous_ids) - 1)
+            ]
+            shifted_estimates[parameter_id] = estimates[previous_id]
+    return shifted_estimates
@@ -1,8 +1,36 @@
+from functools import cached_property, lru_cache
+from typing import Dict, Iterable, Sequence, Union
+
 import libsbml
+from petab_timecourse.sbml import get_slug
 
 from .constants import TYPE_PATH, PARAMETER
 
 
+@lru_cache(maxsize=2**14)
+def parse_formula(formula: str) -> libsbml.ASTNode:
+    """Parse an SBML L3 formula.
+
+    Parsed formulae are cached, since many controls share the same trigger
+    or assignment formula. libsbml copies the AST when it is set as the math
+    of an element, so the cached AST is not shared between elements, but
+    should not be edited.
+
+    Args:
+        formula:
+            The formula.
+
+    Returns:
+        The AST of the formula.
+    """
+    ast = libsbml.parseL3Formula(formula)
+    if ast is None:
+        raise ValueError(
+            f'Invalid formula `{formula}`: {libsbml.getLastParseL3Error()}'
+        )
+    return ast
+
+
 def add_parameter(
     sbml_model: libsbml.Model,
     parameter_id: str,
@@ -14,6 +42,7 @@ def add_parameter(
     parameter.setId(parameter_id)
     parameter.setValue(initial_value)
     parameter.setConstant(constant)
+    return parameter
 
 
 def add_assignment_rule(
@@ -24,9 +53,93 @@ def add_assignment_rule(
 ):
     rule = sbml_model.createAssignmentRule()
     rule.setVariable(target_id)
-    rule.setMath(libsbml.parseL3Formula(formula))
+    rule.setMath(parse_formula(formula))
     if fix_parameter_definition:
         sbml_model.getParameter(target_id).setConstant(False)
+    return rule
+
+
+def get_time_trigger_formula(time: Union[float, str]) -> str:
+    """Get a trigger formula that is true from some fixed time onwards.
+
+    The formula only depends on time and a numeric literal or parameter, so
+    AMICI can handle it as an explicit time discontinuity, rather than as the
+    root of a state-dependent function.
+
+    Args:
+        time:
+            The trigger time, or the ID of the parameter that stores it.
+
+    Returns:
+        The trigger formula.
+    """
+    if isinstance(time, str):
+        return f'time >= {time}'
+    return f'time >= {float(time)}'
+
+
+def get_time_event_id(time: float) -> str:
+    """Get the ID of the event that applies all controls at some time.
+
+    Args:
+        time:
+            The event time.
+
+    Returns:
+        The event ID.
+    """
+    return f'control_event__time__{get_slug(time)}'
+
+
+def add_time_event(
+    sbml_model: libsbml.Model,
+    event_id: str,
+    time: Union[float, str],
+    assignments: Dict[str, str],
+) -> libsbml.Event:
+    """Add an event that is triggered at a fixed time.
+
+    Args:
+        sbml_model:
+            The SBML model.
+        event_id:
+            The event ID.
+        time:
+            The trigger time, or the ID of the parameter that stores it.
+        assignments:
+            Keys are the IDs of the assigned model entities, values are the
+            assigned formulae.
+
+    Returns:
+        The event.
+    """
+    event = sbml_model.createEvent()
+    event.setId(event_id)
+    event.setUseValuesFromTriggerTime(True)
+
+    trigger = event.createTrigger()
+    trigger.setInitialValue(True)
+    trigger.setPersistent(True)
+    trigger.setMath(parse_formula(get_time_trigger_formula(time)))
+
+    for variable, formula in assignments.items():
+        event_assignment = event.createEventAssignment()
+        event_assignment.setVariable(variable)
+        event_assignment.setMath(parse_formula(str(formula)))
+    return event
+
+
+def get_control_default_parameter_id(parameter_id: str) -> str:
+    """Get the ID of the parameter that stores the value before any control.
+
+    Args:
+        parameter_id:
+            The ID of the controlled parameter.
+
+    Returns:
+        The parameter ID.
+    """
+    return f'control_default__{parameter_id}'
 
 
 # FIXME request that users only supply SBML where the control parameters are already not constant?
@@ -35,20 +148,191 @@ def set_control_parameters_not_constant(
     petab_control_problem: 'petab_control.Problem',
     petab_problem: 'petab.Problem',
 ) -> None:
+    SbmlBatchEditor(petab_problem.sbml_model).set_not_constant(
+        petab_control_problem.control_parameter_df.index,
+    )
+
+
+# Elements where `getId` is the ID of the assigned variable.
+VARIABLE_ID_TYPE_CODES = {
+    libsbml.SBML_ALGEBRAIC_RULE,
+    libsbml.SBML_ASSIGNMENT_RULE,
+    libsbml.SBML_EVENT_ASSIGNMENT,
+    libsbml.SBML_INITIAL_ASSIGNMENT,
+    libsbml.SBML_RATE_RULE,
+}
+
+
+def is_indexed(element: libsbml.SBase) -> bool:
+    """Check whether an element can be found by its SId.
+
+    Args:
+        element:
+            The element.
+
+    Returns:
+        Whether the element has an SId that identifies it, rather than the
+        variable that it assigns.
+    """
+    return (
+        element.isSetId()
+        and element.getTypeCode() not in VARIABLE_ID_TYPE_CODES
+    )
+
+
+class SbmlBatchEditor():
+    """Add many elements to an SBML model, and find elements by SId.
+
+    Finding an element with `libsbml.Model.getElementBySId` walks the whole
+    model, so this class instead builds an index of all elements once.
+
+    Attributes:
+        sbml_model:
+            The SBML model.
+    """
+    def __init__(self, sbml_model: libsbml.Model):
+        """Set up the editor.
+
+        Args:
+            sbml_model:
+                See the class attributes.
+        """
+        self.sbml_model = sbml_model
+
+    @cached_property
+    def elements(self) -> Dict[str, libsbml.SBase]:
+        """The elements of the model, by SId.
+
+        Built on first use, then updated by the editor.
+        """
+        return {
+            element.getId(): element
+            for element in self.sbml_model.getListOfAllElements()
+            if is_indexed(element)
+        }
+
+    def _index(self, element: libsbml.SBase) -> None:
+        # Only update the index if it has already been built.
+        if 'elements' in self.__dict__ and is_indexed(element):
+            self.elements[element.getId()] = element
+
+    def get_element(self, sid: str) -> libsbml.SBase:
+        """Get an element by SId.
+
+        Args:
+            sid:
+                The SId.
+
+        Returns:
+            The element, or `None` if there is no element with the SId.
+        """
+        return self.elements.get(sid)
+
+    def add_parameters(
+        self,
+        parameter_ids: Sequence[str],
+        values: Union[float, Sequence[float]],
+        constant: Union[bool, Sequence[bool]] = True,
+    ) -> None:
+        """Add parameters.
+
+        Args:
+            parameter_ids:
+                The parameter IDs.
+            values:
+                The value of each parameter, or one value for all parameters.
+            constant:
+                Whether each parameter is constant, or one flag for all
+                parameters.
+        """
+        if not isinstance(values, Iterable):
+            values = [values] * len(parameter_ids)
+        if not isinstance(constant, Iterable):
+            constant = [constant] * len(parameter_ids)
+        for parameter_id, value, constant_ in zip(
+            parameter_ids,
+            values,
+            constant,
+        ):
+            self._index(add_parameter(
+                self.sbml_model,
+                parameter_id,
+                float(value),
+                constant=bool(constant_),
+            ))
+
+    def add_assignment_rules(
+        self,
+        target_ids: Sequence[str],
+        formulae: Sequence[str],
+    ) -> None:
+        """Add assignment rules to parameters.
+
+        Args:
+            target_ids:
+                The IDs of the assigned parameters, which are set to be not
+                constant.
+            formulae:
+                The formula of each rule.
+        """
+        for target_id, formula in zip(target_ids, formulae):
+            self._index(add_assignment_rule(
+                sbml_model=self.sbml_model,
+                target_id=target_id,
+                formula=formula,
+                fix_parameter_definition=False,
+            ))
+        self.set_not_constant(target_ids)
+
+    def add_time_events(
+        self,
+        event_ids: Sequence[str],
+        times: Sequence[Union[float, str]],
+        assignments: Sequence[Dict[str, str]],
+    ) -> None:
+        """Add events that are triggered at fixed times.
+
+        Args:
+            event_ids:
+                The event IDs.
+            times:
+                The trigger time of each event. See `add_time_event`.
+            assignments:
+                The assignments of each event. See `add_time_event`.
+        """
+        for event_id, time, event_assignments in zip(
+            event_ids,
+            times,
+            assignments,
+        ):
+            self._index(add_time_event(
+                sbml_model=self.sbml_model,
+                event_id=event_id,
+                time=time,
+                assignments=event_assignments,
+            ))
+
+    def set_not_constant(self, parameter_ids: Sequence[str]) -> None:
+        """Set parameters to be not constant.
 
-    for parameter_id in petab_control_problem.control_parameter_df.index:
-        parameter = petab_problem.sbml_model.getElementBySId(parameter_id)
-        # Perhaps misuse of this constant `PARAMETER`, currently means two things:
-        #    - a parameter in the control problem
-        #    - a parameter in the SBML model
-        if parameter.getElementName() != PARAMETER:
-            raise ValueError(
-                'A control parameter was specified that is not an SBML parameter. '
-                'Control parameter ID: {parameter_id}'
-            )
-        if parameter.setConstant(False) != 0:
-            raise ValueError(
-                'An unexpected error occurred while trying to set the control '
-                'parameter as not constant in the SBML model. Control parameter ID: '
-                f'{parameter_id}'
-            )
+        Args:
+            parameter_ids:
+                The parameter IDs.
+        """
+        for parameter_id in parameter_ids:
+            parameter = self.get_element(parameter_id)
+            # Perhaps misuse of this constant `PARAMETER`, currently means two
+            # things:
+            #    - a parameter in the control problem
+            #    - a parameter in the SBML model
+            if parameter is None or parameter.getElementName() != PARAMETER:
+                raise ValueError(
+                    'A control parameter was specified that is not an SBML '
+                    f'parameter. Control parameter ID: {parameter_id}'
+                )
+            if parameter.setConstant(False) != libsbml.LIBSBML_OPERATION_SUCCESS:
+                raise ValueError(
+                    'An unexpected error occurred while trying to set the '
+                    'control parameter as not constant in the SBML model. '
+                    f'Control parameter ID: {parameter_id}'
+                )
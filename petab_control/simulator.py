@@ -0,0 +1,627 @@
+"""Simulate control timecourses with AMICI, one simulation per period."""
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import amici
+from amici.petab_import import import_petab_problem
+import numpy as np
+import pandas as pd
+import petab
+from petab.C import (
+    LIN,
+    LOG,
+    LOG10,
+    MEASUREMENT,
+    NOISE_PARAMETERS,
+    NOMINAL_VALUE,
+    OBSERVABLE_ID,
+    OBSERVABLE_PARAMETERS,
+    PARAMETER_SCALE,
+    SIMULATION_CONDITION_ID,
+    TIME,
+)
+from petab_timecourse import Timecourse
+
+from .constants import (
+    FINAL_STATE,
+    LLH,
+    RDATAS,
+    SLLH,
+    SRES,
+    TYPE_PATH,
+)
+from .periods import (
+    Checkpoint,
+    PeriodSimulator,
+    get_sensitivity_columns,
+)
+from .petab import get_structural_hash
+
+
+AMICI_PARAMETER_SCALES = {
+    LIN: amici.ParameterScaling.none,
+    LOG: amici.ParameterScaling.ln,
+    LOG10: amici.ParameterScaling.log10,
+}
+
+
+def import_cached_petab_problem(
+    petab_problem: petab.Problem,
+    cache_dir: TYPE_PATH,
+    **kwargs,
+) -> 'amici.Model':
+    """Import a PEtab problem, reusing a compiled model if possible.
+
+    Compiled models are stored under a hash of the structural parts of the
+    PEtab problem. Problems that only differ in parameter values or
+    measurements, e.g. control problems created with
+    `get_structural_control_petab_problem` that only differ in control times
+    or values, reuse the same compiled model.
+
+    Args:
+        petab_problem:
+            The PEtab problem.
+        cache_dir:
+            The directory with compiled models.
+        **kwargs:
+            Passed to `amici.petab_import.import_petab_problem`.
+
+    Returns:
+        The AMICI model.
+    """
+    structural_hash = get_structural_hash(petab_problem)
+    model_name = f'{petab_problem.model.model_id}__{structural_hash[:16]}'
+    # AMICI loads the model instead of compiling it, if it already exists
+    # in the output directory.
+    return import_petab_problem(
+        petab_problem,
+        model_output_dir=str(Path(cache_dir) / model_name),
+        model_name=model_name,
+        **kwargs,
+    )
+
+
+class PeriodGradient(Mapping):
+    """The gradient of a period, as a view of a row of a gradient array.
+
+    Used in lean results of `ControlSimulator`, instead of a dictionary. Each
+    simulation writes into new arrays, so the row is not overwritten by later
+    simulations.
+
+    Attributes:
+        sllh:
+            The row of the gradient array.
+        columns:
+            Keys are the sensitivity parameter IDs of the period, values are
+            their columns in `sllh`.
+    """
+    def __init__(self, sllh: np.ndarray, columns: Dict[str, int]):
+        self.sllh = sllh
+        self.columns = columns
+
+    def __getitem__(self, parameter_id: str) -> float:
+        return float(self.sllh[self.columns[parameter_id]])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.columns)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+
+class ControlSimulator(PeriodSimulator):
+    """Simulate a PEtab timecourse with one AMICI simulation per period.
+
+    The state and state sensitivities at the end of each period are the
+    initial state and state sensitivities of the next period. See
+    `PeriodSimulator` for the prefix cache and the checkpoints.
+
+    Attributes:
+        petab_problem:
+            The PEtab problem, with a timecourse table.
+        timecourse:
+            The simulated timecourse.
+        period_end_times:
+            The end time of each period. For the last period, this is the
+            last measured timepoint.
+        sensitivity_parameter_ids:
+            The AMICI model parameters that sensitivities are computed for.
+        sensitivity_sources_periods:
+            Optionally, the sensitivity sources of each period, e.g. one
+            source per estimated control, which is only active in the
+            periods of the control. See
+            `petab_control.periods.get_sensitivity_columns`. Defaults to one
+            source per parameter in `sensitivity_parameter_ids`, which is
+            active in all periods.
+        lean_results:
+            Whether simulations only return the log-likelihood, gradient and
+            final state of each period, instead of the AMICI return data
+            with all trajectories. The gradients are views of
+            `sllh_periods`.
+        llh_periods:
+            The log-likelihood of each period, from the last simulation
+            with lean results. Each simulation has new arrays, such that
+            earlier results remain valid.
+        sllh_periods:
+            The gradient of each period, from the last simulation with lean
+            results, with one column per source in `sllh_parameter_ids`.
+        sllh_parameter_ids:
+            The sensitivity sources of the columns of `sllh_periods`.
+    """
+    def __init__(
+        self,
+        petab_problem: petab.Problem,
+        timecourse_id: str,
+        amici_model: 'amici.Model' = None,
+        amici_solver: 'amici.Solver' = None,
+        model_output_dir: TYPE_PATH = None,
+        prefix_period_count: int = 0,
+        model_cache_dir: TYPE_PATH = None,
+        checkpoint_max_bytes: int = 0,
+        lean_results: bool = False,
+    ):
+        """Set up the simulator.
+
+        Args:
+            petab_problem:
+                The PEtab problem.
+            timecourse_id:
+                The ID of the timecourse to simulate. The measurements of the
+                timecourse have this ID as their simulation condition ID.
+            amici_model:
+                The compiled AMICI model of the PEtab problem. Compiled from
+                the PEtab problem if not supplied.
+            amici_solver:
+                The AMICI solver. The default solver of the model, if not
+                supplied.
+            model_output_dir:
+                Where to compile the AMICI model, if it is not supplied.
+            prefix_period_count:
+                See `PeriodSimulator.prefix_period_count`.
+            model_cache_dir:
+                If supplied, and the AMICI model is not supplied, the model is
+                imported with `import_cached_petab_problem` from this
+                directory, instead of compiled into `model_output_dir`.
+            checkpoint_max_bytes:
+                See `PeriodSimulator.checkpoint_max_bytes`.
+            lean_results:
+                See the class attributes.
+        """
+        self.petab_problem = petab_problem
+        self.timecourse_id = timecourse_id
+        self.timecourse = Timecourse.from_df(
+            timecourse_df=petab_problem.timecourse_df,
+            timecourse_id=timecourse_id,
+        )
+
+        if amici_model is None and model_cache_dir is not None:
+            amici_model = import_cached_petab_problem(
+                petab_problem,
+                cache_dir=model_cache_dir,
+            )
+        if amici_model is None:
+            import_kwargs = {}
+            if model_output_dir is not None:
+                import_kwargs['model_output_dir'] = str(Path(model_output_dir))
+            amici_model = import_petab_problem(petab_problem, **import_kwargs)
+        if amici_solver is None:
+            amici_solver = amici_model.getSolver()
+        # The periods and sensitivity parameters are set below.
+        super().__init__(
+            amici_model=amici_model,
+            amici_solver=amici_solver,
+            amici_edata_periods=[],
+            period_start_times=[],
+            sensitivity_columns_periods=[],
+            sllh_size=0,
+            prefix_period_count=prefix_period_count,
+            checkpoint_max_bytes=checkpoint_max_bytes,
+        )
+
+        self.parameter_ids = list(amici_model.getParameterIds())
+        self.fixed_parameter_ids = list(amici_model.getFixedParameterIds())
+        self.observable_ids = list(amici_model.getObservableIds())
+        self._parameter_indices = {
+            parameter_id: index
+            for index, parameter_id in enumerate(self.parameter_ids)
+        }
+        self._fixed_parameter_indices = {
+            parameter_id: index
+            for index, parameter_id in enumerate(self.fixed_parameter_ids)
+        }
+
+        self.parameter_scales = [
+            (
+                petab_problem.parameter_df.loc[parameter_id, PARAMETER_SCALE]
+                if parameter_id in petab_problem.parameter_df.index
+                else LIN
+            )
+            for parameter_id in self.parameter_ids
+        ]
+        self.amici_parameter_scales = amici.parameterScalingFromIntVector([
+            int(AMICI_PARAMETER_SCALES[scale])
+            for scale in self.parameter_scales
+        ])
+
+        # Default values are the nominal values of the PEtab parameters
+        # table, else the values in the model.
+        self.default_parameters = np.array(
+            amici_model.getUnscaledParameters(),
+            dtype=float,
+        )
+        for parameter_id, nominal_value in (
+            petab_problem.parameter_df[NOMINAL_VALUE].items()
+        ):
+            if parameter_id in self._parameter_indices:
+                self.default_parameters[
+                    self._parameter_indices[parameter_id]
+                ] = nominal_value
+        self.default_fixed_parameters = np.array(
+            amici_model.getFixedParameters(),
+            dtype=float,
+        )
+
+        estimated_parameter_ids = set(petab_problem.x_free_ids)
+        self.sensitivity_parameter_ids = [
+            parameter_id
+            for parameter_id in self.parameter_ids
+            if parameter_id in estimated_parameter_ids
+        ]
+        self.sensitivity_sources_periods = None
+        self._sensitivity_sources_key = None
+
+        self.period_start_times, self.period_end_times = \
+            self._get_period_times()
+        self.amici_edata_periods = self._create_edata_periods()
+
+        self.lean_results = lean_results
+        self.llh_periods = np.empty(0)
+        self.sllh_periods = np.empty((0, 0))
+        self.sllh_parameter_ids = []
+
+    def _get_measurement_df(self) -> pd.DataFrame:
+        measurement_df = self.petab_problem.measurement_df
+        if SIMULATION_CONDITION_ID in measurement_df:
+            measurement_df = measurement_df.loc[
+                measurement_df[SIMULATION_CONDITION_ID] == self.timecourse_id
+            ]
+        for column in [OBSERVABLE_PARAMETERS, NOISE_PARAMETERS]:
+            if (
+                column in measurement_df
+                and measurement_df[column].notna().any()
+            ):
+                raise NotImplementedError(
+                    f'Measurements with `{column}` are not yet supported by '
+                    'the control simulator.'
+                )
+        return measurement_df
+
+    def _get_period_times(self) -> Tuple[np.ndarray, np.ndarray]:
+        durations = np.array(
+            [period.duration for period in self.timecourse.periods],
+            dtype=float,
+        )
+        start_times = np.concatenate([[0.0], np.cumsum(durations[:-1])])
+        end_times = start_times + durations
+        if not np.isfinite(end_times[-1]):
+            measurement_times = self._get_measurement_df()[TIME].to_numpy(
+                dtype=float,
+            )
+            end_times[-1] = max(
+                start_times[-1],
+                measurement_times.max(initial=start_times[-1]),
+            )
+        return start_times, end_times
+
+    def _create_edata_periods(self) -> List['amici.ExpData']:
+        """Create the AMICI experimental data of each period.
+
+        Each period has timepoints for its measurements, with repeated
+        timepoints for replicate measurements, and a final timepoint at the
+        end of the period, which provides the initial state of the next
+        period.
+        """
+        measurement_df = self._get_measurement_df()
+        times = measurement_df[TIME].to_numpy(dtype=float)
+        period_indices = np.searchsorted(
+            self.period_start_times,
+            times,
+            side='right',
+        ) - 1
+        observable_indices = pd.Index(self.observable_ids).get_indexer(
+            measurement_df[OBSERVABLE_ID]
+        )
+        if (observable_indices == -1).any():
+            raise ValueError(
+                'Some measurements are of observables that are not in the '
+                'model: '
+                f'{set(measurement_df[OBSERVABLE_ID][observable_indices == -1])}'
+            )
+        # Replicates of the same observable at the same time need separate
+        # timepoints.
+        replicate_indices = (
+            measurement_df
+            .groupby([TIME, OBSERVABLE_ID])
+            .cumcount()
+            .to_numpy()
+        )
+        measurements = measurement_df[MEASUREMENT].to_numpy(dtype=float)
+
+        amici_edata_periods = []
+        for period_index, end_time in enumerate(self.period_end_times):
+            in_period = period_indices == period_index
+            timepoints = sorted(set(zip(
+                times[in_period],
+                replicate_indices[in_period],
+            )))
+            timepoint_indices = {
+                timepoint: index
+                for index, timepoint in enumerate(timepoints)
+            }
+
+            observed_data = np.full(
+                (len(timepoints) + 1, len(self.observable_ids)),
+                np.nan,
+            )
+            for time, replicate_index, observable_index, measurement in zip(
+                times[in_period],
+                replicate_indices[in_period],
+                observable_indices[in_period],
+                measurements[in_period],
+            ):
+                observed_data[
+                    timepoint_indices[(time, replicate_index)],
+                    observable_index,
+                ] = measurement
+
+            amici_edata = amici.ExpData(self.amici_model.get())
+            amici_edata.setTimepoints([
+                *[time for time, _ in timepoints],
+                end_time,
+            ])
+            amici_edata.setObservedData(observed_data.flatten())
+            amici_edata.pscale = self.amici_parameter_scales
+            amici_edata_periods.append(amici_edata)
+        return amici_edata_periods
+
+    def replace_in_parameter_mapping(
+        self,
+        replacements: Dict[str, float],
+        scaled: bool = False,
+    ) -> None:
+        """Replace default parameter values.
+
+        Args:
+            replacements:
+                Keys are parameter IDs, values are parameter values.
+            scaled:
+                Whether the values are on parameter scale.
+        """
+        for parameter_id, value in replacements.items():
+            if parameter_id in self._parameter_indices:
+                index = self._parameter_indices[parameter_id]
+                if scaled:
+                    value = petab.unscale(value, self.parameter_scales[index])
+                self.default_parameters[index] = value
+            elif parameter_id in self._fixed_parameter_indices:
+                self.default_fixed_parameters[
+                    self._fixed_parameter_indices[parameter_id]
+                ] = value
+        self.checkpoints = []
+
+    def get_period_parameters(
+        self,
+        problem_parameters: Dict[str, float],
+        scaled_parameters: bool = True,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the AMICI parameter vectors of a period.
+
+        Args:
+            problem_parameters:
+                Keys are AMICI model parameter or fixed parameter IDs, values
+                are parameter values. Other keys are ignored.
+            scaled_parameters:
+                Whether the values of model parameters are on parameter scale.
+                Values of fixed parameters are always on linear scale.
+
+        Returns:
+            The model parameters on parameter scale, and the fixed parameters.
+        """
+        parameters = petab.map_scale(
+            self.default_parameters,
+            self.parameter_scales,
+        )
+        parameters = np.array(list(parameters), dtype=float)
+        fixed_parameters = self.default_fixed_parameters.copy()
+        for parameter_id, value in problem_parameters.items():
+            if parameter_id in self._parameter_indices:
+                index = self._parameter_indices[parameter_id]
+                if not scaled_parameters:
+                    value = petab.scale(value, self.parameter_scales[index])
+                parameters[index] = value
+            elif parameter_id in self._fixed_parameter_indices:
+                fixed_parameters[
+                    self._fixed_parameter_indices[parameter_id]
+                ] = value
+        return parameters, fixed_parameters
+
+    def get_sensitivity_sources(
+        self,
+        period_index: int,
+    ) -> Dict[str, Optional[str]]:
+        """Get the sensitivity sources of a period.
+
+        Args:
+            period_index:
+                The index of the period.
+
+        Returns:
+            Keys are source IDs, values are the model parameters that take
+            the values of the sources, or `None` for inactive sources. See
+            `sensitivity_sources_periods`.
+        """
+        if self.sensitivity_sources_periods is None:
+            return {
+                parameter_id: parameter_id
+                for parameter_id in self.sensitivity_parameter_ids
+            }
+        return self.sensitivity_sources_periods[period_index]
+
+    def _update_sensitivity_columns(self) -> None:
+        """Update the sensitivity columns of the periods, if they changed.
+
+        The columns of the gradient are all sensitivity sources of all
+        periods. Checkpoints of other sensitivity sources are discarded.
+        """
+        n_periods = len(self.timecourse.periods)
+        sensitivity_sources_periods = [
+            dict(self.get_sensitivity_sources(period_index))
+            for period_index in range(n_periods)
+        ]
+        key = tuple(
+            tuple(sensitivity_sources.items())
+            for sensitivity_sources in sensitivity_sources_periods
+        )
+        if key == self._sensitivity_sources_key:
+            return
+        self.sllh_parameter_ids = list(dict.fromkeys(
+            source_id
+            for sensitivity_sources in sensitivity_sources_periods
+            for source_id in sensitivity_sources
+        ))
+        self.sllh_size = len(self.sllh_parameter_ids)
+        self.sensitivity_columns_periods = get_sensitivity_columns(
+            sensitivity_sources_periods=sensitivity_sources_periods,
+            parameter_ids=self.parameter_ids,
+            sllh_source_ids=self.sllh_parameter_ids,
+        )
+        self._sensitivity_sources_key = key
+        self.checkpoints = []
+
+    def simulate(
+        self,
+        problem_parameters_periods: Sequence[Dict[str, float]],
+        scaled_parameters: bool = True,
+        control_parameters: Dict[str, Dict[str, Any]] = None,
+        lean_results: bool = None,
+    ) -> List[Dict[str, Any]]:
+        """Simulate the timecourse.
+
+        Args:
+            problem_parameters_periods:
+                The parameters of each period. See `get_period_parameters`.
+            scaled_parameters:
+                Whether the parameters are on parameter scale.
+            control_parameters:
+                Unused. For compatibility with `petab_timecourse` simulators.
+            lean_results:
+                Whether to return lean results. Defaults to `lean_results`.
+                For example, full results of the final solution of an
+                optimization with lean results.
+
+        Returns:
+            The results of each period, with the log-likelihood (`LLH`), the
+            log-likelihood gradient (`SLLH`) as a mapping with sensitivity
+            source IDs as keys, the state and state sensitivities at the end
+            of the period (`FINAL_STATE`), the residual sensitivities
+            (`SRES`) with one column per source in `SLLH`, and the AMICI
+            return data (`RDATAS`). The sensitivities in the AMICI return
+            data include the direct effects on inactive sources. See
+            `petab_control.periods.SensitivityColumns`. Lean results do
+            not have the residual sensitivities and the AMICI return data,
+            and their gradient is a `PeriodGradient` view of `sllh_periods`.
+            Periods after a failed simulation have a `nan` log-likelihood
+            and no gradient.
+        """
+        if lean_results is None:
+            lean_results = self.lean_results
+        self._update_sensitivity_columns()
+        checkpoints = self.simulate_periods(
+            parameters_periods=[
+                self.get_period_parameters(
+                    problem_parameters=problem_parameters,
+                    scaled_parameters=scaled_parameters,
+                )
+                for problem_parameters in problem_parameters_periods
+            ],
+            keep_rdatas=not lean_results,
+        )
+
+        n_periods = len(self.timecourse.periods)
+        if lean_results:
+            # Results of earlier simulations keep views of the old arrays.
+            self.llh_periods = np.full(n_periods, np.nan)
+            self.sllh_periods = np.zeros((n_periods, self.sllh_size))
+        return [
+            self._get_period_results(
+                period_index=period_index,
+                checkpoint=(
+                    checkpoints[period_index]
+                    if period_index < len(checkpoints)
+                    else None
+                ),
+                lean_results=lean_results,
+            )
+            for period_index in range(n_periods)
+        ]
+
+    def _get_period_results(
+        self,
+        period_index: int,
+        checkpoint: Checkpoint,
+        lean_results: bool,
+    ) -> Dict[str, Any]:
+        """Get the results of a period.
+
+        Args:
+            period_index:
+                The index of the period.
+            checkpoint:
+                The simulation of the period, or `None` if it was not
+                simulated.
+            lean_results:
+                Whether to return lean results.
+
+        Returns:
+            The results of the period. See `simulate`.
+        """
+        sensitivity_columns = self.sensitivity_columns_periods[period_index]
+        llh = np.nan
+        columns = {}
+        final_state = (None, None)
+        if checkpoint is not None:
+            llh = checkpoint.llh
+            if checkpoint.sllh is not None:
+                columns = dict(zip(
+                    self.get_sensitivity_sources(period_index),
+                    sensitivity_columns.sllh_columns.tolist(),
+                ))
+            if checkpoint.x is not None:
+                final_state = (checkpoint.x, checkpoint.sx)
+
+        if lean_results:
+            self.llh_periods[period_index] = llh
+            sllh = self.sllh_periods[period_index]
+            if columns:
+                sllh[:] = checkpoint.sllh
+            return {
+                LLH: llh,
+                SLLH: PeriodGradient(sllh=sllh, columns=columns),
+                FINAL_STATE: final_state,
+            }
+
+        period_results = {
+            LLH: llh,
+            SLLH: {
+                source_id: float(checkpoint.sllh[column])
+                for source_id, column in columns.items()
+            },
+            FINAL_STATE: final_state,
+            RDATAS: [checkpoint.rdata] if checkpoint is not None else [],
+        }
+        if columns and checkpoint.rdata.sres is not None:
+            period_results[SRES] = sensitivity_columns.subtract(
+                checkpoint.rdata.sres
+            )[:, :len(columns)]
+        return period_results
@@ -0,0 +1,209 @@
+import sys
+import types
+
+import pytest
+
+import fake_amici
+import fake_pypesto
+
+
+try:
+    import amici
+except ImportError:
+    # Tests of the simulator use the fake model, so only need the AMICI API.
+    amici = fake_amici
+    amici.petab_import = types.ModuleType('amici.petab_import')
+    amici.petab_objective = types.ModuleType('amici.petab_objective')
+
+    def import_petab_problem(*args, **kwargs):
+        raise NotImplementedError('Importing models requires AMICI.')
+
+    def simulate_petab(*args, **kwargs):
+        raise NotImplementedError('Simulating models requires AMICI.')
+
+    amici.petab_import.import_petab_problem = import_petab_problem
+    amici.petab_objective.simulate_petab = simulate_petab
+    sys.modules['amici'] = amici
+    sys.modules['amici.petab_import'] = amici.petab_import
+    sys.modules['amici.petab_objective'] = amici.petab_objective
+
+try:
+    import pypesto
+except ImportError:
+    # Tests of the receding-horizon controller only need the pyPESTO API.
+    pypesto = fake_pypesto
+    sys.modules['pypesto'] = pypesto
+    sys.modules['pypesto.optimize'] = pypesto.optimize
+    sys.modules['pypesto.petab'] = pypesto.petab
+
+
+@pytest.fixture
+def fake_amici_model(monkeypatch):
+    """The fake AMICI model, with the simulation functions of AMICI
+    replaced by those of `fake_amici`, if AMICI is installed.
+    """
+    if amici is not fake_amici:
+        for name in fake_amici.PATCHED_ATTRIBUTES:
+            monkeypatch.setattr(amici, name, getattr(fake_amici, name))
+    return fake_amici.getModel()
+
+
+@pytest.fixture
+def fake_pypesto_module(monkeypatch):
+    """The fake pyPESTO module, with the optimization of pyPESTO replaced
+    by that of `fake_pypesto`, if pyPESTO is installed.
+    """
+    fake_pypesto.reset()
+    if pypesto is not fake_pypesto:
+        for name, value in fake_pypesto.PATCHED_ATTRIBUTES.items():
+            monkeypatch.setattr(f'pypesto.{name}', value)
+    return fake_pypesto
+
+
+TIMECOURSE_ID = 'timecourse'
+
+
+@pytest.fixture
+def timecourse_petab_problem():
+    """A PEtab problem of the fake model, with a timecourse of four
+    periods and measurements in each period.
+    """
+    pytest.importorskip('petab_timecourse')
+    import pandas as pd
+    import petab
+    from petab.C import (
+        ESTIMATE,
+        MEASUREMENT,
+        NOMINAL_VALUE,
+        OBSERVABLE_ID,
+        PARAMETER_ID,
+        PARAMETER_SCALE,
+        SIMULATION_CONDITION_ID,
+        TIME,
+    )
+    from petab_timecourse import get_timecourse_df
+    from petab_timecourse.C import TIMECOURSE, TIMECOURSE_ID as TIMECOURSE_ID_
+
+    petab_problem = petab.Problem(
+        parameter_df=pd.DataFrame(
+            {
+                PARAMETER_SCALE: ['lin', 'log10', 'lin'],
+                NOMINAL_VALUE: [0.3, 0.5, 0.1],
+                ESTIMATE: [0, 1, 1],
+            },
+            index=pd.Index(['k1', 'k2', 'k3'], name=PARAMETER_ID),
+        ),
+        measurement_df=pd.DataFrame({
+            OBSERVABLE_ID: [
+                'obs1', 'obs2', 'obs1', 'obs1', 'obs2', 'obs1', 'obs2', 'obs1',
+            ],
+            SIMULATION_CONDITION_ID: [TIMECOURSE_ID] * 8,
+            TIME: [5.0, 5.0, 12.0, 12.0, 25.0, 31.0, 40.0, 40.0],
+            MEASUREMENT: [1.5, 2.2, 3.0, 3.1, 1.0, 4.0, 2.5, 4.4],
+        }),
+    )
+    petab_problem.timecourse_df = get_timecourse_df(pd.DataFrame({
+        TIMECOURSE_ID_: [TIMECOURSE_ID],
+        TIMECOURSE: ['0:original;10:control;20:control;30:control'],
+    }))
+    return petab_problem
+
+
+# The non-control parameters of each period of the timecourse.
+DEFAULT_PROBLEM_PARAMETERS_PERIODS = [
+    {'f1': 2.0},
+    {'f1': 2.0},
+    {'f1': 1.0},
+    {'f1': 1.0},
+]
+
+
+@pytest.fixture
+def control_problem(fake_amici_model, timecourse_petab_problem):
+    """A PEtab Control problem with a `ControlSimulator` of the timecourse.
+
+    `k2` has two estimated controls, `u1` and `u2`, in the second and third
+    periods, and a fixed control in the last period. The simulator is set
+    up as by `Problem.setup_simulator`, without importing a model.
+    """
+    import pandas as pd
+    from petab.C import (
+        ESTIMATE as ESTIMATE_COLUMN,
+        LOWER_BOUND,
+        MEASUREMENT,
+        NOISE_FORMULA,
+        NOMINAL_VALUE,
+        OBSERVABLE_FORMULA,
+        OBSERVABLE_ID,
+        PARAMETER_SCALE,
+        TIME,
+        UPPER_BOUND,
+    )
+
+    from petab_control.constants import (
+        CONTROL_ID,
+        ESTIMATE,
+        PARAMETER_ID,
+        VALUE,
+    )
+    from petab_control.problem import Problem
+    from petab_control.simulator import ControlSimulator
+
+    problem = Problem(
+        problem_id='control_problem',
+        control_df=pd.DataFrame({
+            CONTROL_ID: ['u1', 'u2', 'u3'],
+            PARAMETER_ID: ['k2', 'k2', 'k2'],
+            TIME: [10.0, 20.0, 30.0],
+            VALUE: [ESTIMATE, ESTIMATE, 0.1],
+        }),
+        control_parameter_df=pd.DataFrame(
+            {
+                PARAMETER_SCALE: ['log10'],
+                LOWER_BOUND: [1e-3],
+                UPPER_BOUND: [1e3],
+                NOMINAL_VALUE: [0.5],
+                ESTIMATE_COLUMN: [0],
+            },
+            index=pd.Index(['k2'], name=PARAMETER_ID),
+        ),
+        objective_observable_df=pd.DataFrame(
+            {OBSERVABLE_FORMULA: ['obs1'], NOISE_FORMULA: [1]},
+            index=pd.Index(['objective'], name=OBSERVABLE_ID),
+        ),
+        objective_measurement_df=pd.DataFrame({
+            OBSERVABLE_ID: ['objective'],
+            TIME: [40.0],
+            MEASUREMENT: [0.0],
+        }),
+    )
+
+    problem.simulator = ControlSimulator(
+        petab_problem=timecourse_petab_problem,
+        timecourse_id=TIMECOURSE_ID,
+        amici_model=fake_amici_model,
+    )
+    periods_parameters, problem.simulator_control_parameters = \
+        problem.get_periods_parameters()
+    problem.simulator_default_problem_parameters_periods = [
+        {
+            **default_problem_parameters,
+            **{
+                parameter_id: control_id
+                for parameter_id, control_id in period_parameters.items()
+                if control_id is not None
+            },
+        }
+        for default_problem_parameters, period_parameters in zip(
+            DEFAULT_PROBLEM_PARAMETERS_PERIODS,
+            periods_parameters,
+        )
+    ]
+    problem.simulator.sensitivity_sources_periods = \
+        problem.get_periods_sensitivity_sources(
+            sensitivity_parameter_ids=(
+                problem.simulator.sensitivity_parameter_ids
+            ),
+            n_periods=len(problem.simulator.timecourse.periods),
+        )
+    return problem
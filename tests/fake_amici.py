@@ -0,0 +1,293 @@
+"""A fake of the parts of AMICI that `petab_control` uses, for tests.
+
+The model has two states, which are also its observables, and a constant
+rate of change
+
+    dx/dt = STATE_DERIVATIVE @ [p, k],
+
+where `p` are the unscaled model parameters and `k` the fixed parameters.
+The initial state is `[p[0], 2]`. The noise is `1`, such that the
+log-likelihood is `-0.5 * sum(res ** 2)`, without the constant term.
+
+Simulations, state sensitivities and gradients are exact, so tests can
+compare gradients with finite differences, and no model is compiled.
+
+`conftest.py` registers this module as `amici` if AMICI is not installed.
+Else, the `fake_amici` fixture replaces the functions of `amici` that
+simulate.
+"""
+import importlib
+import sys
+from typing import Any, List, Sequence
+
+import numpy as np
+
+
+AMICI_SUCCESS = 0
+AMICI_ERROR = -1
+
+PARAMETER_IDS = ['k1', 'k2', 'k3']
+FIXED_PARAMETER_IDS = ['f1']
+OBSERVABLE_IDS = ['obs1', 'obs2']
+# The rate of change of the states, per unscaled model parameter and fixed
+# parameter.
+STATE_DERIVATIVE = np.array([
+    [0.3, -0.2, 0.5, 0.1],
+    [0.1, 0.4, -0.3, 0.2],
+])
+# Simulations fail if an unscaled model parameter is larger.
+MAX_PARAMETER_VALUE = 1e3
+
+# The number of simulations, e.g. to check that cached results are reused.
+simulation_count = 0
+
+
+class ParameterScaling:
+    none = 0
+    ln = 1
+    log10 = 2
+
+
+class SensitivityOrder:
+    none = 0
+    first = 1
+
+
+class SensitivityMethod:
+    none = 0
+    forward = 1
+    adjoint = 2
+
+
+def parameterScalingFromIntVector(scales: Sequence[int]) -> List[int]:
+    return [int(scale) for scale in scales]
+
+
+def unscale(value: float, scale: int) -> float:
+    if scale == ParameterScaling.ln:
+        return np.exp(value)
+    if scale == ParameterScaling.log10:
+        return 10 ** value
+    return value
+
+
+def get_unscale_derivative(value: float, scale: int) -> float:
+    """Get the derivative of the unscaled value by the scaled value."""
+    if scale == ParameterScaling.ln:
+        return np.exp(value)
+    if scale == ParameterScaling.log10:
+        return 10 ** value * np.log(10)
+    return 1.0
+
+
+class Model:
+    """The model, as returned by `getModel` of an AMICI model module."""
+    module = sys.modules[__name__]
+
+    def __init__(self):
+        self.t0 = 0.0
+        self.always_check_finite = False
+
+    def getParameterIds(self) -> List[str]:
+        return list(PARAMETER_IDS)
+
+    def getFixedParameterIds(self) -> List[str]:
+        return list(FIXED_PARAMETER_IDS)
+
+    def getObservableIds(self) -> List[str]:
+        return list(OBSERVABLE_IDS)
+
+    def getUnscaledParameters(self) -> List[float]:
+        return [1.0] * len(PARAMETER_IDS)
+
+    def getFixedParameters(self) -> List[float]:
+        return [1.0] * len(FIXED_PARAMETER_IDS)
+
+    def getT0(self) -> float:
+        return self.t0
+
+    def setT0(self, t0: float) -> None:
+        self.t0 = t0
+
+    def setAlwaysCheckFinite(self, always_check_finite: bool) -> None:
+        self.always_check_finite = always_check_finite
+
+    def getSolver(self) -> 'Solver':
+        return Solver()
+
+    def get(self) -> 'Model':
+        return self
+
+
+def getModel() -> Model:
+    return Model()
+
+
+class Solver:
+    def __init__(self):
+        self.sensitivity_order = SensitivityOrder.first
+        self.sensitivity_method = SensitivityMethod.forward
+        self.absolute_tolerance = 1e-16
+        self.relative_tolerance = 1e-8
+
+    def getSensitivityOrder(self) -> int:
+        return self.sensitivity_order
+
+    def setSensitivityOrder(self, sensitivity_order: int) -> None:
+        self.sensitivity_order = sensitivity_order
+
+    def getSensitivityMethod(self) -> int:
+        return self.sensitivity_method
+
+    def setSensitivityMethod(self, sensitivity_method: int) -> None:
+        self.sensitivity_method = sensitivity_method
+
+    def setAbsoluteTolerance(self, absolute_tolerance: float) -> None:
+        self.absolute_tolerance = absolute_tolerance
+
+    def setRelativeTolerance(self, relative_tolerance: float) -> None:
+        self.relative_tolerance = relative_tolerance
+
+
+class ExpData:
+    def __init__(self, other: Any = None):
+        self.timepoints = []
+        self.observed_data = []
+        self.parameters = []
+        self.fixedParameters = []
+        self.pscale = []
+        self.plist = []
+        self.x0 = []
+        self.sx0 = []
+        self.tstart_ = 0.0
+        if isinstance(other, ExpData):
+            for name, value in vars(other).items():
+                setattr(self, name, list(np.copy(value)) if isinstance(
+                    value, (list, np.ndarray)
+                ) else value)
+
+    def setTimepoints(self, timepoints: Sequence[float]) -> None:
+        self.timepoints = [float(time) for time in timepoints]
+
+    def getTimepoints(self) -> List[float]:
+        return list(self.timepoints)
+
+    def setObservedData(self, observed_data: Sequence[float]) -> None:
+        self.observed_data = [float(value) for value in observed_data]
+
+    def getObservedData(self) -> List[float]:
+        return list(self.observed_data)
+
+
+class ReturnData:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def runAmiciSimulation(
+    model: Model,
+    solver: Solver,
+    edata: ExpData,
+) -> ReturnData:
+    global simulation_count
+    simulation_count += 1
+
+    timepoints = np.array(edata.timepoints, dtype=float)
+    n_states = len(OBSERVABLE_IDS)
+    scaled_parameters = np.array(edata.parameters, dtype=float)
+    scales = list(edata.pscale) or [0] * len(scaled_parameters)
+    parameters = np.array([
+        unscale(value, scale)
+        for value, scale in zip(scaled_parameters, scales)
+    ])
+    derivatives = np.array([
+        get_unscale_derivative(value, scale)
+        for value, scale in zip(scaled_parameters, scales)
+    ])
+    plist = [int(index) for index in edata.plist]
+    sensitivities = solver.sensitivity_order >= SensitivityOrder.first
+
+    if not np.all(np.abs(parameters) <= MAX_PARAMETER_VALUE):
+        n_timepoints = len(timepoints)
+        return ReturnData(
+            status=AMICI_ERROR,
+            llh=np.nan,
+            sllh=None,
+            x=np.full((n_timepoints, n_states), np.nan),
+            sx=None,
+            res=np.full(n_timepoints * n_states, np.nan),
+            sres=None,
+        )
+
+    rate = STATE_DERIVATIVE @ np.concatenate([
+        parameters,
+        np.array(edata.fixedParameters, dtype=float),
+    ])
+    if len(edata.x0):
+        x0 = np.array(edata.x0, dtype=float)
+        sx0 = np.zeros((len(plist), n_states))
+    else:
+        x0 = np.array([parameters[0], 2.0])
+        sx0 = np.zeros((len(plist), n_states))
+        for row, index in enumerate(plist):
+            if index == 0:
+                sx0[row, 0] = derivatives[0]
+    if len(edata.sx0):
+        sx0 = np.array(edata.sx0, dtype=float).reshape(len(plist), n_states)
+
+    durations = timepoints - edata.tstart_
+    x = x0 + np.outer(durations, rate)
+    # Shape: (number of timepoints, number of sensitivity parameters,
+    # number of states).
+    sx = sx0 + np.einsum(
+        't,sp->tps',
+        durations,
+        STATE_DERIVATIVE[:, plist] * derivatives[plist],
+    )
+
+    data = np.array(edata.observed_data, dtype=float).reshape(
+        len(timepoints),
+        n_states,
+    )
+    measured = ~np.isnan(data)
+    res = (x - data)[measured]
+    # Shape: (number of residuals, number of sensitivity parameters).
+    sres = sx.transpose(0, 2, 1)[measured]
+    return ReturnData(
+        status=AMICI_SUCCESS,
+        llh=-0.5 * float(res @ res),
+        sllh=-(res @ sres) if sensitivities else None,
+        x=x,
+        sx=sx if sensitivities else None,
+        res=res,
+        sres=sres if sensitivities else None,
+    )
+
+
+def runAmiciSimulations(
+    model: Model,
+    solver: Solver,
+    edata_list: Sequence[ExpData],
+    failfast: bool = True,
+    num_threads: int = 1,
+) -> List[ReturnData]:
+    return [
+        runAmiciSimulation(model, solver, edata)
+        for edata in edata_list
+    ]
+
+
+def import_model_module(module_name: str, module_path: str):
+    if str(module_path) not in sys.path:
+        sys.path.insert(0, str(module_path))
+    return importlib.import_module(module_name)
+
+
+# Replaced in `amici` by the `fake_amici` fixture, if AMICI is installed.
+PATCHED_ATTRIBUTES = [
+    'ExpData',
+    'import_model_module',
+    'parameterScalingFromIntVector',
+    'runAmiciSimulation',
+    'runAmiciSimulations',
+]
@@ -0,0 +1,112 @@
+"""A fake of the parts of pyPESTO that `petab_control` uses, for tests.
+
+Nothing is simulated. Optimizations return their first guess, with each
+free parameter shifted by a different step, such that tests can follow
+estimates from one optimization to the next.
+
+`conftest.py` registers this module as `pypesto` if pyPESTO is not
+installed. Else, the `fake_pypesto_module` fixture replaces the attributes
+of `pypesto` that `petab_control` uses.
+"""
+import types
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+
+# The scaled estimate of the `i`-th free parameter is its guess plus
+# `(i + 1) * ESTIMATE_STEP`.
+ESTIMATE_STEP = 0.1
+
+# The importers and optimized problems, in order of creation.
+importers: List['PetabImporter'] = []
+minimized_problems: List['Problem'] = []
+
+
+class Objective:
+    def __init__(self, model: Any):
+        self.model = model
+        self.edatas = None
+
+
+class Problem:
+    def __init__(
+        self,
+        objective: Objective,
+        lb: Sequence[float],
+        ub: Sequence[float],
+        x_fixed_indices: Sequence[int] = None,
+        x_fixed_vals: Sequence[float] = None,
+        x_guesses: Sequence[Sequence[float]] = None,
+        x_names: Sequence[str] = None,
+        x_scales: Sequence[str] = None,
+        copy_objective: bool = True,
+    ):
+        self.objective = objective
+        self.lb_full = np.array(lb, dtype=float)
+        self.ub_full = np.array(ub, dtype=float)
+        self.x_fixed_indices = list(x_fixed_indices or [])
+        self.x_fixed_vals = list(x_fixed_vals or [])
+        self.x_guesses_full = np.array(x_guesses or [], dtype=float)
+        self.x_names = list(x_names)
+        self.x_scales = list(x_scales)
+        self.dim_full = len(self.lb_full)
+        self.x_free_indices = [
+            index
+            for index in range(self.dim_full)
+            if index not in self.x_fixed_indices
+        ]
+        # The experimental data when the problem was created, which is
+        # replaced for later problems of the same objective.
+        self.edatas = objective.edatas
+
+    def set_x_guesses(self, x_guesses: Sequence[Sequence[float]]) -> None:
+        self.x_guesses_full = np.array(x_guesses, dtype=float)
+
+
+class PetabImporter:
+    def __init__(self, petab_problem: Any, **kwargs):
+        self.petab_problem = petab_problem
+        self.kwargs = kwargs
+        self.model_count = 0
+        self.objective_count = 0
+        importers.append(self)
+
+    def create_model(self) -> object:
+        self.model_count += 1
+        return object()
+
+    def create_objective(self, model: Any = None) -> Objective:
+        self.objective_count += 1
+        return Objective(model=model)
+
+
+def minimize(problem: Problem, n_starts: int = 1, **kwargs):
+    minimized_problems.append(problem)
+    x = np.array(problem.x_guesses_full[0], dtype=float)
+    for position, index in enumerate(problem.x_free_indices):
+        x[index] += (position + 1) * ESTIMATE_STEP
+    x[problem.x_fixed_indices] = problem.x_fixed_vals
+    optimizer_result = types.SimpleNamespace(x=x)
+    return types.SimpleNamespace(
+        optimize_result=types.SimpleNamespace(list=[optimizer_result]),
+    )
+
+
+def reset() -> None:
+    importers.clear()
+    minimized_problems.clear()
+
+
+optimize = types.ModuleType('pypesto.optimize')
+optimize.minimize = minimize
+petab = types.ModuleType('pypesto.petab')
+petab.PetabImporter = PetabImporter
+
+# Replaced in `pypesto` by the `fake_pypesto_module` fixture, if pyPESTO
+# is installed.
+PATCHED_ATTRIBUTES: Dict[str, Any] = {
+    'Problem': Problem,
+    'optimize.minimize': minimize,
+    'petab.PetabImporter': PetabImporter,
+}
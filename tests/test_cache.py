@@ -0,0 +1,40 @@
+from petab_control.cache import get_files_hash, get_referenced_paths
+
+
+def test_get_referenced_paths_follows_yaml_references(tmp_path):
+    """References of referenced YAML files are included, once each."""
+    (tmp_path / 'petab').mkdir()
+    (tmp_path / 'problem.yaml').write_text(
+        'petab: petab/petab.yaml\n'
+        'control_files: [control.tsv]\n'
+    )
+    (tmp_path / 'petab' / 'petab.yaml').write_text(
+        'sbml_files: [model.xml]\n'
+        'parent: ../problem.yaml\n'
+    )
+    (tmp_path / 'petab' / 'model.xml').write_text('<sbml/>')
+    (tmp_path / 'control.tsv').write_text('')
+
+    paths = get_referenced_paths(tmp_path / 'problem.yaml')
+
+    assert paths == [
+        tmp_path / 'problem.yaml',
+        tmp_path / 'petab' / 'petab.yaml',
+        tmp_path / 'petab' / 'model.xml',
+        tmp_path / 'control.tsv',
+    ]
+
+
+def test_get_files_hash_changes_with_nested_references(tmp_path):
+    """Changes to files that are referenced by nested YAML files change the
+    hash.
+    """
+    (tmp_path / 'problem.yaml').write_text('petab: petab.yaml\n')
+    (tmp_path / 'petab.yaml').write_text('sbml_files: [model.xml]\n')
+    model_path = tmp_path / 'model.xml'
+    model_path.write_text('<sbml/>')
+
+    hash_ = get_files_hash([tmp_path / 'problem.yaml'])
+    model_path.write_text('<sbml level="3"/>')
+
+    assert get_files_hash([tmp_path / 'problem.yaml']) != hash_
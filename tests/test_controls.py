@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.constants import ESTIMATE
+from petab_control.controls import ControlSet
+
+
+def test_get_active_indices():
+    """The active control is the latest control of its target at or before
+    a timepoint, and the last of controls with the same time.
+    """
+    control_set = ControlSet(
+        target_ids=['k1', 'k2', 'k1', 'k1', 'k2'],
+        times=[10.0, 0.0, 0.0, 10.0, 20.0],
+        values=[1.0, ESTIMATE, 2.0, 3.0, 4.0],
+    )
+
+    active_indices = control_set.get_active_indices([-1.0, 0.0, 5.0, 10.0, 30.0])
+
+    np.testing.assert_array_equal(active_indices['k1'], [-1, 2, 2, 3, 3])
+    np.testing.assert_array_equal(active_indices['k2'], [-1, 1, 1, 1, 4])
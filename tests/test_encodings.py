@@ -0,0 +1,294 @@
+from pathlib import Path
+
+import libsbml
+import numpy as np
+import petab
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.constants import (
+    ENCODING_EVENTS,
+    ENCODING_SWITCH_CONDITIONS,
+    ENCODING_SWITCHES,
+    ENCODING_TIMECOURSE,
+)
+from petab_control.constants import ESTIMATE
+from petab_control.controls import ControlSet
+from petab_control.problem import (
+    Problem,
+    add_control_events,
+    get_control_events_petab_problem,
+)
+from petab_control.sbml import (
+    get_control_default_parameter_id,
+    get_time_event_id,
+)
+
+INPUT_PATH = (
+    Path(__file__).resolve().parent.parent
+    / 'doc' / 'examples' / 'input' / 'optimize_then_control' / 'petab'
+)
+TIMECOURSE_ID = 'timecourse1'
+TARGET_ID = 'influx'
+DEFAULT_VALUE = -1.0
+
+
+def get_petab_problem(
+    encoding: str,
+    consolidate_events: bool = False,
+) -> petab.Problem:
+    return get_control_events_petab_problem(
+        petab_control_problem=Problem.from_yaml(
+            INPUT_PATH / 'control' / 'petab_control_problem.yaml',
+        ),
+        petab_problem=petab.Problem.from_yaml(
+            str(INPUT_PATH / 'estimate' / 'petab_problem.yaml'),
+        ),
+        unscaled_parameters0={'decay': 0.5, 'substrate0': 1.0},
+        timecourse_id=TIMECOURSE_ID,
+        consolidate_events=consolidate_events,
+        encoding=encoding,
+    )
+
+
+def get_timecourse_conditions(petab_problem: petab.Problem):
+    """Get the time and condition of each timecourse period."""
+    return [
+        (float(time), dict(petab_problem.condition_df.loc[condition_id]))
+        for time, condition_id in (
+            period.split(':')
+            for period in petab_problem.timecourse_df.loc[
+                TIMECOURSE_ID,
+                'timecourse',
+            ].split(';')
+        )
+    ]
+
+
+def get_event_assignments(petab_problem: petab.Problem):
+    """Get the time and assignments of each event."""
+    events = []
+    for event in petab_problem.sbml_model.getListOfEvents():
+        trigger = libsbml.formulaToL3String(event.getTrigger().getMath())
+        events.append((
+            float(trigger.split('>=')[1]),
+            {
+                assignment.getVariable():
+                libsbml.formulaToL3String(assignment.getMath())
+                for assignment in event.getListOfEventAssignments()
+            },
+        ))
+    return sorted(events, key=lambda event: event[0])
+
+
+def get_values(changes, parameters, times, formula=None):
+    """Get the value of the target at each time.
+
+    Args:
+        changes:
+            The time and assigned values of each change.
+        parameters:
+            The values of the parameters that changes and the formula may
+            refer to.
+        times:
+            The times.
+        formula:
+            The formula of the target, in terms of assigned values. If
+            `None`, the target is assigned directly.
+    """
+    values = []
+    for time in times:
+        state = dict(parameters)
+        state.setdefault(TARGET_ID, DEFAULT_VALUE)
+        for change_time, assignments in changes:
+            if change_time > time:
+                break
+            state.update({
+                variable: float(eval(str(value), {}, parameters))
+                for variable, value in assignments.items()
+            })
+        if formula is not None:
+            state[TARGET_ID] = eval(formula, {}, state)
+        values.append(state[TARGET_ID])
+    return values
+
+
+def test_encodings_are_equivalent():
+    """All encodings apply the same control at any time."""
+    petab_problems = {
+        encoding: get_petab_problem(encoding)
+        for encoding in [
+            ENCODING_EVENTS,
+            ENCODING_TIMECOURSE,
+            ENCODING_SWITCHES,
+            ENCODING_SWITCH_CONDITIONS,
+        ]
+    }
+    sbml_model = petab_problems[ENCODING_SWITCHES].sbml_model
+    rng = np.random.default_rng(0)
+    # Estimated controls take random values. Events assign the values of
+    # fixed controls directly.
+    parameters = {
+        parameter.getId(): (
+            rng.uniform(1, 2)
+            if parameter.getId().endswith('__value__estimate')
+            else parameter.getValue()
+        )
+        for parameter in sbml_model.getListOfParameters()
+        if parameter.getId().startswith('control_parameter__')
+    }
+    # Switches are off before the first control.
+    parameters.update({
+        parameter.getId(): 0
+        for parameter in sbml_model.getListOfParameters()
+        if parameter.getId().startswith('switch_parameter__')
+    })
+    parameters[get_control_default_parameter_id(TARGET_ID)] = DEFAULT_VALUE
+    formula = libsbml.formulaToL3String(
+        sbml_model.getAssignmentRuleByVariable(TARGET_ID).getMath()
+    )
+    times = np.linspace(0, 100, 201)
+
+    expected = get_values(
+        changes=get_timecourse_conditions(
+            petab_problems[ENCODING_TIMECOURSE]
+        ),
+        parameters=parameters,
+        times=times,
+    )
+    assert len(set(expected)) > 3
+
+    np.testing.assert_allclose(
+        get_values(
+            changes=get_event_assignments(petab_problems[ENCODING_EVENTS]),
+            parameters=parameters,
+            times=times,
+        ),
+        expected,
+    )
+    np.testing.assert_allclose(
+        get_values(
+            changes=get_event_assignments(petab_problems[ENCODING_SWITCHES]),
+            parameters=parameters,
+            times=times,
+            formula=formula,
+        ),
+        expected,
+    )
+    np.testing.assert_allclose(
+        get_values(
+            changes=get_timecourse_conditions(
+                petab_problems[ENCODING_SWITCH_CONDITIONS]
+            ),
+            parameters=parameters,
+            times=times,
+            formula=formula,
+        ),
+        expected,
+    )
+
+
+def test_consolidated_events_are_equivalent():
+    """Consolidated events apply the same controls, with one event per
+    control time.
+    """
+    petab_problem = get_petab_problem(ENCODING_EVENTS)
+    consolidated_petab_problem = get_petab_problem(
+        ENCODING_EVENTS,
+        consolidate_events=True,
+    )
+
+    event_ids = [
+        event.getId()
+        for event in consolidated_petab_problem.sbml_model.getListOfEvents()
+    ]
+    times = {time for time, _ in get_event_assignments(petab_problem)}
+    assert sorted(event_ids) == sorted(
+        get_time_event_id(time) for time in times
+    )
+    assert (
+        get_event_assignments(consolidated_petab_problem)
+        == get_event_assignments(petab_problem)
+    )
+
+
+def get_controls_sbml_document() -> libsbml.SBMLDocument:
+    sbml_document = libsbml.SBMLDocument(3, 2)
+    sbml_model = sbml_document.createModel()
+    for parameter_id in ['k1', 'k2']:
+        parameter = sbml_model.createParameter()
+        parameter.setId(parameter_id)
+        parameter.setConstant(False)
+    return sbml_document
+
+
+def test_consolidate_events():
+    """Controls at the same time are applied by one event, with one event
+    assignment per control.
+    """
+    control_set = ControlSet(
+        target_ids=['k1', 'k2', 'k1', 'k2'],
+        times=[0.0, 0.0, 10.0, 20.0],
+        values=[ESTIMATE, 2.0, 3.0, ESTIMATE],
+    )
+    sbml_document = get_controls_sbml_document()
+    sbml_model = sbml_document.getModel()
+
+    add_control_events(
+        sbml_model=sbml_model,
+        parameter_controls=control_set,
+        consolidate_events=True,
+    )
+
+    events = {
+        event.getId(): (
+            libsbml.formulaToL3String(event.getTrigger().getMath()),
+            {
+                assignment.getVariable():
+                libsbml.formulaToL3String(assignment.getMath())
+                for assignment in event.getListOfEventAssignments()
+            },
+        )
+        for event in sbml_model.getListOfEvents()
+    }
+    control_parameter_ids = control_set.control_parameter_ids
+    assert events == {
+        get_time_event_id(0.0): ('time >= 0', {
+            'k1': control_parameter_ids[0],
+            'k2': '2',
+        }),
+        get_time_event_id(10.0): ('time >= 10', {'k1': '3'}),
+        get_time_event_id(20.0): ('time >= 20', {
+            'k2': control_parameter_ids[3],
+        }),
+    }
+
+    unconsolidated_sbml_document = get_controls_sbml_document()
+    unconsolidated_sbml_model = unconsolidated_sbml_document.getModel()
+    add_control_events(
+        sbml_model=unconsolidated_sbml_model,
+        parameter_controls=control_set,
+    )
+    assert [
+        event.getId()
+        for event in unconsolidated_sbml_model.getListOfEvents()
+    ] == list(control_set.event_ids)
+
+
+def test_consolidate_events_duplicate_target():
+    """Several controls of a parameter at the same time are reported."""
+    control_set = ControlSet(
+        target_ids=['k1', 'k2', 'k1'],
+        times=[0.0, 0.0, 0.0],
+        values=[1.0, 2.0, 3.0],
+    )
+
+    sbml_document = get_controls_sbml_document()
+
+    with pytest.raises(ValueError, match='Parameter: k1. Time: 0.0.'):
+        add_control_events(
+            sbml_model=sbml_document.getModel(),
+            parameter_controls=control_set,
+            consolidate_events=True,
+        )
@@ -0,0 +1,50 @@
+import importlib
+import inspect
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+import petab_control
+
+
+def test_all_names_resolve():
+    """Every name in `__all__` is loaded by the lazy module attributes."""
+    for name in petab_control.__all__:
+        assert getattr(petab_control, name) is not None, name
+
+
+def test_problem_attributes_match_problem():
+    """`PROBLEM_ATTRIBUTES` lists the public classes and functions that are
+    defined in `problem`.
+    """
+    problem = importlib.import_module('petab_control.problem')
+    assert petab_control.PROBLEM_ATTRIBUTES == {
+        name
+        for name, value in vars(problem).items()
+        if not name.startswith('_')
+        and (inspect.isclass(value) or inspect.isfunction(value))
+        and value.__module__ == problem.__name__
+    }
+    for name, module in petab_control.LAZY_ATTRIBUTE_MODULES.items():
+        assert name in vars(
+            importlib.import_module(f'petab_control.{module}')
+        )
+
+
+def test_all_does_not_import_problem():
+    """`__all__` is available without importing heavy dependencies."""
+    output = subprocess.run(
+        [
+            sys.executable,
+            '-c',
+            'import sys, petab_control; petab_control.__all__; '
+            'print("petab_control.problem" in sys.modules)',
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    assert output.strip() == 'False'
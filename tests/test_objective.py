@@ -0,0 +1,524 @@
+from collections import OrderedDict
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import petab
+from petab.C import ESTIMATE
+import pytest
+import scipy.sparse
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.constants import (
+    FVAL,
+    GRAD,
+    HESS,
+    LLH,
+    RDATAS,
+    RES,
+    SENSITIVITY_METHOD_ADJOINT,
+    SENSITIVITY_METHOD_AUTO,
+    SENSITIVITY_METHOD_FORWARD,
+    SLLH,
+    SRES,
+)
+from petab_control.objective import (
+    CachedObjective,
+    GradientMapping,
+    choose_sensitivity_method,
+    get_encoded_gradient_mapping,
+    get_objective_state,
+    get_simulation_context,
+    simulate_encoded_objective,
+    simulate_objective,
+    simulate_objective_state,
+    simulate_objective_state_batch,
+)
+
+from petab_control.problem import (
+    Problem,
+    get_control_events_petab_problem,
+    get_start_time,
+)
+
+import fake_amici
+
+
+X_NAMES = ['u1', 'u2']
+X = np.array([0.2, -0.1])
+
+INPUT_PATH = (
+    Path(__file__).resolve().parent.parent
+    / 'doc' / 'examples' / 'input' / 'optimize_then_control' / 'petab'
+)
+
+
+def get_finite_difference_gradient(fun, x: np.ndarray, step: float = 1e-6):
+    return np.array([
+        (fun(x + step * direction) - fun(x - step * direction)) / (2 * step)
+        for direction in np.eye(len(x))
+    ])
+
+
+@pytest.mark.parametrize('restrict_sensitivities', [True, False])
+def test_gradient_of_controls_of_same_parameter(
+    control_problem,
+    restrict_sensitivities,
+):
+    """The gradient of two estimated controls of the same parameter matches
+    finite differences. Each control affects the periods after it through
+    the state.
+    """
+    control_problem.simulator.sensitivity_sources_periods = \
+        control_problem.get_periods_sensitivity_sources(
+            sensitivity_parameter_ids=(
+                control_problem.simulator.sensitivity_parameter_ids
+            ),
+            n_periods=len(control_problem.simulator.timecourse.periods),
+            restrict_sensitivities=restrict_sensitivities,
+        )
+
+    def fun(x):
+        return simulate_objective(
+            x=x,
+            petab_control_problem=control_problem,
+            x_names=X_NAMES,
+            sensitivities=False,
+        )[FVAL]
+
+    expected_gradient = get_finite_difference_gradient(fun, X)
+    # The second control only affects the last periods, so the gradient of
+    # the first control is wrong if its effect is not carried.
+    assert not np.isclose(expected_gradient[0], 0)
+
+    gradient = simulate_objective(
+        x=X,
+        petab_control_problem=control_problem,
+        x_names=X_NAMES,
+    )[GRAD]
+    np.testing.assert_allclose(gradient, expected_gradient, rtol=1e-5)
+
+    sllh = control_problem.simulate(dict(zip(X_NAMES, X)))[SLLH]
+    np.testing.assert_allclose(
+        [sllh[x_name] for x_name in X_NAMES],
+        -expected_gradient,
+        rtol=1e-5,
+    )
+
+
+def test_simulation_contexts_are_bounded(control_problem, monkeypatch):
+    """Only the most recently used simulators are kept in the process."""
+    from petab_control import objective
+
+    monkeypatch.setattr(objective, '_SIMULATION_CONTEXTS', OrderedDict())
+    monkeypatch.setattr(objective, 'SIMULATION_CONTEXTS_MAX_SIZE', 2)
+    objective_states = [
+        get_objective_state(
+            petab_control_problem=control_problem,
+            x_names=X_NAMES,
+        )
+        for _ in range(3)
+    ]
+
+    simulator = get_simulation_context(objective_states[0])
+    get_simulation_context(objective_states[1])
+    # Using the first simulator again makes the second the least recently
+    # used.
+    assert get_simulation_context(objective_states[0]) is simulator
+    get_simulation_context(objective_states[2])
+    assert list(objective._SIMULATION_CONTEXTS) == [
+        objective_states[0].key,
+        objective_states[2].key,
+    ]
+
+    # Dropped simulators are created again when required.
+    result = simulate_objective_state(
+        x=X,
+        objective_state=objective_states[1],
+    )
+    expected_result = simulate_objective(
+        x=X,
+        petab_control_problem=control_problem,
+        x_names=X_NAMES,
+    )
+    assert np.isclose(result[FVAL], expected_result[FVAL])
+    np.testing.assert_allclose(result[GRAD], expected_result[GRAD])
+    assert len(objective._SIMULATION_CONTEXTS) == 2
+
+
+def test_forward_sensitivities_by_default():
+    """Adjoint sensitivities are only used if requested."""
+    assert choose_sensitivity_method(
+        n_parameters=100,
+        n_states=1,
+    ) == SENSITIVITY_METHOD_FORWARD
+    assert choose_sensitivity_method(
+        n_parameters=100,
+        n_states=1,
+        sensitivity_method=SENSITIVITY_METHOD_AUTO,
+    ) == SENSITIVITY_METHOD_ADJOINT
+
+
+def test_cached_prefix_matches_uncached(control_problem):
+    """Objectives that start from the cached prefix have the results of
+    objectives that simulate all periods, and simulate the prefix once.
+    """
+    import fake_amici
+
+    xs = [X, np.array([0.5, 0.3])]
+    expected_results = [
+        simulate_objective(
+            x=x,
+            petab_control_problem=control_problem,
+            x_names=X_NAMES,
+        )
+        for x in xs
+    ]
+
+    control_problem.simulator.prefix_period_count = 1
+    objective_state = get_objective_state(
+        petab_control_problem=control_problem,
+        x_names=X_NAMES,
+    )
+    n_periods = len(control_problem.simulator.timecourse.periods)
+    for simulate in [
+        partial(
+            simulate_objective,
+            petab_control_problem=control_problem,
+            x_names=X_NAMES,
+        ),
+        partial(simulate_objective_state, objective_state=objective_state),
+    ]:
+        for index, (x, expected_result) in enumerate(
+            zip(xs, expected_results)
+        ):
+            simulation_count = fake_amici.simulation_count
+            result = simulate(x)
+            # Only the first simulation of each simulator includes the
+            # prefix.
+            assert (
+                fake_amici.simulation_count - simulation_count
+                == n_periods - (1 if index else 0)
+            )
+            assert np.isclose(result[FVAL], expected_result[FVAL])
+            np.testing.assert_allclose(result[GRAD], expected_result[GRAD])
+
+    result = simulate_objective_state_batch(
+        xs=np.array(xs),
+        objective_state=objective_state,
+    )
+    np.testing.assert_allclose(
+        result[FVAL],
+        [expected_result[FVAL] for expected_result in expected_results],
+    )
+    np.testing.assert_allclose(
+        result[GRAD],
+        [expected_result[GRAD] for expected_result in expected_results],
+    )
+
+
+@pytest.mark.parametrize('lean_results', [False, True])
+def test_gradient_matches_finite_differences(control_problem, lean_results):
+    """The gradients of the objective of the problem, of lean objective
+    states, and of batches, match finite differences.
+    """
+    control_problem.simulator.lean_results = lean_results
+    objective_state = get_objective_state(
+        petab_control_problem=control_problem,
+        x_names=X_NAMES,
+    )
+    xs = np.array([X, [0.5, 0.3], [-0.4, 0.6]])
+
+    def fun(x):
+        return simulate_objective(
+            x=x,
+            petab_control_problem=control_problem,
+            x_names=X_NAMES,
+            sensitivities=False,
+        )[FVAL]
+
+    expected_gradients = [
+        get_finite_difference_gradient(fun, x)
+        for x in xs
+    ]
+    for x, expected_gradient in zip(xs, expected_gradients):
+        for result in [
+            simulate_objective(
+                x=x,
+                petab_control_problem=control_problem,
+                x_names=X_NAMES,
+            ),
+            simulate_objective_state(x=x, objective_state=objective_state),
+        ]:
+            np.testing.assert_allclose(
+                result[GRAD],
+                expected_gradient,
+                rtol=1e-5,
+            )
+    np.testing.assert_allclose(
+        simulate_objective_state_batch(
+            xs=xs,
+            objective_state=objective_state,
+        )[GRAD],
+        expected_gradients,
+        rtol=1e-5,
+    )
+
+
+@pytest.mark.parametrize('gradient_on_demand', [False, True])
+def test_cached_objective_matches_uncached(
+    control_problem,
+    gradient_on_demand,
+):
+    """Cached objective results are the results of the simulation, and
+    each parameter vector is simulated once per required output.
+    """
+    simulate = partial(
+        simulate_objective,
+        petab_control_problem=control_problem,
+        x_names=X_NAMES,
+    )
+    objective_state = get_objective_state(
+        petab_control_problem=control_problem,
+        x_names=X_NAMES,
+    )
+    cached_objective = CachedObjective(
+        simulate=simulate,
+        max_size=2,
+        gradient_on_demand=gradient_on_demand,
+        simulate_batch=partial(
+            simulate_objective_state_batch,
+            objective_state=objective_state,
+        ),
+    )
+    expected_result = simulate(X)
+
+    assert np.isclose(cached_objective.fun(X), expected_result[FVAL])
+    np.testing.assert_allclose(
+        cached_objective.grad(X.copy()),
+        expected_result[GRAD],
+    )
+    fval, grad = cached_objective(X)
+    assert np.isclose(fval, expected_result[FVAL])
+    np.testing.assert_allclose(grad, expected_result[GRAD])
+    # Without the gradient on demand, the first call already computes the
+    # gradient.
+    assert cached_objective.misses == (2 if gradient_on_demand else 1)
+    assert cached_objective.hits == (1 if gradient_on_demand else 2)
+
+    # Batches only simulate parameter vectors without cached results, once
+    # each.
+    other_x = np.array([0.5, 0.3])
+    fvals, grads = cached_objective.evaluate_batch(
+        np.array([X, other_x, other_x]),
+    )
+    other_result = simulate(other_x)
+    np.testing.assert_allclose(
+        fvals,
+        [expected_result[FVAL], other_result[FVAL], other_result[FVAL]],
+    )
+    np.testing.assert_allclose(
+        grads,
+        [expected_result[GRAD], other_result[GRAD], other_result[GRAD]],
+    )
+    assert cached_objective.misses == (4 if gradient_on_demand else 3)
+    assert cached_objective.hits == (2 if gradient_on_demand else 3)
+
+    # The least recently used results are dropped.
+    cached_objective.fun(np.array([-0.4, 0.6]))
+    misses = cached_objective.misses
+    cached_objective(X)
+    assert cached_objective.misses == misses + 1
+
+
+def test_gauss_newton_hessian(control_problem):
+    """The Hessian is the Gauss-Newton approximation from the residuals and
+    residual sensitivities, which match finite differences.
+    """
+    simulate = partial(
+        simulate_objective,
+        petab_control_problem=control_problem,
+        x_names=X_NAMES,
+        residuals=True,
+    )
+    result = simulate(X)
+
+    np.testing.assert_allclose(result[HESS], result[SRES].T @ result[SRES])
+    # The noise of the fake model is `1`, without the constant term.
+    assert np.isclose(result[FVAL], 0.5 * np.sum(result[RES] ** 2))
+    np.testing.assert_allclose(result[GRAD], result[SRES].T @ result[RES])
+    step = 1e-6
+    np.testing.assert_allclose(
+        result[SRES],
+        np.array([
+            (
+                simulate(X + step * direction, sensitivities=False)[RES]
+                - simulate(X - step * direction, sensitivities=False)[RES]
+            ) / (2 * step)
+            for direction in np.eye(len(X))
+        ]).T,
+        rtol=1e-5,
+        atol=1e-8,
+    )
+
+    cached_objective = CachedObjective(simulate=simulate)
+    np.testing.assert_allclose(cached_objective.hess(X), result[HESS])
+    res, sres = cached_objective.res(X)
+    np.testing.assert_allclose(res, result[RES])
+    np.testing.assert_allclose(sres, result[SRES])
+    assert cached_objective.misses == 1
+
+
+def test_failed_simulation_gradient(control_problem):
+    """The gradient of a failed simulation is `nan`, like the objective
+    value.
+    """
+    objective_state = get_objective_state(
+        petab_control_problem=control_problem,
+        x_names=X_NAMES,
+    )
+    # The controls are on log10 scale.
+    x = np.array([np.log10(2 * fake_amici.MAX_PARAMETER_VALUE), 0.0])
+
+    result = simulate_objective_state(x=x, objective_state=objective_state)
+
+    assert np.isnan(result[FVAL])
+    assert result[GRAD].shape == X.shape
+    assert np.isnan(result[GRAD]).all()
+
+
+def test_failed_encoded_simulation_gradient(monkeypatch):
+    """The gradient of a failed simulation of an encoded problem is `nan`,
+    even if sensitivities of some simulation are available.
+    """
+    import amici.petab_objective
+
+    rdatas = [
+        fake_amici.ReturnData(status=fake_amici.AMICI_SUCCESS),
+        fake_amici.ReturnData(status=fake_amici.AMICI_ERROR),
+    ]
+    monkeypatch.setattr(
+        amici.petab_objective,
+        'simulate_petab',
+        lambda **kwargs: {LLH: -1.0, SLLH: {'k1': 1.0}, RDATAS: rdatas},
+    )
+    gradient_mapping = GradientMapping(
+        matrix=scipy.sparse.csr_matrix(np.eye(2)),
+        parameter_ids=['k1', 'k2'],
+    )
+
+    def simulate():
+        return simulate_encoded_objective(
+            x=X,
+            petab_problem=None,
+            amici_model=None,
+            amici_solver=fake_amici.Solver(),
+            gradient_mapping=gradient_mapping,
+        )
+
+    result = simulate()
+    assert np.isnan(result[FVAL])
+    assert np.isnan(result[GRAD]).all()
+
+    rdatas.pop()
+    result = simulate()
+    assert result[FVAL] == 1.0
+    np.testing.assert_array_equal(result[GRAD], [-1.0, 0.0])
+
+
+def test_encoded_gradient_mapping(monkeypatch):
+    """The gradient of an estimated control of an encoded problem is the sum
+    of the gradients of the parameters of its controls, which are found by
+    ID.
+    """
+    import amici.petab_objective
+
+    petab_control_problem = Problem.from_yaml(
+        INPUT_PATH / 'control' / 'petab_control_problem.yaml',
+    )
+    original_petab_problem = petab.Problem.from_yaml(
+        str(INPUT_PATH / 'estimate' / 'petab_problem.yaml'),
+    )
+    petab_problem = get_control_events_petab_problem(
+        petab_control_problem=petab_control_problem,
+        petab_problem=original_petab_problem,
+        unscaled_parameters0={'decay': 0.5, 'substrate0': 1.0},
+        timecourse_id='timecourse1',
+        consolidate_events=True,
+    )
+    assert 'timecourse' not in petab_problem.extensions_config
+    # The rows of the control parameters are not required to be first.
+    petab_problem.parameter_df = petab_problem.parameter_df.iloc[::-1]
+    # `influx_40` is applied at three times. The other controls are not
+    # estimated, or not optimized.
+    x_names = ['influx_40', 'other', 'influx_20', 'influx_80']
+    gradient_mapping = get_encoded_gradient_mapping(
+        petab_control_problem=petab_control_problem,
+        petab_problem=petab_problem,
+        x_names=x_names,
+        start_time=get_start_time(
+            petab_control_problem=petab_control_problem,
+            petab_problem=original_petab_problem,
+        ),
+    )
+
+    parameter_df = petab_problem.parameter_df
+    assert set(gradient_mapping.parameter_ids) == set(
+        parameter_df.index[
+            (parameter_df[ESTIMATE] == 1)
+            & parameter_df.index.str.startswith('control_parameter__')
+        ]
+    )
+    np.testing.assert_array_equal(
+        gradient_mapping.matrix.sum(axis=1).A1,
+        [3, 0, 1, 1],
+    )
+
+    # The encoded problem is simulated with the control parameters of each
+    # optimizer parameter, and the gradient is mapped back.
+    rng = np.random.default_rng(0)
+    targets = dict(zip(
+        gradient_mapping.parameter_ids,
+        rng.uniform(-1, 1, len(gradient_mapping.parameter_ids)),
+    ))
+
+    def simulate_petab(problem_parameters, **kwargs):
+        residuals = {
+            parameter_id: problem_parameters[parameter_id] - target
+            for parameter_id, target in targets.items()
+        }
+        return {
+            LLH: -0.5 * sum(
+                residual ** 2 for residual in residuals.values()
+            ),
+            SLLH: {
+                parameter_id: -residual
+                for parameter_id, residual in residuals.items()
+            },
+            RDATAS: [fake_amici.ReturnData(status=fake_amici.AMICI_SUCCESS)],
+        }
+
+    monkeypatch.setattr(
+        amici.petab_objective,
+        'simulate_petab',
+        simulate_petab,
+    )
+    simulate = partial(
+        simulate_encoded_objective,
+        petab_problem=petab_problem,
+        amici_model=None,
+        amici_solver=fake_amici.Solver(),
+        gradient_mapping=gradient_mapping,
+    )
+
+    x = rng.uniform(-1, 1, len(x_names))
+    np.testing.assert_allclose(
+        simulate(x)[GRAD],
+        get_finite_difference_gradient(
+            lambda x: simulate(x, sensitivities=False)[FVAL],
+            x,
+        ),
+        rtol=1e-6,
+        atol=1e-8,
+    )
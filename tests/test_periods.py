@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.periods import PeriodSimulator, get_sensitivity_columns
+from petab_control.simulator import ControlSimulator
+
+import fake_amici
+from conftest import TIMECOURSE_ID
+from test_simulator import get_problem_parameters_periods
+
+
+SENSITIVITY_PARAMETER_IDS = ['k2', 'k3']
+
+
+@pytest.fixture
+def control_simulator(fake_amici_model, timecourse_petab_problem):
+    return ControlSimulator(
+        petab_problem=timecourse_petab_problem,
+        timecourse_id=TIMECOURSE_ID,
+        amici_model=fake_amici_model,
+    )
+
+
+@pytest.fixture
+def period_simulator(control_simulator):
+    """A simulator of the periods of the timecourse, with a prefix and
+    checkpoints.
+    """
+    n_periods = len(control_simulator.timecourse.periods)
+    return PeriodSimulator(
+        amici_model=control_simulator.amici_model,
+        amici_solver=control_simulator.amici_solver,
+        amici_edata_periods=control_simulator.amici_edata_periods,
+        period_start_times=control_simulator.period_start_times,
+        sensitivity_columns_periods=get_sensitivity_columns(
+            sensitivity_sources_periods=[
+                {
+                    parameter_id: parameter_id
+                    for parameter_id in SENSITIVITY_PARAMETER_IDS
+                },
+            ] * n_periods,
+            parameter_ids=control_simulator.parameter_ids,
+            sllh_source_ids=SENSITIVITY_PARAMETER_IDS,
+        ),
+        sllh_size=len(SENSITIVITY_PARAMETER_IDS),
+        prefix_period_count=1,
+        checkpoint_max_bytes=None,
+    )
+
+
+def get_parameters_periods(control_simulator, c1: float, c2: float):
+    return [
+        control_simulator.get_period_parameters(problem_parameters)
+        for problem_parameters in get_problem_parameters_periods(c1=c1, c2=c2)
+    ]
+
+
+def test_batch_matches_serial(control_simulator, period_simulator):
+    """Batch simulations have the results of serial simulations, including
+    candidates with failed simulations.
+    """
+    # The third candidate fails in the third period, as `k2 = 1e4`.
+    controls = [(0.2, 0.4), (0.2, -0.1), (0.5, 4.0), (-0.3, 0.1)]
+    checkpoints_candidates = period_simulator.simulate_periods_batch([
+        get_parameters_periods(control_simulator, c1=c1, c2=c2)
+        for c1, c2 in controls
+    ])
+
+    assert len(checkpoints_candidates) == len(controls)
+    for (c1, c2), checkpoints in zip(controls, checkpoints_candidates):
+        expected_checkpoints = period_simulator.simulate_periods(
+            get_parameters_periods(control_simulator, c1=c1, c2=c2),
+        )
+        assert len(checkpoints) == len(expected_checkpoints)
+        for checkpoint, expected_checkpoint in zip(
+            checkpoints,
+            expected_checkpoints,
+        ):
+            assert checkpoint.key == expected_checkpoint.key
+            if np.isnan(expected_checkpoint.llh):
+                assert np.isnan(checkpoint.llh)
+                continue
+            assert np.isclose(checkpoint.llh, expected_checkpoint.llh)
+            np.testing.assert_allclose(
+                checkpoint.sllh,
+                expected_checkpoint.sllh,
+            )
+            np.testing.assert_allclose(checkpoint.x, expected_checkpoint.x)
+            np.testing.assert_allclose(checkpoint.sx, expected_checkpoint.sx)
+    assert len(checkpoints_candidates[2]) == 3
+
+
+def test_checkpoints_of_higher_sensitivity_order(
+    control_simulator,
+    period_simulator,
+):
+    """Checkpoints with sensitivities are restored for simulations without
+    sensitivities, but not the reverse.
+    """
+    amici_solver = period_simulator.amici_solver
+    parameters_periods = \
+        get_parameters_periods(control_simulator, c1=0.2, c2=0.4)
+    expected_checkpoints = period_simulator.simulate_periods(
+        parameters_periods,
+    )
+    simulation_count = fake_amici.simulation_count
+
+    amici_solver.setSensitivityOrder(fake_amici.SensitivityOrder.none)
+    checkpoints = period_simulator.simulate_periods(parameters_periods)
+    assert fake_amici.simulation_count == simulation_count
+    assert checkpoints == expected_checkpoints
+
+    # Only the last two periods have other parameters.
+    other_parameters_periods = \
+        get_parameters_periods(control_simulator, c1=0.2, c2=-0.1)
+    checkpoints = period_simulator.simulate_periods(other_parameters_periods)
+    assert fake_amici.simulation_count == simulation_count + 2
+    assert checkpoints[:2] == expected_checkpoints[:2]
+    assert [checkpoint.sensitivity_order for checkpoint in checkpoints] == [
+        fake_amici.SensitivityOrder.first,
+        fake_amici.SensitivityOrder.first,
+        fake_amici.SensitivityOrder.none,
+        fake_amici.SensitivityOrder.none,
+    ]
+    assert checkpoints[2].sllh is None
+
+    amici_solver.setSensitivityOrder(fake_amici.SensitivityOrder.first)
+    checkpoints = period_simulator.simulate_periods(other_parameters_periods)
+    assert fake_amici.simulation_count == simulation_count + 4
+    assert all(checkpoint.sllh is not None for checkpoint in checkpoints)
@@ -0,0 +1,191 @@
+from types import SimpleNamespace
+
+import libsbml
+import numpy as np
+import pandas as pd
+import petab
+from petab.C import (
+    CONDITION_ID,
+    ESTIMATE,
+    NOMINAL_VALUE,
+    OBSERVABLE_FORMULA,
+    OBSERVABLE_ID,
+    PARAMETER_ID,
+    PARAMETER_SCALE,
+)
+from petab.models.sbml_model import SbmlModel
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.controls import ControlSet
+from petab_control.petab import (
+    derive_petab_problem,
+    get_structural_hash,
+    parameter_controls_to_timecourse_new,
+)
+from petab_control.problem import ParameterControl
+
+
+@pytest.fixture
+def petab_problem():
+    sbml_document = libsbml.SBMLDocument(3, 1)
+    sbml_model = sbml_document.createModel()
+    sbml_model.setId('model')
+    for parameter_id in ['k1', 'k2']:
+        parameter = sbml_model.createParameter()
+        parameter.setId(parameter_id)
+        parameter.setValue(1)
+        parameter.setConstant(True)
+    return petab.Problem(
+        model=SbmlModel(
+            sbml_model=sbml_model,
+            sbml_document=sbml_document,
+            model_id='model',
+        ),
+        condition_df=pd.DataFrame(
+            {'k1': [1.0]},
+            index=pd.Index(['c0'], name=petab.C.CONDITION_ID),
+        ),
+        observable_df=pd.DataFrame(
+            {OBSERVABLE_FORMULA: ['k2']},
+            index=pd.Index(['obs'], name=OBSERVABLE_ID),
+        ),
+        parameter_df=pd.DataFrame(
+            {
+                PARAMETER_SCALE: ['lin'],
+                NOMINAL_VALUE: [1.0],
+                ESTIMATE: [1],
+            },
+            index=pd.Index(['k2'], name=PARAMETER_ID),
+        ),
+    )
+
+
+def test_get_structural_hash_covers_estimated_parameters(petab_problem):
+    """Estimated parameters change the hash, since AMICI compiles the other
+    parameters as constants, but nominal values do not.
+    """
+    hash_ = get_structural_hash(petab_problem)
+
+    renominalized_problem = derive_petab_problem(petab_problem)
+    renominalized_problem.parameter_df = \
+        petab_problem.parameter_df.assign(**{NOMINAL_VALUE: 2.0})
+    assert get_structural_hash(renominalized_problem) == hash_
+
+    fixed_problem = derive_petab_problem(petab_problem)
+    fixed_problem.parameter_df = \
+        petab_problem.parameter_df.assign(**{ESTIMATE: 0})
+    assert get_structural_hash(fixed_problem) != hash_
+
+
+def test_derive_petab_problem(petab_problem):
+    """Derived problems share tables until they are replaced, and clone the
+    model if required.
+    """
+    petab_problem.extensions_config = {'timecourse': {'format_version': 1}}
+    original_parameter_df = petab_problem.parameter_df
+
+    derived_problem = derive_petab_problem(petab_problem)
+    assert derived_problem.parameter_df is original_parameter_df
+    assert derived_problem.condition_df is petab_problem.condition_df
+
+    derived_problem.parameter_df = original_parameter_df.assign(
+        **{ESTIMATE: 0},
+    )
+    derived_problem.extensions_config.pop('timecourse')
+    derived_problem.sbml_model.getParameter('k1').setValue(2)
+    derived_problem.sbml_model.setId('derived')
+
+    assert petab_problem.parameter_df is original_parameter_df
+    assert (petab_problem.parameter_df[ESTIMATE] == 1).all()
+    assert 'timecourse' in petab_problem.extensions_config
+    assert petab_problem.sbml_model.getParameter('k1').getValue() == 1
+    assert petab_problem.sbml_model.getId() == 'model'
+    assert derived_problem.model.model_id == 'model'
+
+    shared_model_problem = derive_petab_problem(
+        petab_problem,
+        clone_model=False,
+    )
+    assert shared_model_problem.sbml_model is petab_problem.sbml_model
+
+
+def get_controls_at_timepoint_baseline(parameter_controls, timepoint):
+    """The active control of each parameter, as it was found, by scanning
+    the sorted controls of each parameter.
+    """
+    active_controls = {}
+    for parameter_id, controls in parameter_controls.items():
+        controls = sorted(controls, key=lambda control: control.time)
+        active_controls[parameter_id] = None
+        for control_index, control in enumerate(controls):
+            if control.time <= timepoint and (
+                control_index + 1 == len(controls)
+                or controls[control_index + 1].time > timepoint
+            ):
+                active_controls[parameter_id] = control
+                break
+    return active_controls
+
+
+def test_timecourse_conditions_match_scan(petab_problem):
+    """The condition of each control time assigns the active control of each
+    parameter, as found by a scan of the controls at each time.
+    """
+    parameter_controls = {
+        'k1': [
+            ParameterControl('k1', time=10.0, value=ESTIMATE),
+            ParameterControl('k1', time=0.0, value=1.0),
+            ParameterControl('k1', time=30.0, value=2.0),
+        ],
+        'k2': [
+            ParameterControl('k2', time=20.0, value=3.0),
+            ParameterControl('k2', time=30.0, value=ESTIMATE),
+            ParameterControl('k2', time=40.0, value=4.0),
+        ],
+    }
+    petab_control_problem = SimpleNamespace(
+        control_parameter_df=pd.DataFrame(
+            {
+                PARAMETER_SCALE: ['lin', 'log10'],
+                NOMINAL_VALUE: [1.0, 1.0],
+                ESTIMATE: [1, 1],
+            },
+            index=pd.Index(['k1', 'k2'], name=PARAMETER_ID),
+        ),
+    )
+    petab_problem.condition_df = pd.DataFrame(
+        {'k3': [5.0]},
+        index=pd.Index(['timecourse1'], name=CONDITION_ID),
+    )
+
+    control_set = ControlSet.from_parameter_controls(parameter_controls)
+    for controls in [parameter_controls, control_set]:
+        condition_df, _, timecourse_df = parameter_controls_to_timecourse_new(
+            parameter_controls=controls,
+            petab_problem=petab_problem,
+            petab_control_problem=petab_control_problem,
+            timecourse_id='timecourse1',
+        )
+
+        times = [0.0, 10.0, 20.0, 30.0, 40.0]
+        periods = timecourse_df.loc['timecourse1', 'timecourse'].split(';')
+        assert [float(period.split(':')[0]) for period in periods] == times
+        condition_ids = [period.split(':')[1] for period in periods]
+        assert list(condition_df.index) == [*condition_ids, 'timecourse1']
+        for time, condition_id in zip(times, condition_ids):
+            condition = condition_df.loc[condition_id]
+            assert condition['k3'] == 5.0
+            for parameter_id, control in get_controls_at_timepoint_baseline(
+                parameter_controls,
+                time,
+            ).items():
+                if control is None:
+                    assert pd.isna(condition[parameter_id])
+                else:
+                    assert (
+                        condition[parameter_id]
+                        == control.get_control_parameter_id()
+                    )
+        assert np.isnan(condition_df.loc['timecourse1', 'k3'])
@@ -0,0 +1,322 @@
+import copy
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import petab
+from petab.C import (
+    ESTIMATE,
+    LIN,
+    MEASUREMENT,
+    NOMINAL_VALUE,
+    OBSERVABLE_ID,
+    PARAMETER_ID,
+    PARAMETER_SCALE,
+    TIME,
+)
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.constants import (
+    CATEGORY,
+    CONTROL,
+    CONTROL_TIME,
+    ENCODING_EVENTS,
+    ENCODING_SWITCH_CONDITIONS,
+    ENCODING_SWITCHES,
+    ENCODING_TIMECOURSE,
+    ORIGINAL,
+)
+from petab_control.petab_problem import (
+    CATEGORY_DTYPE,
+    INCLUSIVE_OPTIONS,
+    FiniteHorizonIndex,
+    get_combined_petab_problem,
+    get_finite_control_petab_problem,
+    get_finite_petab_problem,
+)
+from petab_control.problem import Problem, get_control_events_petab_problem
+
+
+INPUT_PATH = (
+    Path(__file__).resolve().parent.parent
+    / 'doc' / 'examples' / 'input' / 'optimize_then_control' / 'petab'
+)
+CONTROL_YAML = INPUT_PATH / 'control' / 'petab_control_problem.yaml'
+PETAB_YAML = INPUT_PATH / 'estimate' / 'petab_problem.yaml'
+TIMECOURSE_ID = 'timecourse1'
+
+
+def get_baseline_finite_petab_problem(
+    petab_problem,
+    t0,
+    t1,
+    nominal_values,
+    inclusive,
+):
+    """`get_finite_petab_problem`, as it was with `pandas.Series.between`
+    masks.
+    """
+    petab_problem = copy.deepcopy(petab_problem)
+    petab_problem.parameter_df.loc[
+        petab_problem.parameter_df[CATEGORY] == CONTROL,
+        [ESTIMATE, NOMINAL_VALUE],
+    ] = 0
+    if nominal_values is not None:
+        petab_problem.parameter_df.update(
+            pd.Series(nominal_values, name=NOMINAL_VALUE)
+        )
+    measurement_df = petab_problem.measurement_df.loc[
+        petab_problem.measurement_df[TIME].between(t0, t1, inclusive=inclusive)
+    ]
+    petab_problem.measurement_df = measurement_df.loc[
+        measurement_df[CATEGORY] != CONTROL
+    ]
+    return petab_problem
+
+
+def get_baseline_finite_control_petab_problem(
+    petab_problem,
+    t0,
+    t1,
+    nominal_values,
+    inclusive,
+):
+    """`get_finite_control_petab_problem`, as it was with
+    `pandas.Series.between` masks.
+    """
+    petab_problem = copy.deepcopy(petab_problem)
+    parameter_df = petab_problem.parameter_df
+    parameter_df.loc[parameter_df[CATEGORY] == ORIGINAL, ESTIMATE] = 0
+    desired_control_times = parameter_df[CONTROL_TIME].between(
+        t0,
+        t1,
+        inclusive=inclusive,
+    )
+    parameter_df.loc[~desired_control_times, ESTIMATE] = 0
+    parameter_df.loc[~desired_control_times, NOMINAL_VALUE] = 0
+    if nominal_values is not None:
+        parameter_df.update(pd.Series(nominal_values, name=NOMINAL_VALUE))
+    measurement_df = petab_problem.measurement_df.loc[
+        petab_problem.measurement_df[TIME].between(t0, t1, inclusive=inclusive)
+    ]
+    petab_problem.measurement_df = measurement_df.loc[
+        measurement_df[CATEGORY] != ORIGINAL
+    ]
+    return petab_problem
+
+
+@pytest.fixture
+def combined_petab_problem():
+    """A combined PEtab problem, with unsorted and missing times, and
+    times on the window bounds.
+    """
+    parameter_df = pd.DataFrame(
+        {
+            PARAMETER_SCALE: LIN,
+            NOMINAL_VALUE: [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+            ESTIMATE: 1,
+            CATEGORY: [ORIGINAL, ORIGINAL, CONTROL, CONTROL, CONTROL, CONTROL],
+            CONTROL_TIME: [np.nan, np.nan, 20.0, 10.0, np.nan, 30.0],
+        },
+        index=pd.Index(
+            ['k1', 'k2', 'u_20', 'u_10', 'u_missing', 'u_30'],
+            name=PARAMETER_ID,
+        ),
+    ).astype({CATEGORY: CATEGORY_DTYPE})
+    measurement_df = pd.DataFrame({
+        OBSERVABLE_ID: 'obs',
+        TIME: [30.0, 10.0, np.nan, 20.0, 10.0, 5.0, 25.0, np.nan, 20.0],
+        MEASUREMENT: np.arange(9, dtype=float),
+        CATEGORY: [
+            ORIGINAL, ORIGINAL, ORIGINAL, ORIGINAL,
+            CONTROL, CONTROL, CONTROL, CONTROL, CONTROL,
+        ],
+    }).astype({CATEGORY: CATEGORY_DTYPE})
+    return petab.Problem(
+        parameter_df=parameter_df,
+        measurement_df=measurement_df,
+    )
+
+
+@pytest.mark.parametrize('inclusive', INCLUSIVE_OPTIONS)
+@pytest.mark.parametrize('t0, t1', [
+    (10.0, 20.0),
+    (-np.inf, 20.0),
+    (20.0, np.inf),
+    (12.0, 18.0),
+    (20.0, 10.0),
+])
+@pytest.mark.parametrize('nominal_values', [None, {'k1': 0.5, 'u_10': 0.7}])
+@pytest.mark.parametrize('get_finite, get_baseline', [
+    (get_finite_petab_problem, get_baseline_finite_petab_problem),
+    (
+        get_finite_control_petab_problem,
+        get_baseline_finite_control_petab_problem,
+    ),
+])
+def test_finite_windows_match_between_masks(
+    combined_petab_problem,
+    get_finite,
+    get_baseline,
+    t0,
+    t1,
+    nominal_values,
+    inclusive,
+):
+    """Windows of the sorted time index have the measurements, estimated
+    parameters and nominal values of `pandas.Series.between` masks.
+    """
+    expected_petab_problem = get_baseline(
+        combined_petab_problem,
+        t0=t0,
+        t1=t1,
+        nominal_values=nominal_values,
+        inclusive=inclusive,
+    )
+    parameter_df = combined_petab_problem.parameter_df.copy()
+    measurement_df = combined_petab_problem.measurement_df.copy()
+    for index in [None, FiniteHorizonIndex(combined_petab_problem)]:
+        petab_problem = get_finite(
+            combined_petab_problem,
+            t0=t0,
+            t1=t1,
+            nominal_values=nominal_values,
+            inclusive=inclusive,
+            index=index,
+        )
+        pd.testing.assert_frame_equal(
+            petab_problem.parameter_df,
+            expected_petab_problem.parameter_df,
+        )
+        pd.testing.assert_frame_equal(
+            petab_problem.measurement_df.sort_index(),
+            expected_petab_problem.measurement_df,
+        )
+        # Measurements are sorted by time.
+        assert petab_problem.measurement_df[TIME].is_monotonic_increasing
+
+    # The combined problem is not edited.
+    pd.testing.assert_frame_equal(
+        combined_petab_problem.parameter_df,
+        parameter_df,
+    )
+    pd.testing.assert_frame_equal(
+        combined_petab_problem.measurement_df,
+        measurement_df,
+    )
+
+
+def test_unknown_inclusive_option(combined_petab_problem):
+    with pytest.raises(ValueError, match='Unknown option'):
+        get_finite_petab_problem(
+            combined_petab_problem,
+            t0=0.0,
+            t1=10.0,
+            inclusive='all',
+        )
+
+
+def get_double_build_combined_petab_problem(encoding: str) -> petab.Problem:
+    """`get_combined_petab_problem`, as it was, with the control problem
+    built twice, and the original parameters of the control problem
+    dropped.
+    """
+    original_petab_problem = petab.Problem.from_yaml(str(PETAB_YAML))
+    original_parameter_df = original_petab_problem.parameter_df
+
+    def get_control_petab_problem():
+        return get_control_events_petab_problem(
+            petab_control_problem=Problem.from_yaml(yaml_path=CONTROL_YAML),
+            petab_problem=petab.Problem.from_yaml(str(PETAB_YAML)),
+            unscaled_parameters0=dict(original_parameter_df.loc[
+                original_parameter_df[ESTIMATE] == 1,
+                NOMINAL_VALUE,
+            ]),
+            timecourse_id=TIMECOURSE_ID,
+            consolidate_events=True,
+            encoding=encoding,
+        )
+
+    control_petab_problem = get_control_petab_problem()
+    combined_petab_problem = get_control_petab_problem()
+    combined_petab_problem.measurement_df = pd.concat([
+        original_petab_problem.measurement_df.assign(**{CATEGORY: ORIGINAL}),
+        control_petab_problem.measurement_df.assign(**{CATEGORY: CONTROL}),
+    ])
+    parameter_df = pd.concat([
+        original_parameter_df.assign(**{CATEGORY: ORIGINAL}),
+        control_petab_problem.parameter_df.assign(**{CATEGORY: CONTROL}),
+    ])
+    combined_petab_problem.parameter_df = \
+        parameter_df.loc[~parameter_df.index.duplicated()]
+    return combined_petab_problem
+
+
+@pytest.mark.parametrize('encoding', [
+    ENCODING_EVENTS,
+    ENCODING_TIMECOURSE,
+    ENCODING_SWITCHES,
+    ENCODING_SWITCH_CONDITIONS,
+])
+def test_combined_petab_problem_matches_double_build(encoding):
+    """The single pass has the tables of building the control problem
+    twice, with categorical categories.
+    """
+    combined_petab_problem = get_combined_petab_problem(
+        control_yaml=CONTROL_YAML,
+        petab_yaml=PETAB_YAML,
+        timecourse_id=TIMECOURSE_ID,
+        encoding=encoding,
+    )
+    expected_petab_problem = get_double_build_combined_petab_problem(encoding)
+
+    for table in ['measurement_df', 'parameter_df']:
+        df = getattr(combined_petab_problem, table)
+        assert df[CATEGORY].dtype == CATEGORY_DTYPE
+        expected_df = getattr(expected_petab_problem, table)
+        pd.testing.assert_frame_equal(
+            df.reset_index(drop=table == 'measurement_df'),
+            expected_df.reset_index(drop=table == 'measurement_df').astype(
+                {CATEGORY: CATEGORY_DTYPE}
+            ),
+        )
+    # The original parameters remain estimated.
+    parameter_df = combined_petab_problem.parameter_df
+    assert (parameter_df.loc[parameter_df[CATEGORY] == ORIGINAL, ESTIMATE]
+            == 1).all()
+    for table in ['condition_df', 'observable_df']:
+        pd.testing.assert_frame_equal(
+            getattr(combined_petab_problem, table),
+            getattr(expected_petab_problem, table),
+        )
+
+
+def test_combined_petab_problem_parameter_id_collision():
+    """Control parameters cannot have the IDs of original parameters."""
+    control_parameter_id = (
+        get_combined_petab_problem(
+            control_yaml=CONTROL_YAML,
+            petab_yaml=PETAB_YAML,
+            timecourse_id=TIMECOURSE_ID,
+        )
+        .parameter_df
+        .query(f'{CATEGORY} == "{CONTROL}"')
+        .index[0]
+    )
+    petab_problem = petab.Problem.from_yaml(str(PETAB_YAML))
+    parameter_df = petab_problem.parameter_df
+    petab_problem.parameter_df = pd.concat([
+        parameter_df,
+        parameter_df.iloc[[0]].rename(
+            index={parameter_df.index[0]: control_parameter_id},
+        ),
+    ])
+
+    with pytest.raises(ValueError, match=control_parameter_id):
+        get_combined_petab_problem(
+            control_yaml=CONTROL_YAML,
+            petab_yaml=petab_problem,
+            timecourse_id=TIMECOURSE_ID,
+        )
@@ -0,0 +1,408 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from petab.C import (
+    ESTIMATE,
+    LOWER_BOUND,
+    MEASUREMENT,
+    NOMINAL_VALUE,
+    NOISE_FORMULA,
+    OBSERVABLE_FORMULA,
+    OBSERVABLE_ID,
+    PARAMETER_SCALE,
+    TIME,
+    UPPER_BOUND,
+)
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.constants import CONTROL_ID, PARAMETER_ID, PERIODS, VALUE
+import petab_control.problem
+from petab_control.problem import Problem
+
+
+INPUT_PATH = (
+    Path(__file__).resolve().parent.parent
+    / 'doc' / 'examples' / 'input' / 'optimize_then_control' / 'petab'
+    / 'control'
+)
+
+
+@pytest.fixture
+def problem():
+    return Problem(
+        problem_id='problem',
+        control_df=pd.DataFrame({
+            CONTROL_ID: ['u1', 'u1', 'u2'],
+            PARAMETER_ID: ['k', 'k', 'k'],
+            TIME: [0.0, 10.0, 20.0],
+            VALUE: [ESTIMATE, ESTIMATE, 1.5],
+        }),
+        control_parameter_df=pd.DataFrame(
+            {
+                PARAMETER_SCALE: ['lin'],
+                LOWER_BOUND: [0.0],
+                UPPER_BOUND: [10.0],
+                NOMINAL_VALUE: [1.0],
+                ESTIMATE: [0],
+            },
+            index=pd.Index(['k'], name=PARAMETER_ID),
+        ),
+        objective_observable_df=pd.DataFrame(
+            {OBSERVABLE_FORMULA: ['x'], NOISE_FORMULA: [1]},
+            index=pd.Index(['obs'], name=OBSERVABLE_ID),
+        ),
+        objective_measurement_df=pd.DataFrame({
+            OBSERVABLE_ID: ['obs'],
+            TIME: [30.0],
+            MEASUREMENT: [1.0],
+        }),
+    )
+
+
+def test_derived_tables_follow_replaced_tables(problem):
+    """Derived tables are recomputed after the control tables are replaced,
+    or after in-place edits and `invalidate_cache`.
+    """
+    assert problem.parameter_df.loc['u2', NOMINAL_VALUE] == 1.5
+    assert len(problem.timecourse.periods) == 3
+    tables_version = problem.tables_version
+
+    problem.control_df = problem.control_df.assign(
+        **{VALUE: [ESTIMATE, ESTIMATE, 2.5], TIME: [0.0, 10.0, 30.0]},
+    )
+    assert problem.tables_version == tables_version + 1
+    assert problem.parameter_df.loc['u2', NOMINAL_VALUE] == 2.5
+    assert problem.timecourse.periods[1].duration == 20
+
+    problem.control_parameter_df = problem.control_parameter_df.assign(
+        **{UPPER_BOUND: 5.0},
+    )
+    assert (problem.parameter_df[UPPER_BOUND] == 5.0).all()
+
+    problem.control_df.loc[2, VALUE] = 3.5
+    problem.invalidate_cache()
+    assert problem.parameter_df.loc['u2', NOMINAL_VALUE] == 3.5
+
+
+def test_derived_tables_are_cached(problem, monkeypatch):
+    """Derived tables are computed once, and returned as shallow copies
+    that can be changed by replacement without affecting the cache.
+    """
+    n_calls = []
+    get_parameter_df = problem._get_parameter_df
+    monkeypatch.setattr(
+        problem,
+        '_get_parameter_df',
+        lambda: n_calls.append(1) or get_parameter_df(),
+    )
+
+    parameter_df = problem.parameter_df
+    assert problem.parameter_df is not parameter_df
+    assert len(n_calls) == 1
+
+    parameter_df[NOMINAL_VALUE] = 0.0
+    parameter_df.index = parameter_df.index.str.upper()
+    periods_parameters_map = problem.get_periods_parameters_map()
+    periods_parameters_map.periods_parameters = []
+
+    assert problem.parameter_df.loc['u2', NOMINAL_VALUE] == 1.5
+    assert len(problem.get_periods_parameters()[0]) == 3
+    assert len(n_calls) == 1
+
+
+def get_periods_parameters_baseline(
+    problem: Problem,
+    start_period_index: int,
+):
+    """`Problem.get_periods_parameters`, as it was, with one scan of the
+    controls table per period and control parameter.
+    """
+    time = 0
+    periods_parameters = []
+    control_parameters = {}
+    for period_index, period in enumerate(problem.timecourse.periods):
+        period_parameters = {
+            parameter_id: None
+            for parameter_id in problem.control_parameter_df.index
+        }
+        for parameter_id in period_parameters:
+            updates = problem.control_df.loc[
+                (problem.control_df[PARAMETER_ID] == parameter_id)
+                & (problem.control_df[TIME] == time)
+            ]
+            if updates.empty:
+                continue
+            if len(updates) > 1:
+                raise ValueError('Multiple controls.')
+            update = updates.iloc[0]
+            control_id = update[CONTROL_ID]
+            if control_id in control_parameters:
+                control_parameters[control_id][PERIODS].append(
+                    period_index + start_period_index,
+                )
+            else:
+                control_parameters[control_id] = {
+                    VALUE: update[VALUE],
+                    PERIODS: [period_index + start_period_index],
+                    PARAMETER_ID: parameter_id,
+                }
+            period_parameters[parameter_id] = control_id
+        time += period.duration
+        periods_parameters.append(period_parameters)
+    return periods_parameters, control_parameters
+
+
+@pytest.fixture
+def two_parameter_problem(problem):
+    """Two control parameters, with shared and distinct control times, and
+    a control that is applied in several periods.
+    """
+    problem.control_df = pd.DataFrame({
+        CONTROL_ID: ['v1', 'u1', 'u2', 'v1', 'u1', 'v2'],
+        PARAMETER_ID: ['m', 'k', 'k', 'm', 'k', 'm'],
+        TIME: [0.0, 0.0, 10.0, 15.0, 20.0, 20.0],
+        VALUE: [ESTIMATE, ESTIMATE, 1.5, ESTIMATE, ESTIMATE, 0.5],
+    })
+    problem.control_parameter_df = pd.concat([
+        problem.control_parameter_df,
+        problem.control_parameter_df.rename(index={'k': 'm'}),
+    ])
+    return problem
+
+
+@pytest.mark.parametrize('start_period_index', [0, 2])
+def test_periods_parameters_match_baseline(
+    two_parameter_problem,
+    start_period_index,
+):
+    """The grouped periods parameters map matches the per-(period,
+    parameter) scan.
+    """
+    problem = two_parameter_problem
+    expected_periods_parameters, expected_control_parameters = \
+        get_periods_parameters_baseline(
+            problem=problem,
+            start_period_index=start_period_index,
+        )
+
+    periods_parameters_map = problem.get_periods_parameters_map(
+        start_period_index=start_period_index,
+    )
+    assert (
+        periods_parameters_map.periods_parameters
+        == expected_periods_parameters
+    )
+    assert (
+        periods_parameters_map.control_parameters
+        == expected_control_parameters
+    )
+    assert (
+        list(periods_parameters_map.control_parameters)
+        == list(expected_control_parameters)
+    )
+
+    # The integer array encodes the same map, with unoffset periods.
+    assert periods_parameters_map.parameter_ids == ['k', 'm']
+    assert periods_parameters_map.control_ids == ['u1', 'v1', 'u2', 'v2']
+    np.testing.assert_array_equal(
+        periods_parameters_map.control_indices,
+        [
+            [0, 1],
+            [2, -1],
+            [-1, 1],
+            [0, 3],
+        ],
+    )
+    for period_parameters, period_control_indices in zip(
+        expected_periods_parameters,
+        periods_parameters_map.control_indices,
+    ):
+        assert period_parameters == {
+            parameter_id: (
+                periods_parameters_map.control_ids[control_index]
+                if control_index != -1
+                else None
+            )
+            for parameter_id, control_index in zip(
+                periods_parameters_map.parameter_ids,
+                period_control_indices,
+            )
+        }
+
+
+def test_periods_parameters_report_all_duplicates(two_parameter_problem):
+    """All controls of the same parameter and time are reported at once."""
+    problem = two_parameter_problem
+    problem.control_df = pd.concat(
+        [
+            problem.control_df,
+            pd.DataFrame({
+                CONTROL_ID: ['u3', 'v3'],
+                PARAMETER_ID: ['k', 'm'],
+                TIME: [10.0, 20.0],
+                VALUE: [2.0, 3.0],
+            }),
+        ],
+        ignore_index=True,
+    )
+
+    with pytest.raises(ValueError, match='same parameter and time') as error:
+        problem.get_periods_parameters_map()
+    message = str(error.value)
+    for control_id in ['u2', 'u3', 'v2', 'v3']:
+        assert control_id in message
+    for control_id in ['u1', 'v1']:
+        assert control_id not in message
+
+
+def test_periods_parameters_report_inconsistent_values(problem):
+    """A control with different values in different periods is reported."""
+    problem.control_df.loc[1, VALUE] = 2.0
+
+    with pytest.raises(ValueError, match='does not match'):
+        problem.get_periods_parameters_map()
+
+
+SPLIT_YAML = """\
+problems:
+  - problem_id: split
+    start_time: last_measured_timepoint
+    control:
+      control_files: [controls_0.tsv, controls_1.tsv]
+      control_parameter_files: [control_parameters.tsv]
+    objective:
+      measurement_files: [measurements_0.tsv, measurements_1.tsv]
+      observable_files: [observables_0.tsv, observables_1.tsv]
+  - problem_id: single
+    start_time: 10
+    control:
+      control_files: [controls_0.tsv]
+      control_parameter_files: [control_parameters.tsv]
+    objective:
+      measurement_files: [measurements_0.tsv]
+      observable_files: [observables_0.tsv]
+  - problem_id: duplicate
+    start_time: 0
+    control:
+      control_files: [controls_0.tsv]
+      control_parameter_files: [control_parameters.tsv]
+    objective:
+      measurement_files: [measurements_0.tsv]
+      observable_files: [observables_0.tsv, observables_0.tsv]
+"""
+
+
+@pytest.fixture
+def split_yaml_path(tmp_path):
+    """The example problem, with its tables split across files, and two
+    more problems.
+    """
+    for filename, split_filenames in {
+        'controls.tsv': ['controls_0.tsv', 'controls_1.tsv'],
+        'objective_measurements.tsv': [
+            'measurements_0.tsv',
+            'measurements_1.tsv',
+        ],
+        'objective_observables.tsv': [
+            'observables_0.tsv',
+            'observables_1.tsv',
+        ],
+    }.items():
+        lines = (INPUT_PATH / filename).read_text().splitlines()
+        header, rows = lines[0], lines[1:]
+        split_index = len(rows) // 2
+        for split_filename, split_rows in zip(
+            split_filenames,
+            [rows[:split_index], rows[split_index:]],
+        ):
+            (tmp_path / split_filename).write_text(
+                '\n'.join([header, *split_rows]) + '\n'
+            )
+    (tmp_path / 'control_parameters.tsv').write_text(
+        (INPUT_PATH / 'control_parameters.tsv').read_text()
+    )
+    yaml_path = tmp_path / 'problems.yaml'
+    yaml_path.write_text(SPLIT_YAML)
+    return yaml_path
+
+
+def test_from_yaml_concatenates_files(split_yaml_path):
+    """Tables that are split across files are read as one table."""
+    expected = Problem.from_yaml(INPUT_PATH / 'petab_control_problem.yaml')
+
+    problem = Problem.from_yaml(split_yaml_path, problem_id='split')
+
+    assert problem.problem_id == 'split'
+    # Rows of controls with multiple times share their index label, so
+    # the index of the controls table is not compared.
+    pd.testing.assert_frame_equal(
+        problem.control_df.reset_index(drop=True),
+        expected.control_df.reset_index(drop=True),
+    )
+    for table in [
+        'control_parameter_df',
+        'objective_observable_df',
+        'objective_measurement_df',
+    ]:
+        pd.testing.assert_frame_equal(
+            getattr(problem, table),
+            getattr(expected, table),
+        )
+    pd.testing.assert_frame_equal(problem.parameter_df, expected.parameter_df)
+
+
+def test_from_yaml_problem_ids(split_yaml_path):
+    """Problems are selected by ID, and duplicate IDs across the files of a
+    table are reported.
+    """
+    with pytest.raises(KeyError, match='Problem IDs'):
+        Problem.from_yaml(split_yaml_path)
+
+    problem = Problem.from_yaml(split_yaml_path, problem_id='single')
+    assert problem.start_time == 10
+    assert len(problem.control_df) == 2
+    assert list(problem.objective_observable_df.index) == [
+        'observable_substrate',
+    ]
+
+    with pytest.raises(ValueError, match='observable_substrate'):
+        Problem.from_yaml(split_yaml_path, problem_id='duplicate')
+
+
+def test_from_yaml_all_is_lazy(split_yaml_path, monkeypatch):
+    """Only the tables of accessed problems are read, once."""
+    read_paths = []
+    read_control_df = petab_control.problem.read_control_df
+
+    def read_control_df_(path):
+        read_paths.append(Path(path).name)
+        return read_control_df(path)
+
+    monkeypatch.setattr(
+        petab_control.problem,
+        'read_control_df',
+        read_control_df_,
+    )
+
+    problems = Problem.from_yaml_all(split_yaml_path)
+    assert list(problems) == ['split', 'single', 'duplicate']
+    assert len(problems) == 3
+    assert read_paths == []
+
+    problem = problems['single']
+    assert read_paths == ['controls_0.tsv']
+    assert problems['single'] is problem
+    assert read_paths == ['controls_0.tsv']
+
+    assert len(problems['split'].control_df) == 7
+    assert sorted(read_paths) == [
+        'controls_0.tsv',
+        'controls_0.tsv',
+        'controls_1.tsv',
+    ]
+
+    with pytest.raises(KeyError):
+        problems['missing']
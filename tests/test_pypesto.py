@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+amici = pytest.importorskip('amici')
+if amici.__name__ != 'amici':
+    # `conftest.py` registers the fake AMICI module if AMICI is not
+    # installed, which cannot import models.
+    pytest.skip('Requires AMICI.', allow_module_level=True)
+pypesto = pytest.importorskip('pypesto')
+if pypesto.__name__ != 'pypesto':
+    pytest.skip('Requires pyPESTO.', allow_module_level=True)
+petab_timecourse = pytest.importorskip('petab_timecourse')
+
+from petab_control.constants import (
+    SENSITIVITY_METHOD_ADJOINT,
+    SENSITIVITY_METHOD_FORWARD,
+)
+from petab_control.problem import Problem
+from petab_control.pypesto import get_pypesto_problem
+
+
+INPUT_PATH = (
+    Path(__file__).resolve().parent.parent
+    / 'doc' / 'examples' / 'input' / 'optimize_then_control' / 'petab'
+)
+TIMECOURSE_ID = 'timecourse1'
+ESTIMATED_PARAMETERS = {'decay': 1.0, 'substrate0': 0.8}
+
+
+def get_example_pypesto_problem(sensitivity_method: str, output_path: Path):
+    petab_problem = petab_timecourse.Problem.from_yaml(
+        str(INPUT_PATH / 'estimate' / 'petab_problem.yaml'),
+    )
+    petab_control_problem = Problem.from_yaml(
+        yaml_path=INPUT_PATH / 'control' / 'petab_control_problem.yaml',
+    )
+    return get_pypesto_problem(
+        petab_control_problem=petab_control_problem,
+        setup_simulator_kwargs={
+            'petab_problem': petab_problem,
+            'timecourse_id': TIMECOURSE_ID,
+            'default_problem_parameters': {
+                **ESTIMATED_PARAMETERS,
+                'influx': 0.1,
+            },
+            'solver_settings': {
+                'setAbsoluteTolerance': 1e-12,
+                'setRelativeTolerance': 1e-10,
+            },
+            'fix_petab_problem_parameters': ESTIMATED_PARAMETERS,
+        },
+        petab_importer_kwargs={
+            'output_folder': str(output_path / 'control'),
+            'validate_petab': False,
+        },
+        sensitivity_method=sensitivity_method,
+        adjoint_import_kwargs={
+            'model_output_dir': str(output_path / 'adjoint'),
+        },
+    )
+
+
+def test_forward_matches_adjoint(tmp_path):
+    """Forward sensitivities of the periods have the gradient of adjoint
+    sensitivities of the events-encoded problem.
+    """
+    forward_problem = get_example_pypesto_problem(
+        sensitivity_method=SENSITIVITY_METHOD_FORWARD,
+        output_path=tmp_path / 'forward',
+    )
+    adjoint_problem = get_example_pypesto_problem(
+        sensitivity_method=SENSITIVITY_METHOD_ADJOINT,
+        output_path=tmp_path / 'adjoint',
+    )
+    assert forward_problem.x_names == adjoint_problem.x_names
+
+    x = (forward_problem.lb + forward_problem.ub) / 2
+    fval, grad = forward_problem.objective(x, sensi_orders=(0, 1))
+    expected_fval, expected_grad = \
+        adjoint_problem.objective(x, sensi_orders=(0, 1))
+    assert np.isclose(fval, expected_fval, rtol=1e-6)
+    np.testing.assert_allclose(grad, expected_grad, rtol=1e-4, atol=1e-8)
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+import petab
+from petab.C import (
+    ESTIMATE,
+    LIN,
+    LOWER_BOUND,
+    MEASUREMENT,
+    NOMINAL_VALUE,
+    OBSERVABLE_ID,
+    PARAMETER_ID,
+    PARAMETER_SCALE,
+    SIMULATION_CONDITION_ID,
+    TIME,
+    UPPER_BOUND,
+)
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.constants import (
+    CATEGORY,
+    CONTROL,
+    CONTROL_TARGET,
+    CONTROL_TIME,
+    ORIGINAL,
+)
+from petab_control.petab_problem import CATEGORY_DTYPE
+from petab_control.receding_horizon import (
+    RecedingHorizonController,
+    shift_controls,
+)
+
+
+CONTROL_IDS = ['u_0', 'u_10', 'u_20', 'u_30']
+
+
+@pytest.fixture
+def combined_petab_problem():
+    """A combined PEtab problem with one original parameter, and controls
+    of one parameter every 10 time units.
+    """
+    parameter_df = pd.DataFrame(
+        {
+            PARAMETER_SCALE: LIN,
+            LOWER_BOUND: [0.0] + [-10.0] * 4,
+            UPPER_BOUND: 10.0,
+            NOMINAL_VALUE: [1.0] + [0.0] * 4,
+            ESTIMATE: 1,
+            CATEGORY: [ORIGINAL] + [CONTROL] * 4,
+            CONTROL_TARGET: [np.nan] + ['input'] * 4,
+            CONTROL_TIME: [np.nan, 0.0, 10.0, 20.0, 30.0],
+        },
+        index=pd.Index(['k', *CONTROL_IDS], name=PARAMETER_ID),
+    ).astype({CATEGORY: CATEGORY_DTYPE})
+    measurement_df = pd.DataFrame({
+        OBSERVABLE_ID: ['obs'] * 8,
+        SIMULATION_CONDITION_ID: 'condition',
+        TIME: [1.0, 5.0, 12.0, 25.0, 5.0, 15.0, 25.0, 35.0],
+        MEASUREMENT: 1.0,
+        CATEGORY: [ORIGINAL] * 4 + [CONTROL] * 4,
+    }).astype({CATEGORY: CATEGORY_DTYPE})
+    return petab.Problem(
+        parameter_df=parameter_df,
+        measurement_df=measurement_df,
+    )
+
+
+@pytest.fixture
+def create_edatas(monkeypatch):
+    """The experimental data of an objective are the measurements of the
+    window.
+    """
+    import amici.petab_objective
+
+    def create_edatas(amici_model, petab_problem, simulation_conditions):
+        return petab_problem.measurement_df
+    monkeypatch.setattr(
+        amici.petab_objective,
+        'create_edatas',
+        create_edatas,
+        raising=False,
+    )
+
+
+def test_shift_controls(combined_petab_problem):
+    """Controls start from the controls of the previous window, shifted by
+    the applied controls.
+    """
+    parameter_df = combined_petab_problem.parameter_df
+    window_parameter_df = parameter_df.assign(**{
+        ESTIMATE: [0, 0, 1, 1, 1],
+    })
+    # The previous window started at 0. The first control was applied, so
+    # the second control of the previous window is the first of this
+    # window.
+    assert shift_controls(
+        estimates={'u_0': 1.0, 'u_10': 2.0, 'u_20': 3.0},
+        parameter_df=parameter_df,
+        window_parameter_df=window_parameter_df,
+        t0=10.0,
+    ) == {'u_10': 2.0, 'u_20': 3.0, 'u_30': 3.0}
+    assert shift_controls(
+        estimates={},
+        parameter_df=parameter_df,
+        window_parameter_df=window_parameter_df,
+        t0=10.0,
+    ) == {}
+
+
+def test_window_loop(
+    combined_petab_problem,
+    fake_pypesto_module,
+    create_edatas,
+):
+    """Windows reuse one objective, are warm-started from the previous
+    window, and apply the controls of their first step.
+    """
+    step = fake_pypesto_module.ESTIMATE_STEP
+    controller = RecedingHorizonController(
+        petab_problem=combined_petab_problem,
+        step=10.0,
+        horizon=20.0,
+    )
+    windows = controller.run(t0=0.0, t_end=50.0)
+
+    assert len(fake_pypesto_module.importers) == 1
+    importer = fake_pypesto_module.importers[0]
+    assert importer.model_count == 1
+    assert importer.objective_count == 1
+    # The objective has all parameters, and windows fix parameters.
+    assert (importer.petab_problem.parameter_df[ESTIMATE] == 1).all()
+    assert all(
+        problem.objective is controller.objective
+        for problem in fake_pypesto_module.minimized_problems
+    )
+
+    assert [window.t0 for window in windows] == [0.0, 10.0, 20.0, 30.0, 40.0]
+    # There are no measurements before the first window, and no controls in
+    # the last window, so these steps are skipped.
+    assert windows[0].fit_result is None
+    assert windows[-1].control_result is None
+    assert len(fake_pypesto_module.minimized_problems) == 8
+
+    problems = iter(fake_pypesto_module.minimized_problems)
+    window_problems = [
+        (
+            next(problems) if window.fit_result is not None else None,
+            next(problems) if window.control_result is not None else None,
+        )
+        for window in windows
+    ]
+
+    # Windows use their measurements.
+    fit_problem, control_problem = window_problems[1]
+    assert list(fit_problem.edatas[TIME]) == [1.0, 5.0]
+    assert list(control_problem.edatas[TIME]) == [15.0, 25.0]
+
+    # The first window starts from the nominal values. Without a fit,
+    # the original parameter is zero in control windows, as in
+    # `get_finite_control_petab_problem`.
+    _, control_problem = window_problems[0]
+    assert control_problem.x_free_indices == [1, 2]
+    np.testing.assert_allclose(control_problem.x_guesses_full[0], 0)
+    assert windows[0].control_parameters == pytest.approx({
+        'u_0': step,
+        'u_10': 2 * step,
+    })
+
+    # The fit starts from the previous fit, and the controls from the
+    # controls of the previous window, shifted by one step. Applied controls
+    # are fixed.
+    for window_index, free_indices, previous_control_ids in [
+        (1, [2, 3], ['u_10', 'u_10']),
+        (2, [3, 4], ['u_20', 'u_20']),
+        (3, [4], ['u_30']),
+    ]:
+        previous_window = windows[window_index - 1]
+        fit_problem, control_problem = window_problems[window_index]
+        if window_index > 1:
+            np.testing.assert_allclose(
+                fit_problem.x_guesses_full[0][0],
+                previous_window.fit_parameters['k'],
+            )
+        assert control_problem.x_free_indices == free_indices
+        np.testing.assert_allclose(
+            control_problem.x_guesses_full[0][free_indices],
+            [
+                previous_window.control_parameters[control_id]
+                for control_id in previous_control_ids
+            ],
+        )
+
+    # Only the controls of the first step of each window are applied.
+    assert controller.applied_parameters == pytest.approx({
+        'k': windows[-1].fit_parameters['k'],
+        **{
+            control_id: window.control_parameters[control_id]
+            for control_id, window in zip(CONTROL_IDS, windows)
+        },
+    })
@@ -0,0 +1,90 @@
+import re
+
+import libsbml
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.sbml import SbmlBatchEditor, parse_formula
+
+
+@pytest.fixture
+def sbml_document():
+    sbml_document = libsbml.SBMLDocument(3, 2)
+    sbml_model = sbml_document.createModel()
+    compartment = sbml_model.createCompartment()
+    compartment.setId('cell')
+    compartment.setConstant(True)
+    species = sbml_model.createSpecies()
+    species.setId('x')
+    species.setCompartment('cell')
+    parameter = sbml_model.createParameter()
+    parameter.setId('k')
+    parameter.setConstant(True)
+    return sbml_document
+
+
+def test_index_follows_additions(sbml_document):
+    """Elements added by the editor are found without rebuilding the
+    index, and are the elements of the model.
+    """
+    sbml_model = sbml_document.getModel()
+    editor = SbmlBatchEditor(sbml_model)
+    assert set(editor.elements) == {'cell', 'x', 'k'}
+
+    editor.add_parameters(['p1', 'p2'], values=[1, 2], constant=False)
+    editor.add_time_events(
+        event_ids=['event1'],
+        times=[10.0],
+        assignments=[{'k': 'p1'}],
+    )
+    editor.add_assignment_rules(target_ids=['p2'], formulae=['2 * p1'])
+
+    # Rules and event assignments are not indexed by the IDs of the
+    # variables that they assign.
+    assert set(editor.elements) == {'cell', 'x', 'k', 'p1', 'p2', 'event1'}
+    for sid, element in editor.elements.items():
+        assert element.getId() == sid
+        assert element == sbml_model.getElementBySId(sid)
+    assert editor.get_element('p2').getTypeCode() == libsbml.SBML_PARAMETER
+    assert editor.get_element('p2').getValue() == 2
+    assert not editor.get_element('p2').getConstant()
+    assert editor.get_element('missing') is None
+
+    # The index matches an index that is built from the edited model.
+    assert (
+        set(SbmlBatchEditor(sbml_model).elements) == set(editor.elements)
+    )
+
+
+def test_index_is_built_lazily(sbml_document):
+    """Elements that are added before the index is built are found."""
+    editor = SbmlBatchEditor(sbml_document.getModel())
+    editor.add_parameters(['p'], values=0)
+
+    assert editor.get_element('p').getTypeCode() == libsbml.SBML_PARAMETER
+
+
+def test_set_not_constant(sbml_document):
+    """Only parameters can be set to be not constant."""
+    editor = SbmlBatchEditor(sbml_document.getModel())
+
+    editor.set_not_constant(['k'])
+    assert not editor.get_element('k').getConstant()
+
+    for sid in ['x', 'missing']:
+        with pytest.raises(ValueError, match=f'Control parameter ID: {sid}'):
+            editor.set_not_constant([sid])
+
+
+def test_parse_formula():
+    """Formulae are parsed once, and invalid formulae are reported."""
+    parse_formula.cache_clear()
+
+    ast = parse_formula('time >= 10')
+    assert libsbml.formulaToL3String(ast) == 'time >= 10'
+    assert parse_formula('time >= 10') is ast
+    assert parse_formula.cache_info().hits == 1
+
+    with pytest.raises(ValueError, match=re.escape('Invalid formula `1 +`')):
+        parse_formula('1 +')
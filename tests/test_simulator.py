@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('petab_timecourse')
+
+from petab_control.constants import LLH, RDATAS, SLLH
+from petab_control.simulator import ControlSimulator
+
+from conftest import TIMECOURSE_ID
+
+
+def get_problem_parameters_periods(c1: float, c2: float):
+    """Get the parameters of each period, with two values of `k2`, on
+    parameter scale.
+    """
+    return [
+        {'k1': 0.3, 'k2': -0.3, 'k3': 0.1, 'f1': 2.0},
+        {'k2': c1, 'f1': 2.0},
+        {'k2': c2, 'f1': 1.0},
+        {'k2': c2, 'f1': 1.0},
+    ]
+
+
+def get_values(periods_results):
+    return [
+        (period_results[LLH], dict(period_results[SLLH]))
+        for period_results in periods_results
+    ]
+
+
+def assert_values_equal(values, expected_values):
+    assert len(values) == len(expected_values)
+    for (llh, sllh), (expected_llh, expected_sllh) in zip(
+        values,
+        expected_values,
+    ):
+        assert np.isclose(llh, expected_llh)
+        assert sllh.keys() == expected_sllh.keys()
+        for parameter_id, value in sllh.items():
+            assert np.isclose(value, expected_sllh[parameter_id])
+
+
+def test_lean_results_survive_checkpoint_reuse(
+    fake_amici_model,
+    timecourse_petab_problem,
+):
+    """Lean results of a simulation are not overwritten by the next
+    simulation, which restarts from checkpoints.
+    """
+    simulator = ControlSimulator(
+        petab_problem=timecourse_petab_problem,
+        timecourse_id=TIMECOURSE_ID,
+        amici_model=fake_amici_model,
+        checkpoint_max_bytes=None,
+        lean_results=True,
+    )
+    reference_simulator = ControlSimulator(
+        petab_problem=timecourse_petab_problem,
+        timecourse_id=TIMECOURSE_ID,
+        amici_model=fake_amici_model,
+    )
+
+    periods_results = simulator.simulate(get_problem_parameters_periods(
+        c1=0.2,
+        c2=0.4,
+    ))
+    values = get_values(periods_results)
+    assert_values_equal(values, get_values(reference_simulator.simulate(
+        get_problem_parameters_periods(c1=0.2, c2=0.4),
+    )))
+
+    # Only the last periods change, so the first two periods are restored
+    # from checkpoints.
+    next_periods_results = simulator.simulate(get_problem_parameters_periods(
+        c1=0.2,
+        c2=-0.1,
+    ))
+    assert get_values(periods_results) == values
+    assert not np.isnan(simulator.llh_periods).any()
+    assert_values_equal(
+        get_values(next_periods_results),
+        get_values(reference_simulator.simulate(
+            get_problem_parameters_periods(c1=0.2, c2=-0.1),
+        )),
+    )
+
+
+@pytest.mark.parametrize('lean_results', [False, True])
+def test_checkpoint_restart_matches_full_run(
+    fake_amici_model,
+    timecourse_petab_problem,
+    lean_results,
+):
+    """Simulations that restart from the prefix and checkpoints have the
+    results of a full simulation.
+    """
+    import fake_amici
+
+    simulator = ControlSimulator(
+        petab_problem=timecourse_petab_problem,
+        timecourse_id=TIMECOURSE_ID,
+        amici_model=fake_amici_model,
+        prefix_period_count=1,
+        checkpoint_max_bytes=None,
+        lean_results=lean_results,
+    )
+    reference_simulator = ControlSimulator(
+        petab_problem=timecourse_petab_problem,
+        timecourse_id=TIMECOURSE_ID,
+        amici_model=fake_amici_model,
+        lean_results=lean_results,
+    )
+
+    simulator.simulate(get_problem_parameters_periods(c1=0.2, c2=0.4))
+    for c1, c2, expected_simulation_count in [
+        # Restarts from the end of the second period.
+        (0.2, -0.1, 2),
+        # Restarts from the end of the prefix.
+        (0.5, -0.1, 3),
+        # Restores all periods.
+        (0.5, -0.1, 0),
+    ]:
+        problem_parameters_periods = get_problem_parameters_periods(
+            c1=c1,
+            c2=c2,
+        )
+        simulation_count = fake_amici.simulation_count
+        periods_results = simulator.simulate(problem_parameters_periods)
+        assert (
+            fake_amici.simulation_count - simulation_count
+            == expected_simulation_count
+        )
+        expected_periods_results = \
+            reference_simulator.simulate(problem_parameters_periods)
+        assert_values_equal(
+            get_values(periods_results),
+            get_values(expected_periods_results),
+        )
+        if not lean_results:
+            for period_results, expected_period_results in zip(
+                periods_results,
+                expected_periods_results,
+            ):
+                np.testing.assert_allclose(
+                    period_results[RDATAS][0].res,
+                    expected_period_results[RDATAS][0].res,
+                )